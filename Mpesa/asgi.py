@@ -13,4 +13,22 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Mpesa.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from services_common import outbound  # noqa: E402  (needs configured settings)
+
+
+async def application(scope, receive, send):
+    """Django, plus ASGI lifespan handling: close the outbound async client on shutdown."""
+
+    if scope["type"] != "lifespan":
+        return await django_application(scope, receive, send)
+
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await outbound.areset_client()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
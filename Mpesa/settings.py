@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
+import importlib.util
 import os
 import sys
 from dotenv import load_dotenv
@@ -39,6 +40,13 @@ def _env_csv(name: str, default=None):
 INTERNAL_RATE_LIMIT_ENABLED = _env_bool("INTERNAL_RATE_LIMIT_ENABLED", default=True)
 INTERNAL_RATE_LIMIT_REQUESTS = int(os.getenv("INTERNAL_RATE_LIMIT_REQUESTS", "30"))
 INTERNAL_RATE_LIMIT_WINDOW_SECONDS = int(os.getenv("INTERNAL_RATE_LIMIT_WINDOW_SECONDS", "60"))
+# Per-scope overrides of INTERNAL_RATE_LIMIT_REQUESTS, e.g. "transactions:read=120,payments:write=30".
+# The tightest quota among a view's required OAuth scopes applies.
+RATE_LIMIT_SCOPE_QUOTAS = {
+    scope: int(value)
+    for scope, _, value in (item.partition("=") for item in _env_csv("RATE_LIMIT_SCOPE_QUOTAS"))
+    if scope.strip() and value.strip().isdigit()
+}
 INTERNAL_RATE_LIMIT_PATHS = _env_csv(
     "INTERNAL_RATE_LIMIT_PATHS",
     default=[
@@ -207,13 +215,121 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Content-addressed blob store (QR images; see services_common/blob_store.py). Swap the
+# "blobs" backend for any Django storage (e.g. S3) to move blobs off local disk.
+BLOB_STORAGE_ROOT = os.getenv("BLOB_STORAGE_ROOT", "").strip() or os.path.join(BASE_DIR, "var", "blobs")
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    "blobs": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "OPTIONS": {"location": BLOB_STORAGE_ROOT},
+    },
+}
+
+# Successful QR generation results, keyed by a hash of the request fields and
+# shortcode. A per-process LRU sits in front of the Django cache (see REDIS_URL).
+QR_CACHE_ENABLED = _env_bool("QR_CACHE_ENABLED", default=True)
+QR_CACHE_TTL_SECONDS = int(os.getenv("QR_CACHE_TTL_SECONDS", "86400"))
+QR_CACHE_MAX_ENTRIES = int(os.getenv("QR_CACHE_MAX_ENTRIES", "1024"))
 
-CACHES = {
-    "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-        "LOCATION": "mpesa-stk-api",
+
+# Per-process LocMemCache by default. Set REDIS_URL (requires the `redis`
+# package, pinned in requirements.txt) so cached Daraja tokens and rate-limit
+# counters are shared across gunicorn workers.
+REDIS_URL = os.getenv("REDIS_URL", "").strip()
+
+if REDIS_URL:
+    # Fail at startup rather than on the first cache access in every request.
+    if importlib.util.find_spec("redis") is None:
+        raise RuntimeError("REDIS_URL is set but the `redis` package is not installed (pip install -r requirements.txt)")
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+            "KEY_PREFIX": "mpesa-stk-api",
+        }
     }
-}
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "mpesa-stk-api",
+        }
+    }
+
+
+# Outbound HTTP (Daraja) connection pooling and timeouts.
+OUTBOUND_HTTP_POOL_CONNECTIONS = int(os.getenv("OUTBOUND_HTTP_POOL_CONNECTIONS", "10"))
+OUTBOUND_HTTP_POOL_MAXSIZE = int(os.getenv("OUTBOUND_HTTP_POOL_MAXSIZE", "20"))
+OUTBOUND_HTTP_POOL_BLOCK = _env_bool("OUTBOUND_HTTP_POOL_BLOCK", default=False)
+OUTBOUND_HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OUTBOUND_HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+OUTBOUND_HTTP_READ_TIMEOUT_SECONDS = float(os.getenv("OUTBOUND_HTTP_READ_TIMEOUT_SECONDS", "30"))
+
+# Route STK push, B2C/B2B single, QR generate, Ratiba create and transaction status
+# query to their `async def` views (awaiting Daraja through httpx). Enable under an
+# ASGI server (e.g. `uvicorn Mpesa.asgi:application`); under WSGI the sync views are faster.
+ASYNC_VIEWS_ENABLED = _env_bool("ASYNC_VIEWS_ENABLED", default=False)
+OUTBOUND_ASYNC_MAX_CONNECTIONS = int(os.getenv("OUTBOUND_ASYNC_MAX_CONNECTIONS", "100"))
+
+# Per-endpoint circuit breaker and adaptive (AIMD) in-flight limit for Daraja calls; while the
+# circuit is open, STK/B2C/B2B/QR/Ratiba submissions fail fast with 503 instead of tying up workers.
+UPSTREAM_BREAKER_ENABLED = _env_bool("UPSTREAM_BREAKER_ENABLED", default=True)
+UPSTREAM_BREAKER_WINDOW_SECONDS = float(os.getenv("UPSTREAM_BREAKER_WINDOW_SECONDS", "30"))
+UPSTREAM_BREAKER_MIN_REQUESTS = int(os.getenv("UPSTREAM_BREAKER_MIN_REQUESTS", "10"))
+UPSTREAM_BREAKER_ERROR_RATE = float(os.getenv("UPSTREAM_BREAKER_ERROR_RATE", "0.5"))
+UPSTREAM_BREAKER_SLOW_CALL_SECONDS = float(os.getenv("UPSTREAM_BREAKER_SLOW_CALL_SECONDS", "10"))
+UPSTREAM_BREAKER_OPEN_SECONDS = float(os.getenv("UPSTREAM_BREAKER_OPEN_SECONDS", "30"))
+UPSTREAM_CONCURRENCY_INITIAL = int(os.getenv("UPSTREAM_CONCURRENCY_INITIAL", "16"))
+UPSTREAM_CONCURRENCY_MIN = int(os.getenv("UPSTREAM_CONCURRENCY_MIN", "2"))
+UPSTREAM_CONCURRENCY_MAX = int(os.getenv("UPSTREAM_CONCURRENCY_MAX", "64"))
+
+# Async STK push: persist the intent, return 202 + tracking id, and call Daraja
+# from an in-process thread pool (0 workers = dispatch inline after commit).
+# Callers can also opt in per request with {"async": true}. Rows still
+# `dispatching` after STK_PUSH_DISPATCHING_TIMEOUT_SECONDS (worker died mid-call)
+# are marked `unknown` by `dispatch_stk_pushes`; keep it well above the read timeout.
+STK_PUSH_ASYNC = _env_bool("STK_PUSH_ASYNC", default=False)
+STK_PUSH_DISPATCH_WORKERS = int(os.getenv("STK_PUSH_DISPATCH_WORKERS", "4"))
+STK_PUSH_DISPATCHING_TIMEOUT_SECONDS = int(os.getenv("STK_PUSH_DISPATCHING_TIMEOUT_SECONDS", "600"))
+
+# Fast-ack callbacks: store the raw Safaricom callback in CallbackInbox, answer ResultCode 0
+# immediately and apply it later with `manage.py process_callback_inbox`.
+CALLBACK_FAST_ACK = _env_bool("CALLBACK_FAST_ACK", default=False)
+CALLBACK_INBOX_MAX_ATTEMPTS = int(os.getenv("CALLBACK_INBOX_MAX_ATTEMPTS", "5"))
+
+# Redelivered callbacks (same natural key and body) are acked without being applied again.
+# Applied callbacks are remembered in the cache for this long (0 = database check only).
+CALLBACK_DEDUP_CACHE_SECONDS = int(os.getenv("CALLBACK_DEDUP_CACHE_SECONDS", "86400"))
+# CallbackReceipt rows (one per applied callback) older than this are deleted by
+# `manage.py prune_callback_receipts` (run daily; 0 = keep forever). Keep it well
+# above Safaricom's redelivery window.
+CALLBACK_RECEIPT_RETENTION_DAYS = int(os.getenv("CALLBACK_RECEIPT_RETENTION_DAYS", "30"))
+
+# Bulk payout executors (manage.py run_b2c_bulk / run_b2b_bulk). Rate limits are per business,
+# in requests/second.
+B2C_BULK_CHUNK_SIZE = int(os.getenv("B2C_BULK_CHUNK_SIZE", "100"))
+B2C_BULK_CONCURRENCY = int(os.getenv("B2C_BULK_CONCURRENCY", "8"))
+B2C_BULK_RATE_PER_BUSINESS = float(os.getenv("B2C_BULK_RATE_PER_BUSINESS", "5"))
+B2B_BULK_CHUNK_SIZE = int(os.getenv("B2B_BULK_CHUNK_SIZE", "100"))
+B2B_BULK_CONCURRENCY = int(os.getenv("B2B_BULK_CONCURRENCY", "8"))
+B2B_BULK_RATE_PER_BUSINESS = float(os.getenv("B2B_BULK_RATE_PER_BUSINESS", "5"))
+
+# Reconciliation sweeper (manage.py reconcile_pending_payments): Transaction Status Queries for
+# payments still pending after this many seconds, grouped per shortcode and rate-limited.
+RECONCILE_PENDING_AFTER_SECONDS = int(os.getenv("RECONCILE_PENDING_AFTER_SECONDS", "900"))
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", "200"))
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "4"))
+RECONCILE_RATE_PER_SECOND = float(os.getenv("RECONCILE_RATE_PER_SECOND", "2"))
+
+# Bulk batch uploads (POST .../bulk): bulk_create chunk size and how many rejected rows to echo back.
+BULK_INGEST_CHUNK_SIZE = int(os.getenv("BULK_INGEST_CHUNK_SIZE", "1000"))
+BULK_INGEST_MAX_REJECTIONS = int(os.getenv("BULK_INGEST_MAX_REJECTIONS", "1000"))
+
+# Daraja OAuth tokens are cached until `expires_in` minus this margin.
+DARAJA_TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("DARAJA_TOKEN_REFRESH_MARGIN_SECONDS", "60"))
+# Upper bound on how long other workers wait for a single in-flight refresh.
+DARAJA_TOKEN_LOCK_SECONDS = int(os.getenv("DARAJA_TOKEN_LOCK_SECONDS", "10"))
 
 
 if not DEBUG:
@@ -248,6 +364,10 @@ OAUTH2_PROVIDER = {
     "DEFAULT_SCOPES": [],
 }
 
+# Validated Bearer tokens (and the caller's bound business) are cached for at most
+# this long, and never past the token's own expiry. 0 disables the cache.
+OAUTH2_TOKEN_CACHE_SECONDS = int(os.getenv("OAUTH2_TOKEN_CACHE_SECONDS", "60"))
+
 # Django OAuth Toolkit compatibility (some versions expect this setting).
 # Default built-in Application model.
 OAUTH2_PROVIDER_APPLICATION_MODEL = "oauth2_provider.Application"
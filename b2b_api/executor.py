@@ -0,0 +1,217 @@
+"""Executor for queued bulk B2B payments.
+
+`python manage.py run_b2b_bulk` claims queued `BulkBusinessPaymentItem` rows,
+creates a `B2BUSSDPushRequest` per item (linked through `bulk_item`) and submits
+it via the same path as `POST /api/v1/b2b/single`. The USSD callback moves the
+item and its batch forward.
+
+Item lifecycle: queued -> processing -> submitted -> completed | cancelled | failed
+(or failed straight away when Safaricom rejects the submission).
+
+The RequestRefID is derived from the item id and the request row is written
+before the call. After a crash, items still `processing` are re-queued unless
+Daraja already answered their request (it is no longer `queued`); those are
+left in flight for the callback. A re-queued item whose request row exists
+resends that row, with the same RequestRefID.
+"""
+
+from __future__ import annotations
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, OuterRef
+from django.utils import timezone
+
+from services_common.batching import PerKeyRateLimiter, claim_queued, rollup_batch_status, run_bounded
+
+from .models import B2BUSSDPushRequest, BulkBusinessPaymentBatch, BulkBusinessPaymentItem
+
+
+logger = logging.getLogger(__name__)
+
+ITEM_QUEUED = "queued"
+ITEM_PROCESSING = "processing"
+ITEM_SUBMITTED = "submitted"
+ITEM_COMPLETED = "completed"
+ITEM_CANCELLED = "cancelled"
+ITEM_FAILED = "failed"
+
+PENDING_ITEM_STATUSES = {ITEM_QUEUED, ITEM_PROCESSING, ITEM_SUBMITTED}
+
+
+def _setting(name: str, default):
+    value = getattr(settings, name, default)
+    return default if value is None else value
+
+
+def item_request_ref_id(item: BulkBusinessPaymentItem) -> str:
+    return f"b2b-bulk-{item.batch_id}-{item.id}"
+
+
+def refresh_batch_status(batch_id) -> str:
+    """Recompute a batch's status from its items (only writes when it changes)."""
+
+    counts = {
+        row["status"]: row["n"]
+        for row in BulkBusinessPaymentItem.objects.filter(batch_id=batch_id).values("status").annotate(n=Count("id"))
+    }
+    status = rollup_batch_status(counts, pending=PENDING_ITEM_STATUSES, succeeded={ITEM_COMPLETED})
+    BulkBusinessPaymentBatch.objects.filter(id=batch_id).exclude(status=status).update(status=status, updated_at=timezone.now())
+    return status
+
+
+def _fail_item(item: BulkBusinessPaymentItem, error: str) -> None:
+    item.status = ITEM_FAILED
+    item.result = {"error": error}
+    item.save(update_fields=["status", "result", "updated_at"])
+
+
+def _answered_requests():
+    """USSD push requests Daraja responded to (accepted or rejected)."""
+
+    return B2BUSSDPushRequest.objects.exclude(status=B2BUSSDPushRequest.STATUS_QUEUED)
+
+
+def _resume_item(item: BulkBusinessPaymentItem, req: B2BUSSDPushRequest) -> str:
+    """Bring a claimed item in line with a request an earlier run already sent."""
+
+    if req.status == B2BUSSDPushRequest.STATUS_SUBMITTED:
+        item.status = ITEM_SUBMITTED
+        item.result = {"ussd_request_id": str(req.id), "response": req.api_response_payload}
+    elif req.status == B2BUSSDPushRequest.STATUS_ERROR:
+        item.status = ITEM_FAILED
+        item.result = {"error": "Failed to submit", "details": req.api_error_payload}
+    else:
+        item.status = {
+            B2BUSSDPushRequest.STATUS_SUCCESS: ITEM_COMPLETED,
+            B2BUSSDPushRequest.STATUS_CANCELLED: ITEM_CANCELLED,
+        }.get(req.status, ITEM_FAILED)
+        item.result = req.callback_payload
+    item.save(update_fields=["status", "result", "updated_at"])
+    return item.status
+
+
+def submit_item(item_id, *, limiter: PerKeyRateLimiter | None = None) -> str:
+    """Submit one claimed item. Returns the item's new status."""
+
+    from .views import build_ussd_push_payload, submit_ussd_push
+
+    item = BulkBusinessPaymentItem.objects.select_related("batch", "batch__business").get(id=item_id)
+    batch = item.batch
+    if item.status != ITEM_PROCESSING:
+        return item.status
+
+    business = batch.business
+    if business is None:
+        _fail_item(item, "Batch has no business")
+        return ITEM_FAILED
+
+    options = dict(batch.meta or {})
+    environment = str(options.get("environment") or "sandbox").strip().lower()
+    if environment not in {"sandbox", "production"}:
+        _fail_item(item, "environment must be sandbox or production")
+        return ITEM_FAILED
+
+    request_ref_id = item_request_ref_id(item)
+    amount = str(item.amount)
+    payload, error = build_ussd_push_payload(
+        {
+            **options,
+            "receiver_short_code": item.recipient,
+            "payment_ref": item.item_reference or options.get("payment_ref") or batch.reference,
+        },
+        amount=amount,
+        request_ref_id=request_ref_id,
+    )
+    if error:
+        _fail_item(item, error)
+        return ITEM_FAILED
+
+    try:
+        with transaction.atomic():
+            req = B2BUSSDPushRequest.objects.create(
+                business=business,
+                bulk_item=item,
+                environment=environment,
+                request_ref_id=request_ref_id,
+                status=B2BUSSDPushRequest.STATUS_QUEUED,
+                amount=amount,
+                product_type=item.product_type,
+                request_payload=payload,
+            )
+    except IntegrityError:
+        # Created by an earlier run that crashed. Resend it only if Daraja never answered.
+        req = B2BUSSDPushRequest.objects.get(request_ref_id=request_ref_id)
+        if req.status != B2BUSSDPushRequest.STATUS_QUEUED:
+            return _resume_item(item, req)
+
+    if limiter is not None:
+        limiter.wait(business.id)
+
+    status, data = submit_ussd_push(req)
+    if status == 201:
+        item.status = ITEM_SUBMITTED
+        item.result = {"ussd_request_id": str(req.id), "response": req.api_response_payload}
+    else:
+        item.status = ITEM_FAILED
+        item.result = data
+    item.save(update_fields=["status", "result", "updated_at"])
+    return item.status
+
+
+def requeue_stale_items(*, older_than_seconds: int) -> int:
+    """Re-queue `processing` items abandoned by a crashed executor before Daraja answered."""
+
+    cutoff = timezone.now() - timedelta(seconds=older_than_seconds)
+    return (
+        BulkBusinessPaymentItem.objects.filter(status=ITEM_PROCESSING, updated_at__lt=cutoff)
+        .exclude(Exists(_answered_requests().filter(bulk_item=OuterRef("pk"))))
+        .update(status=ITEM_QUEUED, updated_at=timezone.now())
+    )
+
+
+def make_rate_limiter() -> PerKeyRateLimiter:
+    return PerKeyRateLimiter(float(_setting("B2B_BULK_RATE_PER_BUSINESS", 5)))
+
+
+def run_once(
+    *,
+    batch_id=None,
+    limit: int | None = None,
+    concurrency: int | None = None,
+    limiter: PerKeyRateLimiter | None = None,
+) -> int:
+    """Claim and submit one chunk of queued items. Returns how many were claimed."""
+
+    limit = int(limit or _setting("B2B_BULK_CHUNK_SIZE", 100))
+    concurrency = int(concurrency or _setting("B2B_BULK_CONCURRENCY", 8))
+    limiter = limiter or make_rate_limiter()
+
+    qs = BulkBusinessPaymentItem.objects.all()
+    if batch_id:
+        qs = qs.filter(batch_id=batch_id)
+
+    item_ids = claim_queued(qs, limit=limit)
+    if not item_ids:
+        return 0
+
+    batch_ids = set(BulkBusinessPaymentItem.objects.filter(id__in=item_ids).values_list("batch_id", flat=True))
+    for bid in batch_ids:
+        refresh_batch_status(bid)
+
+    def _submit(item_id):
+        try:
+            return submit_item(item_id, limiter=limiter)
+        except Exception:
+            # Leave the item `processing`; requeue_stale_items() picks it up unless Daraja answered.
+            logger.exception("B2B bulk item %s failed to submit", item_id)
+            return ITEM_PROCESSING
+
+    run_bounded(_submit, item_ids, concurrency=concurrency)
+
+    for bid in batch_ids:
+        refresh_batch_status(bid)
+    return len(item_ids)
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from b2b_api.executor import make_rate_limiter, requeue_stale_items, run_once
+
+
+class Command(BaseCommand):
+    help = "Submit queued bulk B2B payment items to Safaricom"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", default=None, help="Only process items of this batch id")
+        parser.add_argument("--limit", type=int, default=None, help="Items claimed per chunk (default: B2B_BULK_CHUNK_SIZE)")
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=None,
+            help="Concurrent submissions (default: B2B_BULK_CONCURRENCY; use 1 on SQLite)",
+        )
+        parser.add_argument(
+            "--requeue-stale-seconds",
+            type=int,
+            default=300,
+            help="Re-queue items stuck in processing (and not yet answered by Daraja) for longer than this (default: 300; 0 disables)",
+        )
+        parser.add_argument("--loop", action="store_true", help="Keep polling for queued items")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds to sleep when idle with --loop (default: 5)")
+
+    def handle(self, *args, **options):
+        limiter = make_rate_limiter()
+        stale_seconds = int(options["requeue_stale_seconds"] or 0)
+
+        while True:
+            if stale_seconds > 0:
+                requeued = requeue_stale_items(older_than_seconds=stale_seconds)
+                if requeued:
+                    self.stdout.write(f"Re-queued stale items: {requeued}")
+
+            total = 0
+            while True:
+                claimed = run_once(
+                    batch_id=options["batch"],
+                    limit=options["limit"],
+                    concurrency=options["concurrency"],
+                    limiter=limiter,
+                )
+                total += claimed
+                if not claimed:
+                    break
+
+            self.stdout.write(f"Processed B2B bulk items. claimed={total}")
+            if not options["loop"]:
+                return
+            time.sleep(max(float(options["interval"]), 0.1))
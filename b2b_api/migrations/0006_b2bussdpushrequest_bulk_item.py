@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-16 22:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('b2b_api', '0005_b2bussdpushrequest_internal_status_code_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='b2bussdpushrequest',
+            name='bulk_item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ussd_push_requests', to='b2b_api.bulkbusinesspaymentitem'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+def backfill_amount(apps, _schema_editor):
+    """Copy request_payload["amount"] into `amount` where it was never set, so reports can sum in SQL."""
+
+    B2BUSSDPushRequest = apps.get_model("b2b_api", "B2BUSSDPushRequest")
+
+    pending = []
+    for req in B2BUSSDPushRequest.objects.filter(amount="").only("id", "request_payload").iterator(chunk_size=2000):
+        payload = req.request_payload if isinstance(req.request_payload, dict) else {}
+        amount = str(payload.get("amount") or "").strip()[:30]
+        if not amount:
+            continue
+        req.amount = amount
+        pending.append(req)
+        if len(pending) >= 500:
+            B2BUSSDPushRequest.objects.bulk_update(pending, ["amount"])
+            pending = []
+    if pending:
+        B2BUSSDPushRequest.objects.bulk_update(pending, ["amount"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("b2b_api", "0006_b2bussdpushrequest_bulk_item"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_amount, migrations.RunPython.noop),
+    ]
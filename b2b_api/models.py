@@ -72,6 +72,13 @@ class B2BUSSDPushRequest(models.Model):
 		on_delete=models.CASCADE,
 		related_name="b2b_ussd_push_requests",
 	)
+	bulk_item = models.ForeignKey(
+		BulkBusinessPaymentItem,
+		null=True,
+		blank=True,
+		on_delete=models.SET_NULL,
+		related_name="ussd_push_requests",
+	)
 
 	environment = models.CharField(max_length=20, blank=True, default="")
 
@@ -89,6 +89,28 @@ class B2BBulkApiTests(TestCase):
 		self.assertEqual(len(detail_json["items"]), 2)
 
 
+	def test_bulk_create_streams_ndjson(self):
+		lines = [
+			json.dumps({"party_b": "600000", "amount": "100"}),
+			json.dumps({"party_b": "600001", "amount": "0.001"}),
+			json.dumps(["not", "an", "object"]),
+			json.dumps({"account": "600002", "amount": 50}),
+		]
+		resp = self.client.post(
+			"/api/v1/b2b/bulk?reference=B2B-NDJSON",
+			data="\n".join(lines) + "\n",
+			content_type="application/x-ndjson",
+			HTTP_AUTHORIZATION=f"Bearer {self.access_token}",
+		)
+		self.assertEqual(resp.status_code, 201)
+		payload = resp.json()
+		self.assertEqual((payload["accepted"], payload["rejected"]), (2, 2))
+		self.assertEqual(
+			payload["rejections"],
+			[{"row": 2, "error": "amount must have at most 2 decimal places"}, {"row": 3, "error": "row must be an object"}],
+		)
+		self.assertEqual(payload["batch"]["items_count"], 2)
+
 class B2BSingleUssdApiTests(TestCase):
 	def setUp(self):
 		self.business = Business.objects.create(name="Shop B")
@@ -146,8 +168,8 @@ class B2BSingleUssdApiTests(TestCase):
 			"MPESA_B2B_CALLBACK_URL": "https://example.com/result",
 		},
 	)
-	@patch("b2b_api.views.requests.post")
-	@patch("b2b_api.views.requests.get")
+	@patch("b2b_api.views.outbound.post")
+	@patch("b2b_api.views.outbound.get")
 	def test_single_submits_and_persists(self, mock_get, mock_post):
 		class FakeResp:
 			def __init__(self, status_code, payload):
@@ -185,6 +207,78 @@ class B2BSingleUssdApiTests(TestCase):
 		self.assertEqual(ussd.get("request_ref_id"), "req-1")
 		self.assertEqual(ussd.get("response_code"), "0")
 
+	@patch.dict(
+		os.environ,
+		{
+			"MPESA_B2B_USSD_API_URL": "https://sandbox.safaricom.co.ke/v1/ussdpush/get-msisdn",
+			"MPESA_B2B_CALLBACK_URL": "https://example.com/result",
+		},
+	)
+	@patch("b2b_api.views.outbound.post")
+	@patch("b2b_api.views.outbound.get")
+	def test_bulk_executor_resumes_without_resubmitting(self, mock_get, mock_post):
+		from b2b_api.executor import requeue_stale_items, run_once
+		from b2b_api.models import B2BUSSDPushRequest, BulkBusinessPaymentBatch, BulkBusinessPaymentItem
+
+		mock_get.return_value.status_code = 200
+		mock_get.return_value.json.return_value = {"access_token": "abc", "expires_in": "3599"}
+		mock_post.return_value.status_code = 200
+		mock_post.return_value.json.return_value = {"code": "0", "status": "USSD Initiated Successfully"}
+
+		batch = BulkBusinessPaymentBatch.objects.create(
+			business=self.business,
+			reference="SUPPLIERS",
+			meta={"primary_short_code": "000001", "partner_name": "Vendor"},
+		)
+		sent = BulkBusinessPaymentItem.objects.create(batch=batch, recipient="000002", amount="100")
+		crashed = BulkBusinessPaymentItem.objects.create(batch=batch, recipient="000003", amount="50")
+		queued = BulkBusinessPaymentItem.objects.create(batch=batch, recipient="000004", amount="25")
+		unsent = BulkBusinessPaymentItem.objects.create(batch=batch, recipient="000005", amount="10")
+
+		# Simulate an executor that died after submitting `sent`, claiming `crashed`,
+		# and writing the request row of `unsent` without sending it.
+		B2BUSSDPushRequest.objects.create(
+			business=self.business,
+			bulk_item=sent,
+			environment="sandbox",
+			request_ref_id=f"b2b-bulk-{batch.id}-{sent.id}",
+			status=B2BUSSDPushRequest.STATUS_SUBMITTED,
+		)
+		B2BUSSDPushRequest.objects.create(
+			business=self.business,
+			bulk_item=unsent,
+			environment="sandbox",
+			request_ref_id=f"b2b-bulk-{batch.id}-{unsent.id}",
+			status=B2BUSSDPushRequest.STATUS_QUEUED,
+			request_payload={"RequestRefID": f"b2b-bulk-{batch.id}-{unsent.id}", "primaryShortCode": "000001"},
+		)
+		stale = timezone.now() - timedelta(hours=1)
+		BulkBusinessPaymentItem.objects.filter(id__in=[sent.id, crashed.id, unsent.id]).update(status="processing", updated_at=stale)
+
+		self.assertEqual(requeue_stale_items(older_than_seconds=60), 2)
+		self.assertEqual(run_once(batch_id=batch.id, concurrency=1), 3)
+
+		self.assertEqual(mock_post.call_count, 3)
+		sent_refs = {call.kwargs["json"]["RequestRefID"] for call in mock_post.call_args_list}
+		self.assertEqual(
+			sent_refs,
+			{f"b2b-bulk-{batch.id}-{item.id}" for item in (crashed, queued, unsent)},
+		)
+		self.assertEqual(B2BUSSDPushRequest.objects.get(bulk_item=unsent).status, B2BUSSDPushRequest.STATUS_SUBMITTED)
+		self.assertEqual(mock_post.call_args.kwargs["json"]["primaryShortCode"], "000001")
+
+		for req in B2BUSSDPushRequest.objects.filter(bulk_item__batch=batch):
+			resp = self.client.post(
+				"/api/v1/b2b/callback/result",
+				data=json.dumps({"resultCode": "0", "resultDesc": "ok", "requestId": req.request_ref_id}),
+				content_type="application/json",
+			)
+			self.assertEqual(resp.status_code, 200)
+
+		batch.refresh_from_db()
+		self.assertEqual(batch.status, "completed")
+		self.assertEqual(set(batch.items.values_list("status", flat=True)), {"completed"})
+
 	def test_callback_result_updates_request(self):
 		from b2b_api.models import B2BUSSDPushRequest
 
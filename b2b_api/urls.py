@@ -1,13 +1,18 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
 
+# Daraja-bound endpoints use their async views under ASGI (see ASYNC_VIEWS_ENABLED).
+single_ussd_push = views.single_ussd_push_async if settings.ASYNC_VIEWS_ENABLED else views.single_ussd_push
+
+
 urlpatterns = [
 	path("bulk", views.bulk_create, name="b2b_bulk_create"),
 	path("bulk/", views.bulk_create),
-	path("single", views.single_ussd_push, name="b2b_single_ussd_push"),
-	path("single/", views.single_ussd_push),
+	path("single", single_ussd_push, name="b2b_single_ussd_push"),
+	path("single/", single_ussd_push),
 	path("callback/result", views.callback_result, name="b2b_callback_result"),
 	path("callback/result/", views.callback_result),
 	path("bulk/list", views.bulk_list, name="b2b_bulk_list"),
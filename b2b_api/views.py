@@ -2,16 +2,26 @@ import os
 import uuid
 from decimal import Decimal, InvalidOperation
 
-import requests
-
+from asgiref.sync import sync_to_async
+from django.db import transaction
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
+from mpesa_api.models import CallbackInbox
+from services_common import outbound
 from services_common.auth import require_oauth2, require_staff
+from services_common.bulk_ingest import BulkUploadError, ingest_rows, parse_item_amount, read_bulk_upload
+from services_common.callback_dedup import deduplicated
+from services_common.callback_inbox import fast_ack
+from services_common.circuit_breaker import UpstreamUnavailable, unavailable_body
+from services_common.daraja_tokens import get_access_token as get_cached_access_token
+from services_common.daraja_tokens import invalidate_access_token, token_cache_key
 from services_common.http import json_body, parse_limit_param
+from services_common.rollups import b2b_contribution, record_change
 from services_common.tenancy import resolve_business_from_request
 from services_common.status_codes import apply_mapped_status, map_status
 
+from .executor import ITEM_CANCELLED, ITEM_COMPLETED, ITEM_FAILED, refresh_batch_status
 from .models import B2BUSSDPushRequest, BulkBusinessPaymentBatch, BulkBusinessPaymentItem
 
 
@@ -115,25 +125,55 @@ def _get_daraja_credential(business_id, environment: str):
     return cred
 
 
-def _get_access_token(cred):
+def _token_cache_key(cred) -> str:
     token_url = (cred.token_url or "").strip() or _get_default_token_url(cred.environment)
-    resp = requests.get(
-        token_url,
-        auth=(cred.consumer_key, cred.consumer_secret),
-        timeout=30,
+    return token_cache_key(
+        environment=cred.environment,
+        credential_id=cred.id,
+        consumer_key=cred.consumer_key,
+        token_url=token_url,
     )
-    try:
-        data = resp.json()
-    except Exception:
-        data = {"raw": (resp.text or "")}
 
-    if resp.status_code < 200 or resp.status_code >= 300:
-        raise RuntimeError(f"Token request failed ({resp.status_code}): {data}")
 
-    token = data.get("access_token") if isinstance(data, dict) else None
-    if not token:
-        raise RuntimeError(f"Token response missing access_token: {data}")
-    return str(token)
+def _get_access_token(cred):
+    token_url = (cred.token_url or "").strip() or _get_default_token_url(cred.environment)
+
+    def _fetch():
+        resp = outbound.get(
+            token_url,
+            auth=(cred.consumer_key, cred.consumer_secret),
+        )
+        try:
+            data = resp.json()
+        except Exception:
+            data = {"raw": (resp.text or "")}
+
+        if resp.status_code < 200 or resp.status_code >= 300:
+            raise RuntimeError(f"Token request failed ({resp.status_code}): {data}")
+
+        token = data.get("access_token") if isinstance(data, dict) else None
+        if not token:
+            raise RuntimeError(f"Token response missing access_token: {data}")
+        return str(token), data.get("expires_in")
+
+    return get_cached_access_token(_token_cache_key(cred), _fetch)
+
+
+def _parse_bulk_item(raw: dict):
+    recipient = str(raw.get("recipient") or raw.get("party_b") or raw.get("account") or "").strip()
+    if not recipient:
+        return None, "recipient is required"
+    amount, error = parse_item_amount(raw.get("amount"))
+    if error:
+        return None, error
+
+    return {
+        "recipient": recipient,
+        "amount": amount,
+        "currency": str(raw.get("currency") or "KES").strip().upper()[:3] or "KES",
+        "product_type": str(raw.get("product_type") or "").strip()[:60],
+        "item_reference": str(raw.get("reference") or "").strip()[:64],
+    }, None
 
 
 @require_oauth2(scopes=["b2b:write"])
@@ -142,56 +182,37 @@ def bulk_create(request):
     if request.method != "POST":
         return JsonResponse({"error": "Method not allowed"}, status=405)
 
-    body = json_body(request)
-    items = body.get("items")
-    if not isinstance(items, list) or len(items) == 0:
-        return JsonResponse({"error": "items must be a non-empty list"}, status=400)
+    try:
+        batch_fields, rows = read_bulk_upload(request)
+    except BulkUploadError as e:
+        return JsonResponse({"error": str(e)}, status=400)
 
-    reference = str(body.get("reference", "")).strip()[:64]
-    business, error = resolve_business_from_request(request, body.get("business_id"))
+    reference = str(batch_fields.get("reference", "")).strip()[:64]
+    business, error = resolve_business_from_request(request, batch_fields.get("business_id"))
     if error:
         return error
 
-    meta = {k: v for k, v in body.items() if k not in {"items"}}
-    batch = BulkBusinessPaymentBatch.objects.create(reference=reference, meta=meta, business=business)
-
-    created = 0
-    for raw in items:
-        if not isinstance(raw, dict):
-            continue
-        recipient = str(raw.get("recipient") or raw.get("party_b") or raw.get("account") or "").strip()
-        amount_raw = raw.get("amount")
-        currency = str(raw.get("currency") or "KES").strip().upper()[:3]
-        product_type = str(raw.get("product_type") or "").strip()[:60]
-        item_reference = str(raw.get("reference") or "").strip()[:64]
-
-        if not recipient:
-            continue
-        try:
-            amount = Decimal(str(amount_raw))
-        except (InvalidOperation, TypeError):
-            continue
-        if amount <= 0:
-            continue
-
-        BulkBusinessPaymentItem.objects.create(
-            batch=batch,
-            recipient=recipient,
-            amount=amount,
-            currency=currency or "KES",
-            product_type=product_type,
-            item_reference=item_reference,
+    with transaction.atomic():
+        batch = BulkBusinessPaymentBatch.objects.create(reference=reference, meta=batch_fields, business=business)
+        accepted, rejected, rejections = ingest_rows(
+            rows,
+            parse_row=_parse_bulk_item,
+            build=lambda fields: BulkBusinessPaymentItem(batch=batch, **fields),
+            model=BulkBusinessPaymentItem,
         )
-        created += 1
+        if accepted == 0:
+            transaction.set_rollback(True)
 
-    if created == 0:
-        batch.delete()
-        return JsonResponse({"error": "No valid items provided"}, status=400)
+    if accepted == 0:
+        return JsonResponse({"error": "No valid items provided", "rejected": rejected, "rejections": rejections}, status=400)
 
     return JsonResponse(
         {
             "ok": True,
             "batch": _serialize_batch(batch),
+            "accepted": accepted,
+            "rejected": rejected,
+            "rejections": rejections,
         },
         status=201,
     )
@@ -233,51 +254,60 @@ def single_ussd_push(request):
     if request.method != "POST":
         return JsonResponse({"error": "Method not allowed"}, status=405)
 
+    req, error = _create_ussd_push_request(request)
+    if error is not None:
+        return error
+
+    status, data = submit_ussd_push(req)
+    return JsonResponse(data, status=status)
+
+
+@require_oauth2(scopes=["b2b:write"])
+@csrf_exempt
+async def single_ussd_push_async(request):
+    """`single_ussd_push` for ASGI deployments."""
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    req, error = await sync_to_async(_create_ussd_push_request)(request)
+    if error is not None:
+        return error
+
+    status, data = await asubmit_ussd_push(req)
+    return JsonResponse(data, status=status)
+
+
+def _create_ussd_push_request(request):
+    """Validate the request and persist a queued B2BUSSDPushRequest.
+
+    Returns (ussd_request, None) or (None, error_response).
+    """
     body = json_body(request)
 
     business, error = resolve_business_from_request(request, body.get("business_id"))
     if error:
-        return error
+        return None, error
 
     environment = str(body.get("environment") or "sandbox").strip().lower()
     if environment not in {"sandbox", "production"}:
-        return JsonResponse({"error": "environment must be sandbox or production"}, status=400)
-
-    primary_short_code = str(body.get("primary_short_code") or body.get("primaryShortCode") or _env("MPESA_B2B_PRIMARY_SHORT_CODE", "")).strip()
-    receiver_short_code = str(body.get("receiver_short_code") or body.get("receiverShortCode") or _env("MPESA_B2B_RECEIVER_SHORT_CODE", "")).strip()
-    payment_ref = str(body.get("payment_ref") or body.get("paymentRef") or _env("MPESA_B2B_PAYMENT_REF", "paymentRef")).strip()
-    callback_url = str(body.get("callback_url") or body.get("callbackUrl") or _env("MPESA_B2B_CALLBACK_URL", "")).strip()
-    partner_name = str(body.get("partner_name") or body.get("partnerName") or _env("MPESA_B2B_PARTNER_NAME", "Vendor")).strip()
-
-    if not primary_short_code or not receiver_short_code:
-        return JsonResponse({"error": "primary_short_code and receiver_short_code are required"}, status=400)
-    if not callback_url:
-        return JsonResponse({"error": "callback_url is required (or set MPESA_B2B_CALLBACK_URL)"}, status=400)
-    if not partner_name:
-        return JsonResponse({"error": "partner_name is required"}, status=400)
+        return None, JsonResponse({"error": "environment must be sandbox or production"}, status=400)
 
     amount_raw = body.get("amount")
     try:
         amount_dec = Decimal(str(amount_raw))
     except (InvalidOperation, TypeError):
-        return JsonResponse({"error": "amount must be a number"}, status=400)
+        return None, JsonResponse({"error": "amount must be a number"}, status=400)
     if amount_dec <= 0:
-        return JsonResponse({"error": "amount must be > 0"}, status=400)
+        return None, JsonResponse({"error": "amount must be > 0"}, status=400)
     amount_str = str(amount_dec)
 
     request_ref_id = str(body.get("request_ref_id") or body.get("RequestRefID") or "").strip()
     if not request_ref_id:
         request_ref_id = str(uuid.uuid4())
 
-    payload = {
-        "primaryShortCode": primary_short_code,
-        "receiverShortCode": receiver_short_code,
-        "amount": amount_str,
-        "paymentRef": payment_ref,
-        "callbackUrl": callback_url,
-        "partnerName": partner_name,
-        "RequestRefID": request_ref_id,
-    }
+    payload, payload_error = build_ussd_push_payload(body, amount=amount_str, request_ref_id=request_ref_id)
+    if payload_error:
+        return None, JsonResponse({"error": payload_error}, status=400)
 
     req = B2BUSSDPushRequest.objects.create(
         business=business,
@@ -288,61 +318,130 @@ def single_ussd_push(request):
         product_type=str(body.get("product_type") or "").strip()[:60],
         request_payload=payload,
     )
+    return req, None
+
+
+def build_ussd_push_payload(options: dict, *, amount: str, request_ref_id: str):
+    """Build a USSD push payload from request options + env defaults.
+
+    Returns (payload, None) or (None, error message).
+    """
+
+    primary_short_code = str(options.get("primary_short_code") or options.get("primaryShortCode") or _env("MPESA_B2B_PRIMARY_SHORT_CODE", "")).strip()
+    receiver_short_code = str(options.get("receiver_short_code") or options.get("receiverShortCode") or _env("MPESA_B2B_RECEIVER_SHORT_CODE", "")).strip()
+    payment_ref = str(options.get("payment_ref") or options.get("paymentRef") or _env("MPESA_B2B_PAYMENT_REF", "paymentRef")).strip()
+    callback_url = str(options.get("callback_url") or options.get("callbackUrl") or _env("MPESA_B2B_CALLBACK_URL", "")).strip()
+    partner_name = str(options.get("partner_name") or options.get("partnerName") or _env("MPESA_B2B_PARTNER_NAME", "Vendor")).strip()
+
+    if not primary_short_code or not receiver_short_code:
+        return None, "primary_short_code and receiver_short_code are required"
+    if not callback_url:
+        return None, "callback_url is required (or set MPESA_B2B_CALLBACK_URL)"
+    if not partner_name:
+        return None, "partner_name is required"
+
+    return {
+        "primaryShortCode": primary_short_code,
+        "receiverShortCode": receiver_short_code,
+        "amount": amount,
+        "paymentRef": payment_ref,
+        "callbackUrl": callback_url,
+        "partnerName": partner_name,
+        "RequestRefID": request_ref_id,
+    }, None
+
+
+def submit_ussd_push(req: B2BUSSDPushRequest):
+    """Send a persisted B2BUSSDPushRequest to Daraja and record the outcome.
+
+    Returns (http_status, response_body) for the integrator-facing response;
+    201 means Safaricom accepted the request.
+    """
 
     try:
-        cred = _get_daraja_credential(business.id, environment)
-        if not cred:
-            req.status = B2BUSSDPushRequest.STATUS_ERROR
-            req.api_error_payload = {"error": f"No active DarajaCredential for business/environment ({environment})"}
-            req.save(update_fields=["status", "api_error_payload", "updated_at"])
-            return JsonResponse({"error": "Daraja credentials not configured for this business"}, status=400)
-
-        token = _get_access_token(cred)
-
-        url = _get_b2b_ussd_url(environment)
-        resp = requests.post(
-            url,
-            json=payload,
-            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
-            timeout=30,
-        )
-        try:
-            data = resp.json()
-        except Exception:
-            data = {"raw": (resp.text or "")}
+        target, error = _ussd_push_target(req)
+        if error is not None:
+            return error
+        cred, url, headers = target
+        resp = outbound.post(url, json=req.request_payload, headers=headers)
+        return _record_ussd_push_response(req, cred, resp)
+    except Exception as e:
+        return _record_ussd_push_error(req, e)
 
-        if resp.status_code < 200 or resp.status_code >= 300:
-            req.status = B2BUSSDPushRequest.STATUS_ERROR
-            req.api_error_payload = data if isinstance(data, dict) else {"error": data}
-            req.save(update_fields=["status", "api_error_payload", "updated_at"])
-            return JsonResponse({"error": "Safaricom API error", "details": req.api_error_payload}, status=502)
-
-        req.status = B2BUSSDPushRequest.STATUS_SUBMITTED
-        req.api_response_payload = data if isinstance(data, dict) else {"data": data}
-        if isinstance(data, dict):
-            req.response_code = str(data.get("code") or "")
-            req.response_status = str(data.get("status") or "")
-        req.save(update_fields=["status", "api_response_payload", "response_code", "response_status", "updated_at"])
-
-        mapped = map_status(
-            external_system="safaricom",
-            external_code=req.response_code,
-            external_message=req.response_status,
-        )
-        return JsonResponse(
-            {
-                "ok": True,
-                "status_code": mapped.status_code,
-                "status_message": mapped.status_message,
-                "ussd_request": _serialize_ussd_request(req),
-            },
-            status=201,
-        )
+
+async def asubmit_ussd_push(req: B2BUSSDPushRequest):
+    """Async `submit_ussd_push()`: the Daraja call is awaited, DB work runs in a thread."""
+
+    try:
+        target, error = await sync_to_async(_ussd_push_target)(req)
+        if error is not None:
+            return error
+        cred, url, headers = target
+        resp = await outbound.apost(url, json=req.request_payload, headers=headers)
+        return await sync_to_async(_record_ussd_push_response)(req, cred, resp)
     except Exception as e:
+        return await sync_to_async(_record_ussd_push_error)(req, e)
+
+
+def _ussd_push_target(req: B2BUSSDPushRequest):
+    """Returns ((credential, url, headers), None) or (None, (http_status, response_body))."""
+
+    cred = _get_daraja_credential(req.business_id, req.environment)
+    if not cred:
+        req.status = B2BUSSDPushRequest.STATUS_ERROR
+        req.api_error_payload = {"error": f"No active DarajaCredential for business/environment ({req.environment})"}
+        req.save(update_fields=["status", "api_error_payload", "updated_at"])
+        return None, (400, {"error": "Daraja credentials not configured for this business"})
+
+    token = _get_access_token(cred)
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    return (cred, _get_b2b_ussd_url(req.environment), headers), None
+
+
+def _record_ussd_push_response(req: B2BUSSDPushRequest, cred, resp):
+    try:
+        data = resp.json()
+    except Exception:
+        data = {"raw": (resp.text or "")}
+
+    if resp.status_code == 401:
+        # Token was revoked/expired upstream before our refresh margin.
+        invalidate_access_token(_token_cache_key(cred))
+
+    if resp.status_code < 200 or resp.status_code >= 300:
         req.status = B2BUSSDPushRequest.STATUS_ERROR
-        req.api_error_payload = {"error": str(e)}
+        req.api_error_payload = data if isinstance(data, dict) else {"error": data}
         req.save(update_fields=["status", "api_error_payload", "updated_at"])
-        return JsonResponse({"error": "Failed to submit", "details": req.api_error_payload}, status=502)
+        return 502, {"error": "Safaricom API error", "details": req.api_error_payload}
+
+    req.status = B2BUSSDPushRequest.STATUS_SUBMITTED
+    req.api_response_payload = data if isinstance(data, dict) else {"data": data}
+    if isinstance(data, dict):
+        req.response_code = str(data.get("code") or "")
+        req.response_status = str(data.get("status") or "")
+    req.save(update_fields=["status", "api_response_payload", "response_code", "response_status", "updated_at"])
+
+    mapped = map_status(
+        external_system="safaricom",
+        external_code=req.response_code,
+        external_message=req.response_status,
+    )
+    return 201, {
+        "ok": True,
+        "status_code": mapped.status_code,
+        "status_message": mapped.status_message,
+        "ussd_request": _serialize_ussd_request(req),
+    }
+
+
+def _record_ussd_push_error(req: B2BUSSDPushRequest, error: Exception):
+    req.status = B2BUSSDPushRequest.STATUS_ERROR
+    req.api_error_payload = {"error": str(error)}
+    req.save(update_fields=["status", "api_error_payload", "updated_at"])
+    if isinstance(error, UpstreamUnavailable):
+        # Not sent: the circuit for this Daraja endpoint is open (or at its concurrency limit).
+        return 503, unavailable_body(error)
+    return 502, {"error": "Failed to submit", "details": req.api_error_payload}
 
 
 @csrf_exempt
@@ -350,8 +449,15 @@ def callback_result(request):
     """USSD callback result (called by Safaricom)."""
     if request.method != "POST":
         return JsonResponse({"error": "Method not allowed"}, status=405)
+    ack = fast_ack(request, CallbackInbox.KIND_B2B_RESULT)
+    if ack is not None:
+        return ack
+    return apply_callback_result(json_body(request), remote_addr=request.META.get("REMOTE_ADDR"))
 
-    body = json_body(request)
+
+@deduplicated(CallbackInbox.KIND_B2B_RESULT)
+def apply_callback_result(body, *, remote_addr=None):
+    """Apply a B2B USSD result payload (also replayed by the callback inbox worker)."""
     if not isinstance(body, dict):
         return JsonResponse({"error": "Invalid JSON"}, status=400)
 
@@ -364,6 +470,7 @@ def callback_result(request):
     except B2BUSSDPushRequest.DoesNotExist:
         return JsonResponse({"error": "Unknown requestId"}, status=404)
 
+    before = b2b_contribution(req)
     result_code = str(body.get("resultCode") or "").strip()
     result_desc = str(body.get("resultDesc") or "").strip()
 
@@ -405,5 +512,21 @@ def callback_result(request):
             "updated_at",
         ]
     )
+    record_change(before, b2b_contribution(req))
+
+    if req.bulk_item_id:
+        try:
+            item = BulkBusinessPaymentItem.objects.get(id=req.bulk_item_id)
+            item.result = body
+            if new_status == B2BUSSDPushRequest.STATUS_SUCCESS:
+                item.status = ITEM_COMPLETED
+            elif new_status == B2BUSSDPushRequest.STATUS_CANCELLED:
+                item.status = ITEM_CANCELLED
+            else:
+                item.status = ITEM_FAILED
+            item.save(update_fields=["result", "status", "updated_at"])
+            refresh_batch_status(item.batch_id)
+        except Exception:
+            pass
 
     return JsonResponse({"ok": True})
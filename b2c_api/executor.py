@@ -0,0 +1,221 @@
+"""Executor for queued bulk B2C payouts.
+
+`python manage.py run_b2c_bulk` claims queued `BulkPayoutItem` rows, creates a
+`B2CPaymentRequest` per item (linked through `bulk_item`) and submits it via the
+same path as `POST /api/v1/b2c/single`. Results arrive on the normal B2C
+callbacks, which move the item and its batch forward.
+
+Item lifecycle: queued -> processing -> submitted -> completed | failed | timeout
+(or failed straight away when Safaricom rejects the submission).
+
+Each item's OriginatorConversationID is derived from its id and the payment
+request row is created before anything is sent. After a crash, items still
+`processing` are re-queued unless Daraja already answered their payment request
+(it is no longer `queued`, or has a ConversationID); those are left for the
+callbacks/reconciliation. A re-queued item whose request row exists resends that
+row, with the same OriginatorConversationID.
+"""
+
+from __future__ import annotations
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, OuterRef
+from django.utils import timezone
+
+from services_common.batching import PerKeyRateLimiter, claim_queued, rollup_batch_status, run_bounded
+
+from .models import B2CPaymentRequest, BulkPayoutBatch, BulkPayoutItem
+
+
+logger = logging.getLogger(__name__)
+
+ITEM_QUEUED = "queued"
+ITEM_PROCESSING = "processing"
+ITEM_SUBMITTED = "submitted"
+ITEM_COMPLETED = "completed"
+ITEM_FAILED = "failed"
+ITEM_TIMEOUT = "timeout"
+
+PENDING_ITEM_STATUSES = {ITEM_QUEUED, ITEM_PROCESSING, ITEM_SUBMITTED}
+
+
+def _setting(name: str, default):
+    value = getattr(settings, name, default)
+    return default if value is None else value
+
+
+def item_originator_conversation_id(item: BulkPayoutItem) -> str:
+    return f"b2c-bulk-{item.batch_id}-{item.id}"
+
+
+def refresh_batch_status(batch_id) -> str:
+    """Recompute a batch's status from its items (only writes when it changes)."""
+
+    counts = {
+        row["status"]: row["n"]
+        for row in BulkPayoutItem.objects.filter(batch_id=batch_id).values("status").annotate(n=Count("id"))
+    }
+    status = rollup_batch_status(counts, pending=PENDING_ITEM_STATUSES, succeeded={ITEM_COMPLETED})
+    BulkPayoutBatch.objects.filter(id=batch_id).exclude(status=status).update(status=status, updated_at=timezone.now())
+    return status
+
+
+def _fail_item(item: BulkPayoutItem, error: str) -> None:
+    item.status = ITEM_FAILED
+    item.result = {"error": error}
+    item.save(update_fields=["status", "result", "updated_at"])
+
+
+def _answered_requests():
+    """Payment requests Daraja responded to (accepted or rejected)."""
+
+    return B2CPaymentRequest.objects.exclude(status=B2CPaymentRequest.STATUS_QUEUED, conversation_id="")
+
+
+def _resume_item(item: BulkPayoutItem, pr: B2CPaymentRequest) -> str:
+    """Bring a claimed item in line with a payment request an earlier run already sent."""
+
+    if pr.status == B2CPaymentRequest.STATUS_ERROR:
+        item.status = ITEM_FAILED
+        item.result = {"error": "Failed to submit", "details": pr.api_error_payload}
+    elif pr.status == B2CPaymentRequest.STATUS_RESULT:
+        item.status = ITEM_COMPLETED if pr.result_code == 0 else ITEM_FAILED
+        item.result = pr.callback_result_payload
+    elif pr.status == B2CPaymentRequest.STATUS_TIMEOUT:
+        item.status = ITEM_TIMEOUT
+        item.result = pr.callback_timeout_payload
+    else:
+        item.status = ITEM_SUBMITTED
+        item.result = {"payment_request_id": str(pr.id), "response": pr.api_response_payload}
+    item.save(update_fields=["status", "result", "updated_at"])
+    return item.status
+
+
+def submit_item(item_id, *, limiter: PerKeyRateLimiter | None = None) -> str:
+    """Submit one claimed item. Returns the item's new status."""
+
+    from .views import build_payment_payload, submit_payment_request
+
+    item = BulkPayoutItem.objects.select_related("batch", "batch__business").get(id=item_id)
+    batch = item.batch
+    if item.status != ITEM_PROCESSING:
+        return item.status
+
+    business = batch.business
+    if business is None:
+        _fail_item(item, "Batch has no business")
+        return ITEM_FAILED
+
+    options = dict(batch.meta or {})
+    environment = str(options.get("environment") or "sandbox").strip().lower()
+    if environment not in {"sandbox", "production"}:
+        _fail_item(item, "environment must be sandbox or production")
+        return ITEM_FAILED
+
+    if item.amount != item.amount.to_integral_value():
+        # Daraja B2C pays whole shillings only; int(amount) would silently truncate.
+        _fail_item(item, "amount must be a whole number for B2C")
+        return ITEM_FAILED
+    amount = int(item.amount)
+
+    originator_conversation_id = item_originator_conversation_id(item)
+    payload, error = build_payment_payload(
+        business,
+        {**options, "remarks": options.get("remarks") or batch.reference, "occasion": item.item_reference or options.get("occasion")},
+        party_b=item.recipient,
+        amount=amount,
+        originator_conversation_id=originator_conversation_id,
+    )
+    if error:
+        _fail_item(item, error)
+        return ITEM_FAILED
+
+    try:
+        with transaction.atomic():
+            pr = B2CPaymentRequest.objects.create(
+                business=business,
+                bulk_item=item,
+                environment=environment,
+                originator_conversation_id=originator_conversation_id,
+                status=B2CPaymentRequest.STATUS_QUEUED,
+                request_payload=payload,
+                product_type=item.product_type,
+                amount=amount,
+            )
+    except IntegrityError:
+        # Created by an earlier run that crashed. Resend it only if Daraja never answered.
+        pr = B2CPaymentRequest.objects.get(originator_conversation_id=originator_conversation_id)
+        if pr.status != B2CPaymentRequest.STATUS_QUEUED or pr.conversation_id:
+            return _resume_item(item, pr)
+
+    if limiter is not None:
+        limiter.wait(business.id)
+
+    status, data = submit_payment_request(pr)
+    if status == 201:
+        item.status = ITEM_SUBMITTED
+        item.result = {"payment_request_id": str(pr.id), "response": pr.api_response_payload}
+    else:
+        item.status = ITEM_FAILED
+        item.result = data
+    item.save(update_fields=["status", "result", "updated_at"])
+    return item.status
+
+
+def requeue_stale_items(*, older_than_seconds: int) -> int:
+    """Re-queue `processing` items abandoned by a crashed executor before Daraja answered."""
+
+    cutoff = timezone.now() - timedelta(seconds=older_than_seconds)
+    return (
+        BulkPayoutItem.objects.filter(status=ITEM_PROCESSING, updated_at__lt=cutoff)
+        .exclude(Exists(_answered_requests().filter(bulk_item=OuterRef("pk"))))
+        .update(status=ITEM_QUEUED, updated_at=timezone.now())
+    )
+
+
+def make_rate_limiter() -> PerKeyRateLimiter:
+    return PerKeyRateLimiter(float(_setting("B2C_BULK_RATE_PER_BUSINESS", 5)))
+
+
+def run_once(
+    *,
+    batch_id=None,
+    limit: int | None = None,
+    concurrency: int | None = None,
+    limiter: PerKeyRateLimiter | None = None,
+) -> int:
+    """Claim and submit one chunk of queued items. Returns how many were claimed."""
+
+    limit = int(limit or _setting("B2C_BULK_CHUNK_SIZE", 100))
+    concurrency = int(concurrency or _setting("B2C_BULK_CONCURRENCY", 8))
+    limiter = limiter or make_rate_limiter()
+
+    qs = BulkPayoutItem.objects.all()
+    if batch_id:
+        qs = qs.filter(batch_id=batch_id)
+
+    item_ids = claim_queued(qs, limit=limit)
+    if not item_ids:
+        return 0
+
+    batch_ids = set(BulkPayoutItem.objects.filter(id__in=item_ids).values_list("batch_id", flat=True))
+    for bid in batch_ids:
+        refresh_batch_status(bid)
+
+    def _submit(item_id):
+        try:
+            return submit_item(item_id, limiter=limiter)
+        except Exception:
+            # Leave the item `processing`; requeue_stale_items() picks it up unless Daraja answered.
+            logger.exception("B2C bulk item %s failed to submit", item_id)
+            return ITEM_PROCESSING
+
+    run_bounded(_submit, item_ids, concurrency=concurrency)
+
+    for bid in batch_ids:
+        refresh_batch_status(bid)
+    return len(item_ids)
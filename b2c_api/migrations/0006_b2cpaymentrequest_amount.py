@@ -0,0 +1,40 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db import migrations, models
+
+
+def backfill_amount(apps, _schema_editor):
+    B2CPaymentRequest = apps.get_model("b2c_api", "B2CPaymentRequest")
+
+    pending = []
+    for pr in B2CPaymentRequest.objects.filter(amount__isnull=True).only("id", "request_payload").iterator(chunk_size=2000):
+        payload = pr.request_payload if isinstance(pr.request_payload, dict) else {}
+        try:
+            amount = Decimal(str(payload.get("Amount"))).quantize(Decimal("0.01"))
+        except (InvalidOperation, TypeError):
+            continue
+        if not amount.is_finite() or abs(amount) >= Decimal("1e10"):
+            continue
+        pr.amount = amount
+        pending.append(pr)
+        if len(pending) >= 500:
+            B2CPaymentRequest.objects.bulk_update(pending, ["amount"])
+            pending = []
+    if pending:
+        B2CPaymentRequest.objects.bulk_update(pending, ["amount"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('b2c_api', '0005_b2cpaymentrequest_internal_status_code_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='b2cpaymentrequest',
+            name='amount',
+            field=models.DecimalField(blank=True, db_index=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.RunPython(backfill_amount, migrations.RunPython.noop),
+    ]
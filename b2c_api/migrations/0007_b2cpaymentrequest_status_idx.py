@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-16 23:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('b2c_api', '0006_b2cpaymentrequest_amount'),
+        ('business_api', '0005_business_business_type'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='b2cpaymentrequest',
+            index=models.Index(fields=['status', 'created_at'], name='b2c_request_status_idx'),
+        ),
+    ]
@@ -104,9 +104,15 @@ class B2CPaymentRequest(models.Model):
 	internal_status_message = models.TextField(blank=True, default="")
 	transaction_id = models.CharField(max_length=100, blank=True, default="")
 	product_type = models.CharField(max_length=60, blank=True, default="")
+	# Copy of request_payload["Amount"] so reports can aggregate in SQL.
+	amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, db_index=True)
 
 	class Meta:
 		ordering = ["-created_at"]
+		indexes = [
+			# Reconciliation sweeps for requests stuck in `submitted`.
+			models.Index(fields=["status", "created_at"], name="b2c_request_status_idx"),
+		]
 
 	def __str__(self) -> str:
 		return f"B2C PaymentRequest {self.originator_conversation_id} ({self.status})"
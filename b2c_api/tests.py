@@ -1,16 +1,19 @@
 import json
 import os
 from datetime import timedelta
-from unittest.mock import patch
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, TestCase
 from django.utils import timezone
 
 from oauth2_provider.models import AccessToken, Application
 
 from business_api.models import Business
 from business_api.models import DarajaCredential, OAuthClientBusiness
+from services_common.daraja_tokens import clear_local_tokens
 
 
 class B2CBulkApiTests(TestCase):
@@ -80,9 +83,55 @@ class B2CBulkApiTests(TestCase):
 		self.assertEqual(detail_json["id"], batch_id)
 		self.assertEqual(len(detail_json["items"]), 2)
 
+	def test_bulk_create_streams_csv_and_reports_rejected_rows(self):
+		from b2c_api.models import BulkPayoutItem
+
+		body = "\n".join(
+			[
+				"recipient,amount,reference",
+				"254700000000,10,r1",
+				",5,missing-recipient",
+				"254711111111,abc,bad-amount",
+				"254722222222,7.25,r4",
+			]
+		)
+		with self.settings(BULK_INGEST_CHUNK_SIZE=1):
+			resp = self.client.post(
+				"/api/v1/b2c/bulk?reference=PAYROLL-CSV",
+				data=body,
+				content_type="text/csv",
+				HTTP_AUTHORIZATION=f"Bearer {self.access_token}",
+			)
+		self.assertEqual(resp.status_code, 201)
+		payload = resp.json()
+		self.assertEqual(payload["accepted"], 2)
+		self.assertEqual(payload["rejected"], 2)
+		self.assertEqual([r["row"] for r in payload["rejections"]], [2, 3])
+		self.assertEqual(payload["batch"]["reference"], "PAYROLL-CSV")
+		self.assertEqual(payload["batch"]["business_id"], str(self.business.id))
+		self.assertEqual(
+			list(BulkPayoutItem.objects.filter(batch_id=payload["batch"]["id"]).order_by("item_reference").values_list("item_reference", flat=True)),
+			["r1", "r4"],
+		)
+
+	def test_bulk_create_without_valid_rows_creates_nothing(self):
+		from b2c_api.models import BulkPayoutBatch
+
+		resp = self.client.post(
+			"/api/v1/b2c/bulk",
+			data='{"recipient": "254700000000", "amount": "-1"}\nnot json\n',
+			content_type="application/x-ndjson",
+			HTTP_AUTHORIZATION=f"Bearer {self.access_token}",
+		)
+		self.assertEqual(resp.status_code, 400)
+		self.assertEqual(resp.json()["rejected"], 2)
+		self.assertFalse(BulkPayoutBatch.objects.exists())
+
 
 class B2CSingleApiTests(TestCase):
 	def setUp(self):
+		cache.clear()
+		clear_local_tokens()
 		self.business = Business.objects.create(name="Shop A")
 		self.access_token, self.app = self._create_access_token(scope="b2c:write")
 		OAuthClientBusiness.objects.create(application=self.app, business=self.business)
@@ -133,8 +182,8 @@ class B2CSingleApiTests(TestCase):
 			"MPESA_B2C_API_BASE_URL": "https://sandbox.safaricom.co.ke",
 		},
 	)
-	@patch("b2c_api.views.requests.post")
-	@patch("b2c_api.views.requests.get")
+	@patch("b2c_api.views.outbound.post")
+	@patch("b2c_api.views.outbound.get")
 	def test_single_submits_and_persists(self, mock_get, mock_post):
 		class FakeResp:
 			def __init__(self, status_code, payload):
@@ -178,6 +227,75 @@ class B2CSingleApiTests(TestCase):
 		self.assertEqual(payload["payment_request"]["conversation_id"], "conv-1")
 		self.assertEqual(payload["payment_request"]["response_code"], "0")
 
+	@patch.dict(
+		os.environ,
+		{
+			"MPESA_B2C_INITIATOR_NAME": "test-initiator",
+			"MPESA_B2C_SECURITY_CREDENTIAL": "test-credential",
+			"MPESA_B2C_QUEUE_TIMEOUT_URL": "https://example.com/timeout",
+			"MPESA_B2C_RESULT_URL": "https://example.com/result",
+			"MPESA_B2C_PARTY_A": "600000",
+		},
+	)
+	@patch("b2c_api.views.outbound.post")
+	@patch("b2c_api.views.outbound.get")
+	def test_single_reuses_cached_access_token(self, mock_get, mock_post):
+		mock_get.return_value.status_code = 200
+		mock_get.return_value.json.return_value = {"access_token": "abc", "expires_in": "3599"}
+		mock_post.return_value.status_code = 200
+		mock_post.return_value.json.return_value = {"ResponseCode": "0", "ConversationID": "conv"}
+
+		headers = {"HTTP_AUTHORIZATION": f"Bearer {self.access_token}"}
+		for _ in range(3):
+			resp = self.client.post(
+				"/api/v1/b2c/single",
+				data=json.dumps({"party_b": "254700000000", "amount": "1"}),
+				content_type="application/json",
+				**headers,
+			)
+			self.assertEqual(resp.status_code, 201)
+
+		self.assertEqual(mock_get.call_count, 1)
+		self.assertEqual(mock_post.call_count, 3)
+		for call in mock_post.call_args_list:
+			self.assertEqual(call.kwargs["headers"]["Authorization"], "Bearer abc")
+
+	@patch.dict(
+		os.environ,
+		{
+			"MPESA_B2C_INITIATOR_NAME": "test-initiator",
+			"MPESA_B2C_SECURITY_CREDENTIAL": "test-credential",
+			"MPESA_B2C_QUEUE_TIMEOUT_URL": "https://example.com/timeout",
+			"MPESA_B2C_RESULT_URL": "https://example.com/result",
+			"MPESA_B2C_PARTY_A": "600000",
+		},
+	)
+	@patch("b2c_api.views.outbound.apost", new_callable=AsyncMock)
+	@patch("b2c_api.views.outbound.get")
+	async def test_async_single_awaits_daraja_and_persists(self, mock_get, mock_apost):
+		from b2c_api.models import B2CPaymentRequest
+		from b2c_api.views import single_paymentrequest_async
+
+		mock_get.return_value.status_code = 200
+		mock_get.return_value.json.return_value = {"access_token": "abc", "expires_in": "3599"}
+		mock_apost.return_value = MagicMock(status_code=200)
+		mock_apost.return_value.json.return_value = {"ResponseCode": "0", "ConversationID": "conv-async"}
+
+		request = AsyncRequestFactory().post(
+			"/api/v1/b2c/single",
+			data=json.dumps({"party_b": "254700000000", "amount": "1", "originator_conversation_id": "orig-async"}),
+			content_type="application/json",
+			headers={"Authorization": f"Bearer {self.access_token}"},
+		)
+		resp = await single_paymentrequest_async(request)
+
+		self.assertEqual(resp.status_code, 201)
+		self.assertEqual(json.loads(resp.content)["payment_request"]["conversation_id"], "conv-async")
+		mock_apost.assert_awaited_once()
+		self.assertEqual(mock_apost.call_args.kwargs["headers"]["Authorization"], "Bearer abc")
+		pr = await B2CPaymentRequest.objects.aget(originator_conversation_id="orig-async")
+		self.assertEqual(pr.status, B2CPaymentRequest.STATUS_SUBMITTED)
+
 	@patch.dict(os.environ, {}, clear=True)
 	def test_callback_result_updates_request(self):
 		from b2c_api.models import B2CPaymentRequest
@@ -210,6 +328,151 @@ class B2CSingleApiTests(TestCase):
 		self.assertEqual(pr.result_code, 0)
 		self.assertEqual(pr.transaction_id, "T123")
 
+	@patch.dict(
+		os.environ,
+		{
+			"MPESA_B2C_INITIATOR_NAME": "test-initiator",
+			"MPESA_B2C_SECURITY_CREDENTIAL": "test-credential",
+			"MPESA_B2C_QUEUE_TIMEOUT_URL": "https://example.com/timeout",
+			"MPESA_B2C_RESULT_URL": "https://example.com/result",
+			"MPESA_B2C_PARTY_A": "600000",
+		},
+	)
+	@patch("b2c_api.views.outbound.post")
+	@patch("b2c_api.views.outbound.get")
+	def test_bulk_executor_submits_items_and_rolls_up_batch(self, mock_get, mock_post):
+		from b2c_api.executor import run_once
+		from b2c_api.models import B2CPaymentRequest, BulkPayoutBatch
+
+		mock_get.return_value.status_code = 200
+		mock_get.return_value.json.return_value = {"access_token": "abc", "expires_in": "3599"}
+		mock_post.return_value.status_code = 200
+		mock_post.return_value.json.return_value = {"ResponseCode": "0", "ConversationID": "conv"}
+
+		headers = {"HTTP_AUTHORIZATION": f"Bearer {self.access_token}"}
+		create = self.client.post(
+			"/api/v1/b2c/bulk",
+			data=json.dumps(
+				{
+					"reference": "PAYROLL",
+					"items": [
+						{"recipient": "254700000000", "amount": "10"},
+						{"recipient": "254711111111", "amount": "20"},
+					],
+				}
+			),
+			content_type="application/json",
+			**headers,
+		)
+		self.assertEqual(create.status_code, 201)
+		batch = BulkPayoutBatch.objects.get(id=create.json()["batch"]["id"])
+
+		self.assertEqual(run_once(batch_id=batch.id, concurrency=1), 2)
+		self.assertEqual(run_once(batch_id=batch.id, concurrency=1), 0)
+		self.assertEqual(mock_post.call_count, 2)
+
+		batch.refresh_from_db()
+		self.assertEqual(batch.status, "processing")
+		self.assertEqual(set(batch.items.values_list("status", flat=True)), {"submitted"})
+
+		for index, pr in enumerate(B2CPaymentRequest.objects.filter(bulk_item__batch=batch).order_by("bulk_item_id")):
+			with self.captureOnCommitCallbacks(execute=True):
+				resp = self.client.post(
+					"/api/v1/b2c/callback/result",
+					data=json.dumps(
+						{
+							"Result": {
+								"OriginatorConversationID": pr.originator_conversation_id,
+								"ResultCode": 0 if index == 0 else 2001,
+								"ResultDesc": "done",
+							}
+						}
+					),
+					content_type="application/json",
+				)
+			self.assertEqual(resp.status_code, 200)
+
+		batch.refresh_from_db()
+		self.assertEqual(batch.status, "partially_completed")
+
+		# Only the successful payout reaches the daily rollup, keyed on the paying shortcode.
+		from mpesa_api.models import DailyTransactionRollup
+
+		rollup = DailyTransactionRollup.objects.get(direction="b2c_outgoing")
+		self.assertEqual((rollup.business_id, rollup.shortcode, rollup.count), (self.business.id, "600000", 1))
+		self.assertIn(rollup.amount, {Decimal("10.00"), Decimal("20.00")})
+
+	@patch.dict(
+		os.environ,
+		{
+			"MPESA_B2C_INITIATOR_NAME": "test-initiator",
+			"MPESA_B2C_SECURITY_CREDENTIAL": "test-credential",
+			"MPESA_B2C_QUEUE_TIMEOUT_URL": "https://example.com/timeout",
+			"MPESA_B2C_RESULT_URL": "https://example.com/result",
+			"MPESA_B2C_PARTY_A": "600000",
+		},
+	)
+	@patch("b2c_api.views.outbound.post")
+	@patch("b2c_api.views.outbound.get")
+	def test_bulk_executor_resends_requests_daraja_never_answered(self, mock_get, mock_post):
+		from b2c_api.executor import item_originator_conversation_id, requeue_stale_items, run_once
+		from b2c_api.models import B2CPaymentRequest, BulkPayoutBatch, BulkPayoutItem
+
+		mock_get.return_value.status_code = 200
+		mock_get.return_value.json.return_value = {"access_token": "abc", "expires_in": "3599"}
+		mock_post.return_value.status_code = 200
+		mock_post.return_value.json.return_value = {"ResponseCode": "0", "ConversationID": "conv-resent"}
+
+		batch = BulkPayoutBatch.objects.create(business=self.business, reference="PAYROLL")
+		accepted = BulkPayoutItem.objects.create(batch=batch, recipient="254700000000", amount=10)
+		crashed = BulkPayoutItem.objects.create(batch=batch, recipient="254711111111", amount=20)
+		reclaimed = BulkPayoutItem.objects.create(batch=batch, recipient="254722222222", amount=30, status="queued")
+
+		# An executor died: `accepted` and `reclaimed` were answered by Daraja, `crashed` only got its row.
+		for item, status, conversation_id in (
+			(accepted, B2CPaymentRequest.STATUS_SUBMITTED, "conv-1"),
+			(crashed, B2CPaymentRequest.STATUS_QUEUED, ""),
+			(reclaimed, B2CPaymentRequest.STATUS_SUBMITTED, "conv-3"),
+		):
+			oc_id = item_originator_conversation_id(item)
+			B2CPaymentRequest.objects.create(
+				business=self.business,
+				bulk_item=item,
+				environment="sandbox",
+				originator_conversation_id=oc_id,
+				status=status,
+				conversation_id=conversation_id,
+				request_payload={"OriginatorConversationID": oc_id, "Amount": int(item.amount)},
+				amount=item.amount,
+			)
+		stale = timezone.now() - timedelta(hours=1)
+		BulkPayoutItem.objects.filter(id__in=[accepted.id, crashed.id]).update(status="processing", updated_at=stale)
+
+		self.assertEqual(requeue_stale_items(older_than_seconds=60), 1)
+		self.assertEqual(run_once(batch_id=batch.id, concurrency=1), 2)
+
+		mock_post.assert_called_once()
+		self.assertEqual(mock_post.call_args.kwargs["json"]["OriginatorConversationID"], item_originator_conversation_id(crashed))
+		self.assertEqual(B2CPaymentRequest.objects.get(bulk_item=crashed).conversation_id, "conv-resent")
+		statuses = dict(BulkPayoutItem.objects.filter(batch=batch).values_list("id", "status"))
+		self.assertEqual(statuses, {accepted.id: "processing", crashed.id: "submitted", reclaimed.id: "submitted"})
+
+	@patch("b2c_api.views.outbound.post")
+	def test_bulk_executor_fails_fractional_amounts_instead_of_truncating(self, mock_post):
+		from b2c_api.executor import run_once
+		from b2c_api.models import B2CPaymentRequest, BulkPayoutBatch, BulkPayoutItem
+
+		batch = BulkPayoutBatch.objects.create(business=self.business, reference="LEGACY")
+		item = BulkPayoutItem.objects.create(batch=batch, recipient="254700000000", amount=Decimal("100.75"))
+
+		run_once(batch_id=batch.id, concurrency=1)
+
+		item.refresh_from_db()
+		self.assertEqual(item.status, "failed")
+		self.assertEqual(item.result["error"], "amount must be a whole number for B2C")
+		self.assertFalse(B2CPaymentRequest.objects.filter(bulk_item=item).exists())
+		mock_post.assert_not_called()
+
 	def test_single_list_requires_staff(self):
 		from b2c_api.models import B2CPaymentRequest
 
@@ -1,13 +1,18 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
 
+# Daraja-bound endpoints use their async views under ASGI (see ASYNC_VIEWS_ENABLED).
+single_paymentrequest = views.single_paymentrequest_async if settings.ASYNC_VIEWS_ENABLED else views.single_paymentrequest
+
+
 urlpatterns = [
 	path("bulk", views.bulk_create, name="b2c_bulk_create"),
 	path("bulk/", views.bulk_create),
-	path("single", views.single_paymentrequest, name="b2c_single_paymentrequest"),
-	path("single/", views.single_paymentrequest),
+	path("single", single_paymentrequest, name="b2c_single_paymentrequest"),
+	path("single/", single_paymentrequest),
 	path("single/list", views.single_list, name="b2c_single_list"),
 	path("single/list/", views.single_list),
 	path("single/<uuid:payment_request_id>", views.single_detail, name="b2c_single_detail"),
@@ -2,16 +2,26 @@ import os
 import uuid
 from decimal import Decimal, InvalidOperation
 
-import requests
-
+from asgiref.sync import sync_to_async
+from django.db import transaction
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
+from mpesa_api.models import CallbackInbox
+from services_common import outbound
 from services_common.auth import require_oauth2, require_staff
+from services_common.bulk_ingest import BulkUploadError, ingest_rows, parse_item_amount, read_bulk_upload
+from services_common.callback_dedup import deduplicated
+from services_common.callback_inbox import fast_ack
+from services_common.circuit_breaker import UpstreamUnavailable, unavailable_body
+from services_common.daraja_tokens import get_access_token as get_cached_access_token
+from services_common.daraja_tokens import invalidate_access_token, token_cache_key
 from services_common.http import json_body, parse_limit_param
+from services_common.rollups import b2c_contribution, record_change
 from services_common.tenancy import resolve_business_from_request
 from services_common.status_codes import apply_mapped_status, map_safaricom_status
 
+from .executor import ITEM_COMPLETED, ITEM_FAILED, ITEM_TIMEOUT, refresh_batch_status
 from .models import B2CPaymentRequest, BulkPayoutBatch, BulkPayoutItem
 
 
@@ -107,25 +117,55 @@ def _get_daraja_credential(business_id, environment: str):
     return cred
 
 
-def _get_access_token(cred):
+def _token_cache_key(cred) -> str:
     token_url = (cred.token_url or "").strip() or _get_default_token_url(cred.environment)
-    resp = requests.get(
-        token_url,
-        auth=(cred.consumer_key, cred.consumer_secret),
-        timeout=30,
+    return token_cache_key(
+        environment=cred.environment,
+        credential_id=cred.id,
+        consumer_key=cred.consumer_key,
+        token_url=token_url,
     )
-    try:
-        data = resp.json()
-    except Exception:
-        data = {"raw": (resp.text or "")}
 
-    if resp.status_code < 200 or resp.status_code >= 300:
-        raise RuntimeError(f"Token request failed ({resp.status_code}): {data}")
 
-    token = data.get("access_token") if isinstance(data, dict) else None
-    if not token:
-        raise RuntimeError(f"Token response missing access_token: {data}")
-    return str(token)
+def _get_access_token(cred):
+    token_url = (cred.token_url or "").strip() or _get_default_token_url(cred.environment)
+
+    def _fetch():
+        resp = outbound.get(
+            token_url,
+            auth=(cred.consumer_key, cred.consumer_secret),
+        )
+        try:
+            data = resp.json()
+        except Exception:
+            data = {"raw": (resp.text or "")}
+
+        if resp.status_code < 200 or resp.status_code >= 300:
+            raise RuntimeError(f"Token request failed ({resp.status_code}): {data}")
+
+        token = data.get("access_token") if isinstance(data, dict) else None
+        if not token:
+            raise RuntimeError(f"Token response missing access_token: {data}")
+        return str(token), data.get("expires_in")
+
+    return get_cached_access_token(_token_cache_key(cred), _fetch)
+
+
+def _parse_bulk_item(raw: dict):
+    recipient = str(raw.get("recipient") or raw.get("phone_number") or "").strip()
+    if not recipient:
+        return None, "recipient is required"
+    amount, error = parse_item_amount(raw.get("amount"))
+    if error:
+        return None, error
+
+    return {
+        "recipient": recipient,
+        "amount": amount,
+        "currency": str(raw.get("currency") or "KES").strip().upper()[:3] or "KES",
+        "product_type": str(raw.get("product_type") or "").strip()[:60],
+        "item_reference": str(raw.get("reference") or "").strip()[:64],
+    }, None
 
 
 @require_oauth2(scopes=["b2c:write"])
@@ -134,57 +174,38 @@ def bulk_create(request):
     if request.method != "POST":
         return JsonResponse({"error": "Method not allowed"}, status=405)
 
-    body = json_body(request)
-    items = body.get("items")
-    if not isinstance(items, list) or len(items) == 0:
-        return JsonResponse({"error": "items must be a non-empty list"}, status=400)
+    try:
+        batch_fields, rows = read_bulk_upload(request)
+    except BulkUploadError as e:
+        return JsonResponse({"error": str(e)}, status=400)
 
-    reference = str(body.get("reference", "")).strip()[:64]
+    reference = str(batch_fields.get("reference", "")).strip()[:64]
 
-    business, error = resolve_business_from_request(request, body.get("business_id"))
+    business, error = resolve_business_from_request(request, batch_fields.get("business_id"))
     if error:
         return error
 
-    meta = {k: v for k, v in body.items() if k not in {"items"}}
-    batch = BulkPayoutBatch.objects.create(reference=reference, meta=meta, business=business)
-
-    created = 0
-    for raw in items:
-        if not isinstance(raw, dict):
-            continue
-        recipient = str(raw.get("recipient") or raw.get("phone_number") or "").strip()
-        amount_raw = raw.get("amount")
-        currency = str(raw.get("currency") or "KES").strip().upper()[:3]
-        product_type = str(raw.get("product_type") or "").strip()[:60]
-        item_reference = str(raw.get("reference") or "").strip()[:64]
-
-        if not recipient:
-            continue
-        try:
-            amount = Decimal(str(amount_raw))
-        except (InvalidOperation, TypeError):
-            continue
-        if amount <= 0:
-            continue
-
-        BulkPayoutItem.objects.create(
-            batch=batch,
-            recipient=recipient,
-            amount=amount,
-            currency=currency or "KES",
-            product_type=product_type,
-            item_reference=item_reference,
+    with transaction.atomic():
+        batch = BulkPayoutBatch.objects.create(reference=reference, meta=batch_fields, business=business)
+        accepted, rejected, rejections = ingest_rows(
+            rows,
+            parse_row=_parse_bulk_item,
+            build=lambda fields: BulkPayoutItem(batch=batch, **fields),
+            model=BulkPayoutItem,
         )
-        created += 1
+        if accepted == 0:
+            transaction.set_rollback(True)
 
-    if created == 0:
-        batch.delete()
-        return JsonResponse({"error": "No valid items provided"}, status=400)
+    if accepted == 0:
+        return JsonResponse({"error": "No valid items provided", "rejected": rejected, "rejections": rejections}, status=400)
 
     return JsonResponse(
         {
             "ok": True,
             "batch": _serialize_batch(batch),
+            "accepted": accepted,
+            "rejected": rejected,
+            "rejections": rejections,
         },
         status=201,
     )
@@ -207,30 +228,90 @@ def single_paymentrequest(request):
     if request.method != "POST":
         return JsonResponse({"error": "Method not allowed"}, status=405)
 
+    pr, error = _create_payment_request(request)
+    if error is not None:
+        return error
+
+    status, data = submit_payment_request(pr)
+    return JsonResponse(data, status=status)
+
+
+@require_oauth2(scopes=["b2c:write"])
+@csrf_exempt
+async def single_paymentrequest_async(request):
+    """`single_paymentrequest` for ASGI deployments."""
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    pr, error = await sync_to_async(_create_payment_request)(request)
+    if error is not None:
+        return error
+
+    status, data = await asubmit_payment_request(pr)
+    return JsonResponse(data, status=status)
+
+
+def _create_payment_request(request):
+    """Validate the request and persist a queued B2CPaymentRequest.
+
+    Returns (payment_request, None) or (None, error_response).
+    """
     body = json_body(request)
 
     business, error = resolve_business_from_request(request, body.get("business_id"))
     if error:
-        return error
+        return None, error
 
     environment = str(body.get("environment") or "sandbox").strip().lower()
     if environment not in {"sandbox", "production"}:
-        return JsonResponse({"error": "environment must be sandbox or production"}, status=400)
+        return None, JsonResponse({"error": "environment must be sandbox or production"}, status=400)
 
     party_b = str(body.get("party_b") or body.get("recipient") or "").strip()
     if not party_b:
-        return JsonResponse({"error": "party_b is required"}, status=400)
+        return None, JsonResponse({"error": "party_b is required"}, status=400)
 
     amount_raw = body.get("amount")
     try:
         amount_dec = Decimal(str(amount_raw))
     except (InvalidOperation, TypeError):
-        return JsonResponse({"error": "amount must be a number"}, status=400)
+        return None, JsonResponse({"error": "amount must be a number"}, status=400)
     if amount_dec <= 0:
-        return JsonResponse({"error": "amount must be > 0"}, status=400)
+        return None, JsonResponse({"error": "amount must be > 0"}, status=400)
     amount = int(amount_dec)
 
-    party_a = str(body.get("party_a") or _env("MPESA_B2C_PARTY_A", "")).strip()
+    originator_conversation_id = str(body.get("originator_conversation_id") or "").strip()
+    if not originator_conversation_id:
+        originator_conversation_id = str(uuid.uuid4())
+
+    payment_payload, payload_error = build_payment_payload(
+        business,
+        body,
+        party_b=party_b,
+        amount=amount,
+        originator_conversation_id=originator_conversation_id,
+    )
+    if payload_error:
+        return None, JsonResponse({"error": payload_error}, status=400)
+
+    pr = B2CPaymentRequest.objects.create(
+        business=business,
+        environment=environment,
+        originator_conversation_id=originator_conversation_id,
+        status=B2CPaymentRequest.STATUS_QUEUED,
+        request_payload=payment_payload,
+        product_type=str(body.get("product_type") or "").strip()[:60],
+        amount=amount,
+    )
+    return pr, None
+
+
+def build_payment_payload(business, options: dict, *, party_b: str, amount: int, originator_conversation_id: str):
+    """Build a B2C v3 paymentrequest payload from request options + env defaults.
+
+    Returns (payload, None) or (None, error message).
+    """
+
+    party_a = str(options.get("party_a") or _env("MPESA_B2C_PARTY_A", "")).strip()
     if not party_a:
         # Try first active shortcode as a convenience
         try:
@@ -239,37 +320,23 @@ def single_paymentrequest(request):
         except Exception:
             party_a = ""
     if not party_a:
-        return JsonResponse({"error": "party_a is required (or set MPESA_B2C_PARTY_A)"}, status=400)
+        return None, "party_a is required (or set MPESA_B2C_PARTY_A)"
 
-    initiator_name = str(body.get("initiator_name") or _env("MPESA_B2C_INITIATOR_NAME", "")).strip()
-    security_credential = str(body.get("security_credential") or _env("MPESA_B2C_SECURITY_CREDENTIAL", "")).strip()
+    initiator_name = str(options.get("initiator_name") or _env("MPESA_B2C_INITIATOR_NAME", "")).strip()
+    security_credential = str(options.get("security_credential") or _env("MPESA_B2C_SECURITY_CREDENTIAL", "")).strip()
     if not initiator_name or not security_credential:
-        return JsonResponse(
-            {
-                "error": "initiator_name and security_credential are required (or set MPESA_B2C_INITIATOR_NAME / MPESA_B2C_SECURITY_CREDENTIAL)",
-            },
-            status=400,
-        )
+        return None, "initiator_name and security_credential are required (or set MPESA_B2C_INITIATOR_NAME / MPESA_B2C_SECURITY_CREDENTIAL)"
 
-    queue_timeout_url = str(body.get("queue_timeout_url") or _env("MPESA_B2C_QUEUE_TIMEOUT_URL", "")).strip()
-    result_url = str(body.get("result_url") or _env("MPESA_B2C_RESULT_URL", "")).strip()
+    queue_timeout_url = str(options.get("queue_timeout_url") or _env("MPESA_B2C_QUEUE_TIMEOUT_URL", "")).strip()
+    result_url = str(options.get("result_url") or _env("MPESA_B2C_RESULT_URL", "")).strip()
     if not queue_timeout_url or not result_url:
-        return JsonResponse(
-            {
-                "error": "queue_timeout_url and result_url are required (or set MPESA_B2C_QUEUE_TIMEOUT_URL / MPESA_B2C_RESULT_URL)",
-            },
-            status=400,
-        )
+        return None, "queue_timeout_url and result_url are required (or set MPESA_B2C_QUEUE_TIMEOUT_URL / MPESA_B2C_RESULT_URL)"
 
-    command_id = str(body.get("command_id") or _env("MPESA_B2C_COMMAND_ID", "BusinessPayment")).strip()
-    remarks = str(body.get("remarks") or body.get("Remarks") or "").strip()[:200]
-    occasion = str(body.get("occasion") or body.get("Occassion") or "").strip()[:200]
+    command_id = str(options.get("command_id") or _env("MPESA_B2C_COMMAND_ID", "BusinessPayment")).strip()
+    remarks = str(options.get("remarks") or options.get("Remarks") or "").strip()[:200]
+    occasion = str(options.get("occasion") or options.get("Occassion") or "").strip()[:200]
 
-    originator_conversation_id = str(body.get("originator_conversation_id") or "").strip()
-    if not originator_conversation_id:
-        originator_conversation_id = str(uuid.uuid4())
-
-    payment_payload = {
+    return {
         "OriginatorConversationID": originator_conversation_id,
         "InitiatorName": initiator_name,
         "SecurityCredential": security_credential,
@@ -281,77 +348,106 @@ def single_paymentrequest(request):
         "QueueTimeOutURL": queue_timeout_url,
         "ResultURL": result_url,
         "Occassion": occasion,
-    }
+    }, None
 
-    pr = B2CPaymentRequest.objects.create(
-        business=business,
-        environment=environment,
-        originator_conversation_id=originator_conversation_id,
-        status=B2CPaymentRequest.STATUS_QUEUED,
-        request_payload=payment_payload,
-        product_type=str(body.get("product_type") or "").strip()[:60],
-    )
+
+def submit_payment_request(pr: B2CPaymentRequest):
+    """Send a persisted B2CPaymentRequest to Daraja and record the outcome.
+
+    Returns (http_status, response_body) for the integrator-facing response;
+    201 means Safaricom accepted the request.
+    """
 
     try:
-        cred = _get_daraja_credential(business.id, environment)
-        if not cred:
-            pr.status = B2CPaymentRequest.STATUS_ERROR
-            pr.api_error_payload = {"error": f"No active DarajaCredential for business/environment ({environment})"}
-            pr.save(update_fields=["status", "api_error_payload", "updated_at"])
-            return JsonResponse({"error": "Daraja credentials not configured for this business"}, status=400)
-
-        token = _get_access_token(cred)
-
-        payment_url = _get_paymentrequest_url(environment)
-        resp = requests.post(
-            payment_url,
-            json=payment_payload,
-            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
-            timeout=30,
-        )
-        try:
-            data = resp.json()
-        except Exception:
-            data = {"raw": (resp.text or "")}
+        target, error = _payment_request_target(pr)
+        if error is not None:
+            return error
+        cred, url, headers = target
+        resp = outbound.post(url, json=pr.request_payload, headers=headers)
+        return _record_payment_response(pr, cred, resp)
+    except Exception as e:
+        return _record_payment_error(pr, e)
 
-        if resp.status_code < 200 or resp.status_code >= 300:
-            pr.status = B2CPaymentRequest.STATUS_ERROR
-            pr.api_error_payload = data if isinstance(data, dict) else {"error": data}
-            pr.save(update_fields=["status", "api_error_payload", "updated_at"])
-            return JsonResponse({"error": "Safaricom API error", "details": pr.api_error_payload}, status=502)
-
-        pr.status = B2CPaymentRequest.STATUS_SUBMITTED
-        pr.api_response_payload = data if isinstance(data, dict) else {"data": data}
-        if isinstance(data, dict):
-            pr.conversation_id = str(data.get("ConversationID") or "")
-            pr.response_code = str(data.get("ResponseCode") or "")
-            pr.response_description = str(data.get("ResponseDescription") or "")
-        pr.save(
-            update_fields=[
-                "status",
-                "api_response_payload",
-                "conversation_id",
-                "response_code",
-                "response_description",
-                "updated_at",
-            ]
-        )
 
-        mapped = map_safaricom_status(code=pr.response_code, message=pr.response_description)
-        return JsonResponse(
-            {
-                "ok": True,
-                "status_code": mapped.status_code,
-                "status_message": mapped.status_message,
-                "payment_request": _serialize_payment_request(pr),
-            },
-            status=201,
-        )
+async def asubmit_payment_request(pr: B2CPaymentRequest):
+    """Async `submit_payment_request()`: the Daraja call is awaited, DB work runs in a thread."""
+
+    try:
+        target, error = await sync_to_async(_payment_request_target)(pr)
+        if error is not None:
+            return error
+        cred, url, headers = target
+        resp = await outbound.apost(url, json=pr.request_payload, headers=headers)
+        return await sync_to_async(_record_payment_response)(pr, cred, resp)
     except Exception as e:
+        return await sync_to_async(_record_payment_error)(pr, e)
+
+
+def _payment_request_target(pr: B2CPaymentRequest):
+    """Returns ((credential, url, headers), None) or (None, (http_status, response_body))."""
+
+    cred = _get_daraja_credential(pr.business_id, pr.environment)
+    if not cred:
+        pr.status = B2CPaymentRequest.STATUS_ERROR
+        pr.api_error_payload = {"error": f"No active DarajaCredential for business/environment ({pr.environment})"}
+        pr.save(update_fields=["status", "api_error_payload", "updated_at"])
+        return None, (400, {"error": "Daraja credentials not configured for this business"})
+
+    token = _get_access_token(cred)
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    return (cred, _get_paymentrequest_url(pr.environment), headers), None
+
+
+def _record_payment_response(pr: B2CPaymentRequest, cred, resp):
+    try:
+        data = resp.json()
+    except Exception:
+        data = {"raw": (resp.text or "")}
+
+    if resp.status_code == 401:
+        # Token was revoked/expired upstream before our refresh margin.
+        invalidate_access_token(_token_cache_key(cred))
+
+    if resp.status_code < 200 or resp.status_code >= 300:
         pr.status = B2CPaymentRequest.STATUS_ERROR
-        pr.api_error_payload = {"error": str(e)}
+        pr.api_error_payload = data if isinstance(data, dict) else {"error": data}
         pr.save(update_fields=["status", "api_error_payload", "updated_at"])
-        return JsonResponse({"error": "Failed to submit", "details": pr.api_error_payload}, status=502)
+        return 502, {"error": "Safaricom API error", "details": pr.api_error_payload}
+
+    pr.status = B2CPaymentRequest.STATUS_SUBMITTED
+    pr.api_response_payload = data if isinstance(data, dict) else {"data": data}
+    if isinstance(data, dict):
+        pr.conversation_id = str(data.get("ConversationID") or "")
+        pr.response_code = str(data.get("ResponseCode") or "")
+        pr.response_description = str(data.get("ResponseDescription") or "")
+    pr.save(
+        update_fields=[
+            "status",
+            "api_response_payload",
+            "conversation_id",
+            "response_code",
+            "response_description",
+            "updated_at",
+        ]
+    )
+
+    mapped = map_safaricom_status(code=pr.response_code, message=pr.response_description)
+    return 201, {
+        "ok": True,
+        "status_code": mapped.status_code,
+        "status_message": mapped.status_message,
+        "payment_request": _serialize_payment_request(pr),
+    }
+
+
+def _record_payment_error(pr: B2CPaymentRequest, error: Exception):
+    pr.status = B2CPaymentRequest.STATUS_ERROR
+    pr.api_error_payload = {"error": str(error)}
+    pr.save(update_fields=["status", "api_error_payload", "updated_at"])
+    if isinstance(error, UpstreamUnavailable):
+        # Not sent: the circuit for this Daraja endpoint is open (or at its concurrency limit).
+        return 503, unavailable_body(error)
+    return 502, {"error": "Failed to submit", "details": pr.api_error_payload}
 
 
 def _extract_originator_conversation_id(payload: dict) -> str:
@@ -376,8 +472,15 @@ def callback_result(request):
     """ResultURL callback for B2C paymentrequest."""
     if request.method != "POST":
         return JsonResponse({"error": "Method not allowed"}, status=405)
+    ack = fast_ack(request, CallbackInbox.KIND_B2C_RESULT)
+    if ack is not None:
+        return ack
+    return apply_callback_result(json_body(request), remote_addr=request.META.get("REMOTE_ADDR"))
 
-    body = json_body(request)
+
+@deduplicated(CallbackInbox.KIND_B2C_RESULT)
+def apply_callback_result(body, *, remote_addr=None):
+    """Apply a B2C result payload (also replayed by the callback inbox worker)."""
     if not isinstance(body, dict):
         return JsonResponse({"error": "Invalid JSON"}, status=400)
 
@@ -390,6 +493,7 @@ def callback_result(request):
     except B2CPaymentRequest.DoesNotExist:
         return JsonResponse({"error": "Unknown OriginatorConversationID"}, status=404)
 
+    before = b2c_contribution(pr)
     result = body.get("Result") if isinstance(body.get("Result"), dict) else {}
     pr.callback_result_payload = body
     pr.status = B2CPaymentRequest.STATUS_RESULT
@@ -417,22 +521,95 @@ def callback_result(request):
             "updated_at",
         ]
     )
-
-    if pr.bulk_item_id:
-        try:
-            item = BulkPayoutItem.objects.get(id=pr.bulk_item_id)
-            item.result = body
-            if pr.result_code == 0:
-                item.status = "completed"
-            else:
-                item.status = "failed"
-            item.save(update_fields=["result", "status", "updated_at"])
-        except Exception:
-            pass
+    record_change(before, b2c_contribution(pr))
+    _sync_bulk_item(pr, body, ITEM_COMPLETED if pr.result_code == 0 else ITEM_FAILED)
 
     return JsonResponse({"ok": True})
 
 
+def _sync_bulk_item(pr, body, item_status):
+    if not pr.bulk_item_id:
+        return
+    try:
+        item = BulkPayoutItem.objects.get(id=pr.bulk_item_id)
+        item.result = body
+        item.status = item_status
+        item.save(update_fields=["result", "status", "updated_at"])
+        refresh_batch_status(item.batch_id)
+    except Exception:
+        pass
+
+
+# Transaction Status `TransactionStatus` values, lower-cased.
+_TXN_STATUS_COMPLETED = {"completed"}
+_TXN_STATUS_FAILED = {"declined", "failed", "cancelled", "canceled", "expired", "reversed"}
+
+
+def apply_status_query_result(conversation_id, *, result_code, result_desc, result_parameters, body):
+    """Finalise a submitted B2C request from a Transaction Status result.
+
+    Called by the C2B transaction status result handler when the query was made
+    for a B2C ConversationID (see `reconcile_pending_payments`). Only a successful
+    query (ResultCode 0) says anything about the payout: its `TransactionStatus`
+    parameter decides the outcome and `ReceiptNo` is the M-Pesa receipt. A failed
+    query (bad initiator or credential, transaction not found, ...) or an
+    unrecognised status leaves the request `submitted` for the next sweep.
+    Requests that already have a result are left alone. Returns the number of
+    requests updated.
+    """
+    if not conversation_id or result_code != 0:
+        return 0
+
+    params = result_parameters if isinstance(result_parameters, dict) else {}
+    transaction_status = str(params.get("TransactionStatus") or "").strip()
+    if transaction_status.lower() in _TXN_STATUS_COMPLETED:
+        payout_code = 0
+    elif transaction_status.lower() in _TXN_STATUS_FAILED:
+        payout_code = None
+    else:
+        return 0
+    receipt = str(params.get("ReceiptNo") or "").strip()
+    reason = str(params.get("ReasonType") or "").strip()
+    payout_desc = f"Transaction status: {transaction_status}" + (f" ({reason})" if reason else "")
+
+    updated = 0
+    for pr in B2CPaymentRequest.objects.filter(conversation_id=conversation_id, status=B2CPaymentRequest.STATUS_SUBMITTED):
+        before = b2c_contribution(pr)
+        pr.status = B2CPaymentRequest.STATUS_RESULT
+        pr.result_code = payout_code
+        pr.result_desc = payout_desc if payout_code is None else (result_desc or payout_desc)
+        if payout_code == 0:
+            apply_mapped_status(
+                pr,
+                external_system="safaricom",
+                external_code=0,
+                external_message=pr.result_desc,
+            )
+        else:
+            apply_mapped_status(
+                pr,
+                external_system="gateway",
+                external_code=f"TXN_STATUS_{transaction_status.upper()}",
+                external_message=payout_desc,
+            )
+        pr.transaction_id = receipt or pr.transaction_id
+        pr.save(
+            update_fields=[
+                "status",
+                "result_code",
+                "result_desc",
+                "internal_status_code",
+                "internal_status_message",
+                "transaction_id",
+                "updated_at",
+            ]
+        )
+        record_change(before, b2c_contribution(pr))
+        _sync_bulk_item(pr, body, ITEM_COMPLETED if payout_code == 0 else ITEM_FAILED)
+        updated += 1
+    return updated
+
+
 @csrf_exempt
 def callback_timeout(request):
     """QueueTimeOutURL callback for B2C paymentrequest."""
@@ -452,18 +629,12 @@ def callback_timeout(request):
     except B2CPaymentRequest.DoesNotExist:
         return JsonResponse({"error": "Unknown OriginatorConversationID"}, status=404)
 
+    before = b2c_contribution(pr)
     pr.callback_timeout_payload = body
     pr.status = B2CPaymentRequest.STATUS_TIMEOUT
     pr.save(update_fields=["callback_timeout_payload", "status", "updated_at"])
-
-    if pr.bulk_item_id:
-        try:
-            item = BulkPayoutItem.objects.get(id=pr.bulk_item_id)
-            item.result = body
-            item.status = "timeout"
-            item.save(update_fields=["result", "status", "updated_at"])
-        except Exception:
-            pass
+    record_change(before, b2c_contribution(pr))
+    _sync_bulk_item(pr, body, ITEM_TIMEOUT)
 
     return JsonResponse({"ok": True})
 
@@ -0,0 +1,49 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from oauth2_provider.models import AccessToken
+
+from services_common import rollups
+from services_common.auth import invalidate_oauth2_tokens
+
+from .models import Business, MpesaShortcode, OAuthClientBusiness
+
+
+def _invalidate(tokens) -> None:
+    tokens = [t for t in tokens if t]
+    if not tokens:
+        return
+    # Drop now for this connection, and again after commit so no other worker
+    # re-caches the pre-change row in between.
+    invalidate_oauth2_tokens(tokens)
+    transaction.on_commit(lambda: invalidate_oauth2_tokens(tokens))
+
+
+def _tokens_for_applications(application_ids) -> list[str]:
+    return list(AccessToken.objects.filter(application_id__in=list(application_ids)).values_list("token", flat=True))
+
+
+@receiver(post_save, sender=AccessToken)
+@receiver(post_delete, sender=AccessToken)
+def _access_token_changed(sender, instance, **kwargs):
+    _invalidate([instance.token])
+
+
+@receiver(post_save, sender=OAuthClientBusiness)
+@receiver(post_delete, sender=OAuthClientBusiness)
+def _client_binding_changed(sender, instance, **kwargs):
+    _invalidate(_tokens_for_applications([instance.application_id]))
+
+
+@receiver(post_save, sender=Business)
+def _business_changed(sender, instance, created, **kwargs):
+    if created:
+        return
+    app_ids = OAuthClientBusiness.objects.filter(business=instance).values_list("application_id", flat=True)
+    _invalidate(_tokens_for_applications(app_ids))
+
+
+@receiver(post_save, sender=MpesaShortcode)
+@receiver(post_delete, sender=MpesaShortcode)
+def _shortcode_changed(sender, instance, **kwargs):
+    rollups.forget_shortcode(instance.id)
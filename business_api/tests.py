@@ -1,4 +1,7 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from django.utils import timezone
 
@@ -89,3 +92,51 @@ class BusinessOnboardingTests(TestCase):
             HTTP_AUTHORIZATION=f"Bearer {self.token}",
         )
         self.assertEqual(resp.status_code, 403)
+
+
+class OAuthTokenCacheTests(TestCase):
+    def setUp(self):
+        self.business = Business.objects.create(name="Cached Biz")
+        self.app = Application.objects.create(
+            user=None,
+            name="client",
+            client_id="cid-cache",
+            client_secret="secret",
+            client_type=Application.CLIENT_CONFIDENTIAL,
+            authorization_grant_type=Application.GRANT_CLIENT_CREDENTIALS,
+            skip_authorization=True,
+        )
+        OAuthClientBusiness.objects.create(application=self.app, business=self.business)
+        self.token = "tok-cache"
+        AccessToken.objects.create(
+            token=self.token,
+            application=self.app,
+            expires=timezone.now() + timezone.timedelta(hours=1),
+            scope="business:read",
+        )
+
+    def _get_onboarding(self):
+        return self.client.get("/api/v1/business/onboarding", HTTP_AUTHORIZATION=f"Bearer {self.token}")
+
+    def test_validated_token_and_binding_are_cached(self):
+        self.assertEqual(self._get_onboarding().status_code, 200)
+
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self._get_onboarding()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json().get("business", {}).get("name"), "Cached Biz")
+
+        sql = " ".join(q["sql"] for q in ctx.captured_queries)
+        self.assertNotIn("oauth2_provider_accesstoken", sql)
+        self.assertNotIn("business_api_oauthclientbusiness", sql)
+
+    def test_revoking_client_drops_cached_token(self):
+        self.assertEqual(self._get_onboarding().status_code, 200)
+
+        admin = get_user_model().objects.create_superuser(username="root", password="pw", email="root@example.invalid")
+        self.client.force_login(admin)
+        resp = self.client.post(f"/api/v1/maintainer/clients/{self.app.client_id}/revoke")
+        self.assertEqual(resp.status_code, 200)
+        self.client.logout()
+
+        self.assertEqual(self._get_onboarding().status_code, 401)
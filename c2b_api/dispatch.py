@@ -0,0 +1,218 @@
+"""Asynchronous STK push dispatch.
+
+With `STK_PUSH_ASYNC` (or `"async": true` in the request) `stk_push` only
+persists a queued `StkPushInitiation` and returns 202. The Daraja call is made
+after commit on a small in-process thread pool; the `StkPushInitiation` table
+is the queue, so rows left behind by a restart are picked up by
+`python manage.py dispatch_stk_pushes`.
+
+Each row is claimed with a conditional UPDATE (queued -> dispatching), so a row
+is sent at most once even if the pool and the command race. Rows stuck in
+`dispatching` are never resent automatically: an STK prompt is not idempotent.
+Instead `expire_stale_dispatching()` (run by the same command) moves rows that
+have been dispatching for longer than `STK_PUSH_DISPATCHING_TIMEOUT_SECONDS`
+to `unknown`, so the status endpoint gives callers a final answer. A transport
+error after the request may have left (read timeout, connection reset) is
+`unknown` too; `failed` means Daraja was provably never reached.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from urllib3.exceptions import NewConnectionError
+
+from mpesa_api.models import StkPushInitiation
+from mpesa_api.mpesa_credentials import LipanaMpesaPassword, MpesaC2bCredential
+from services_common import outbound
+
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+STALE_DISPATCHING_ERROR = (
+    "Dispatch did not complete (worker stopped mid-call); the STK prompt may or may not "
+    "have reached the customer. Check for a payment before retrying."
+)
+UNCERTAIN_SEND_ERROR = (
+    "No response from Daraja ({error}); the STK prompt may or may not have reached the "
+    "customer. Check for a payment before retrying."
+)
+
+
+def _dispatch_workers() -> int:
+    try:
+        return max(int(getattr(settings, "STK_PUSH_DISPATCH_WORKERS", 4)), 0)
+    except (TypeError, ValueError):
+        return 4
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=_dispatch_workers(), thread_name_prefix="stk-dispatch")
+    return _executor
+
+
+def _stk_push_target() -> tuple[str, dict]:
+    access_token = MpesaC2bCredential.get_access_token()
+    api_url = os.getenv("LIPA_NA_MPESA_ONLINE_URL")
+    if not access_token or not api_url:
+        raise RuntimeError("Missing access token or LIPA_NA_MPESA_ONLINE_URL")
+    return api_url, {"Authorization": f"Bearer {access_token}"}
+
+
+def _stk_push_response_body(response) -> dict:
+    try:
+        response_data = response.json()
+    except Exception:
+        response_data = {"error": "Invalid JSON response", "status_code": response.status_code}
+    return response_data if isinstance(response_data, dict) else {"response": response_data}
+
+
+def post_stk_push(payload: dict) -> dict:
+    """Send an STK push payload to Daraja and return the (JSON) response body."""
+
+    api_url, headers = _stk_push_target()
+    return _stk_push_response_body(outbound.post(api_url, json=payload, headers=headers))
+
+
+async def apost_stk_push(payload: dict) -> dict:
+    """Async `post_stk_push()` (the access token usually comes from cache)."""
+
+    api_url, headers = await sync_to_async(_stk_push_target)()
+    return _stk_push_response_body(await outbound.apost(api_url, json=payload, headers=headers))
+
+
+def _never_sent(error: Exception) -> bool:
+    """True when the STK request provably did not reach Daraja."""
+
+    if isinstance(error, (outbound.UpstreamUnavailable, requests.ConnectTimeout)):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def enqueue_stk_push(initiation_id) -> None:
+    """Dispatch a queued initiation once the current transaction commits."""
+
+    def _submit():
+        if _dispatch_workers() == 0:
+            dispatch_stk_push(initiation_id)
+            return
+        _get_executor().submit(_run_in_worker, initiation_id)
+
+    transaction.on_commit(_submit)
+
+
+def _run_in_worker(initiation_id) -> None:
+    close_old_connections()
+    try:
+        dispatch_stk_push(initiation_id)
+    finally:
+        close_old_connections()
+
+
+def dispatch_stk_push(initiation_id) -> bool:
+    """Send one queued initiation. Returns False if it was not (or no longer) queued."""
+
+    claimed = StkPushInitiation.objects.filter(id=initiation_id, status=StkPushInitiation.STATUS_QUEUED).update(
+        status=StkPushInitiation.STATUS_DISPATCHING,
+        attempts=F("attempts") + 1,
+        dispatched_at=timezone.now(),
+        updated_at=timezone.now(),
+    )
+    if not claimed:
+        return False
+
+    initiation = StkPushInitiation.objects.select_related("shortcode").get(id=initiation_id)
+    payload = dict(initiation.request_payload or {})
+
+    try:
+        # The Daraja password embeds a timestamp; regenerate it at send time.
+        password, timestamp = LipanaMpesaPassword.generate_password(
+            business_shortcode=str(payload.get("BusinessShortCode") or "") or None,
+            passkey=initiation.shortcode.lipa_passkey if initiation.shortcode else None,
+        )
+        payload["Password"] = password
+        payload["Timestamp"] = timestamp
+        api_url, headers = _stk_push_target()
+    except Exception as e:
+        initiation.status = StkPushInitiation.STATUS_FAILED
+        initiation.last_error = str(e)
+        initiation.save(update_fields=["status", "last_error", "updated_at"])
+        return True
+
+    try:
+        response_data = _stk_push_response_body(outbound.post(api_url, json=payload, headers=headers))
+    except Exception as e:
+        if _never_sent(e):
+            initiation.status = StkPushInitiation.STATUS_FAILED
+            initiation.last_error = str(e)
+        else:
+            initiation.status = StkPushInitiation.STATUS_UNKNOWN
+            initiation.last_error = UNCERTAIN_SEND_ERROR.format(error=e)
+        initiation.save(update_fields=["status", "last_error", "updated_at"])
+        return True
+
+    response_code = str(response_data.get("ResponseCode") or response_data.get("responseCode") or "").strip()
+
+    initiation.request_payload = payload
+    initiation.response_payload = response_data
+    initiation.merchant_request_id = response_data.get("MerchantRequestID") or initiation.merchant_request_id
+    initiation.checkout_request_id = response_data.get("CheckoutRequestID") or initiation.checkout_request_id
+    initiation.status = StkPushInitiation.STATUS_SENT if response_code == "0" else StkPushInitiation.STATUS_REJECTED
+    initiation.last_error = ""
+    initiation.save(
+        update_fields=[
+            "request_payload",
+            "response_payload",
+            "merchant_request_id",
+            "checkout_request_id",
+            "status",
+            "last_error",
+            "updated_at",
+        ]
+    )
+    return True
+
+
+def _dispatching_timeout_seconds() -> int:
+    try:
+        return max(int(getattr(settings, "STK_PUSH_DISPATCHING_TIMEOUT_SECONDS", 600)), 1)
+    except (TypeError, ValueError):
+        return 600
+
+
+def expire_stale_dispatching(*, older_than_seconds: int | None = None) -> int:
+    """Move initiations stuck in `dispatching` to `unknown` (never resent). Returns rows updated."""
+
+    if older_than_seconds is None:
+        older_than_seconds = _dispatching_timeout_seconds()
+    now = timezone.now()
+    return StkPushInitiation.objects.filter(
+        status=StkPushInitiation.STATUS_DISPATCHING,
+        dispatched_at__lt=now - timedelta(seconds=older_than_seconds),
+    ).update(status=StkPushInitiation.STATUS_UNKNOWN, last_error=STALE_DISPATCHING_ERROR, updated_at=now)
+
+
+def drain_stk_push_queue(*, limit: int = 100) -> int:
+    """Dispatch up to `limit` queued initiations (oldest first). Returns how many were sent."""
+
+    ids = list(
+        StkPushInitiation.objects.filter(status=StkPushInitiation.STATUS_QUEUED)
+        .order_by("created_at")
+        .values_list("id", flat=True)[:limit]
+    )
+    return sum(1 for initiation_id in ids if dispatch_stk_push(initiation_id))
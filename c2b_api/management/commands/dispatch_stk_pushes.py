@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from c2b_api.dispatch import drain_stk_push_queue, expire_stale_dispatching
+
+
+class Command(BaseCommand):
+    help = "Send queued (async) STK push initiations to Daraja and expire ones stuck in dispatching"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=100, help="Max initiations to send per pass (default: 100)")
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling the queue instead of exiting after one pass",
+        )
+        parser.add_argument("--interval", type=float, default=2.0, help="Seconds between passes with --loop (default: 2)")
+
+    def handle(self, *args, **options):
+        limit = max(int(options["limit"]), 1)
+        while True:
+            expired = expire_stale_dispatching()
+            sent = drain_stk_push_queue(limit=limit)
+            self.stdout.write(f"Dispatched STK pushes. sent={sent} expired={expired}")
+            if not options["loop"]:
+                return
+            if sent < limit:
+                time.sleep(max(float(options["interval"]), 0.1))
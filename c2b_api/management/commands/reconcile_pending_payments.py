@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from c2b_api.reconcile import make_rate_limiter, sweep
+
+
+class Command(BaseCommand):
+    help = "Submit Transaction Status Queries for payments stuck in pending"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=None, help="Rows queried per sweep (default: RECONCILE_BATCH_SIZE)")
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=None,
+            help="Shortcodes queried concurrently (default: RECONCILE_CONCURRENCY; use 1 on SQLite)",
+        )
+        parser.add_argument("--loop", action="store_true", help="Keep sweeping")
+        parser.add_argument("--interval", type=float, default=60.0, help="Seconds to sleep between sweeps with --loop (default: 60)")
+
+    def handle(self, *args, **options):
+        limiter = make_rate_limiter()
+
+        while True:
+            stats = sweep(limit=options["limit"], concurrency=options["concurrency"], limiter=limiter)
+            self.stdout.write(
+                "Reconciled pending payments. "
+                f"candidates={stats.candidates} submitted={stats.submitted} failed={stats.failed} "
+                f"skipped={stats.skipped} shortcodes={stats.shortcodes} "
+                f"elapsed={stats.elapsed:.2f}s rate={stats.per_second:.2f}/s"
+            )
+            if not options["loop"]:
+                return
+            time.sleep(max(float(options["interval"]), 0.1))
@@ -0,0 +1,158 @@
+"""Reconciliation sweeper for payments stuck in a pending state.
+
+`python manage.py reconcile_pending_payments` finds C2B/STK `MpesaPayment` rows
+still `pending` and B2C `B2CPaymentRequest` rows still `submitted` after
+`RECONCILE_PENDING_AFTER_SECONDS`. Both lookups use the `(status, created_at)`
+indexes. For each one it submits a Transaction Status Query through
+`submit_transaction_status_query`, the same code path as the API endpoint. The
+results arrive on `transaction_status_result`, which correlates them through the
+stored `MpesaTransactionStatusQuery` exactly as for a hand-triggered query.
+
+Candidates are grouped per shortcode. Groups run concurrently, at most
+`RECONCILE_CONCURRENCY` at a time. Within a group, queries are spaced by
+`RECONCILE_RATE_PER_SECOND`. A row that was queried within the last
+`RECONCILE_PENDING_AFTER_SECONDS` is skipped, so repeated sweeps do not
+re-query it until its previous query has had time to resolve.
+"""
+
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.fields.json import KeyTextTransform
+from django.utils import timezone
+
+from b2c_api.models import B2CPaymentRequest
+from mpesa_api.models import MpesaPayment, MpesaTransactionStatusQuery
+from services_common.batching import PerKeyRateLimiter, run_bounded
+
+
+RECONCILE_REMARKS = "Reconcile stale pending payment"
+
+
+@dataclass
+class SweepStats:
+    candidates: int = 0
+    submitted: int = 0
+    failed: int = 0
+    skipped: int = 0
+    shortcodes: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def per_second(self) -> float:
+        return self.submitted / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def _setting_int(name: str, default: int) -> int:
+    try:
+        return max(int(getattr(settings, name, default)), 0)
+    except (TypeError, ValueError):
+        return default
+
+
+def _setting_float(name: str, default: float) -> float:
+    try:
+        return max(float(getattr(settings, name, default)), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+def make_rate_limiter() -> PerKeyRateLimiter:
+    return PerKeyRateLimiter(_setting_float("RECONCILE_RATE_PER_SECOND", 2.0))
+
+
+def _payment_candidates(cutoff, limit: int) -> list[tuple[str, dict]]:
+    # Status queries need a transaction id; rows without one can only be resolved by their callback.
+    has_txn_id = (Q(transaction_id__isnull=False) & ~Q(transaction_id="")) | (
+        Q(mpesa_receipt_number__isnull=False) & ~Q(mpesa_receipt_number="")
+    )
+    recent = MpesaTransactionStatusQuery.objects.filter(created_at__gte=cutoff)
+    payments = (
+        MpesaPayment.objects.filter(has_txn_id, status="pending", created_at__lt=cutoff)
+        .exclude(Exists(recent.filter(transaction_id=OuterRef("transaction_id"))))
+        .exclude(Exists(recent.filter(transaction_id=OuterRef("mpesa_receipt_number"))))
+        .select_related("shortcode")
+        .order_by("created_at")[:limit]
+    )
+    candidates = []
+    for payment in payments:
+        txn_id = str(payment.transaction_id or payment.mpesa_receipt_number or "").strip()
+        shortcode = payment.shortcode.shortcode if payment.shortcode_id else ""
+        candidates.append((shortcode, {"transaction_id": txn_id, "shortcode": shortcode}))
+    return candidates
+
+
+def _b2c_candidates(cutoff, limit: int) -> list[tuple[str, dict]]:
+    # Excluded in SQL (not after the LIMIT) so unresolvable old rows cannot fill every batch.
+    recent = MpesaTransactionStatusQuery.objects.filter(created_at__gte=cutoff, transaction_id__isnull=True).annotate(
+        original_conversation_id=KeyTextTransform("OriginalConversationID", "request_payload")
+    )
+    requests = (
+        B2CPaymentRequest.objects.filter(status=B2CPaymentRequest.STATUS_SUBMITTED, created_at__lt=cutoff)
+        .exclude(conversation_id="")
+        .exclude(Exists(recent.filter(original_conversation_id=OuterRef("conversation_id"))))
+        .order_by("created_at")
+        .only("conversation_id", "request_payload")[:limit]
+    )
+    candidates = []
+    for pr in requests:
+        payload = pr.request_payload if isinstance(pr.request_payload, dict) else {}
+        shortcode = str(payload.get("PartyA") or "").strip()
+        candidates.append((shortcode, {"original_conversation_id": pr.conversation_id, "shortcode": shortcode}))
+    return candidates
+
+
+def sweep(*, limit: int | None = None, concurrency: int | None = None, limiter: PerKeyRateLimiter | None = None) -> SweepStats:
+    """Submit status queries for up to `limit` stale rows. Returns throughput stats."""
+
+    from c2b_api.views import _resolve_shortcode, submit_transaction_status_query
+
+    started = time.monotonic()
+    limit = limit if limit is not None else _setting_int("RECONCILE_BATCH_SIZE", 200)
+    concurrency = concurrency if concurrency is not None else _setting_int("RECONCILE_CONCURRENCY", 4)
+    limiter = limiter or make_rate_limiter()
+    cutoff = timezone.now() - timedelta(seconds=_setting_int("RECONCILE_PENDING_AFTER_SECONDS", 900))
+
+    stats = SweepStats()
+    candidates = _payment_candidates(cutoff, limit)
+    candidates += _b2c_candidates(cutoff, limit - len(candidates))
+    stats.candidates = len(candidates)
+
+    # Recently queried rows are already excluded in SQL; this only drops payments sharing a txn id.
+    seen_txn_ids: set[str] = set()
+    groups: dict[str, list[dict]] = {}
+    for shortcode, body in candidates:
+        txn_id = body.get("transaction_id")
+        conversation_id = body.get("original_conversation_id")
+        if txn_id in seen_txn_ids or not (txn_id or conversation_id):
+            stats.skipped += 1
+            continue
+        if txn_id:
+            seen_txn_ids.add(txn_id)
+        groups.setdefault(shortcode, []).append({**body, "remarks": RECONCILE_REMARKS})
+    stats.shortcodes = len(groups)
+
+    def _run_group(item):
+        shortcode, bodies = item
+        shortcode_obj = _resolve_shortcode(shortcode)
+        submitted = failed = 0
+        for body in bodies:
+            limiter.wait(shortcode)
+            _, status = submit_transaction_status_query(body, shortcode_obj=shortcode_obj)
+            if status == 201:
+                submitted += 1
+            else:
+                failed += 1
+        return submitted, failed
+
+    for submitted, failed in run_bounded(_run_group, groups.items(), concurrency=concurrency):
+        stats.submitted += submitted
+        stats.failed += failed
+
+    stats.elapsed = time.monotonic() - started
+    return stats
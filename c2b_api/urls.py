@@ -1,20 +1,28 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
 
+# Daraja-bound endpoints use their async views under ASGI (see ASYNC_VIEWS_ENABLED).
+stk_push = views.stk_push_async if settings.ASYNC_VIEWS_ENABLED else views.stk_push
+transaction_status_query = views.transaction_status_query_async if settings.ASYNC_VIEWS_ENABLED else views.transaction_status_query
+
+
 urlpatterns = [
 	# STK push lifecycle
-	path("stk/push", views.stk_push, name="c2b_stk_push"),
-	path("stk/push/", views.stk_push),
+	path("stk/push", stk_push, name="c2b_stk_push"),
+	path("stk/push/", stk_push),
+	path("stk/push/<uuid:tracking_id>", views.stk_push_status, name="c2b_stk_push_status"),
+	path("stk/push/<uuid:tracking_id>/", views.stk_push_status),
 	path("stk/callback", views.stk_callback, name="c2b_stk_callback"),
 	path("stk/callback/", views.stk_callback),
 	path("stk/error", views.stk_error, name="c2b_stk_error"),
 	path("stk/error/", views.stk_error),
 
 	# Transaction status (reconciliation)
-	path("transaction-status/query", views.transaction_status_query, name="c2b_transaction_status_query"),
-	path("transaction-status/query/", views.transaction_status_query),
+	path("transaction-status/query", transaction_status_query, name="c2b_transaction_status_query"),
+	path("transaction-status/query/", transaction_status_query),
 	path("transaction-status/result", views.transaction_status_result, name="c2b_transaction_status_result"),
 	path("transaction-status/result/", views.transaction_status_result),
 	path("transaction-status/timeout", views.transaction_status_timeout, name="c2b_transaction_status_timeout"),
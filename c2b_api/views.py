@@ -9,22 +9,32 @@ import datetime
 import json
 import os
 import uuid
-from decimal import Decimal, InvalidOperation
+from decimal import Decimal
 
-import requests
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import models, transaction
 from django.http import JsonResponse
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 from requests.auth import HTTPBasicAuth
 from django.utils import timezone
 
-from mpesa_api.models import MpesaCallBacks, MpesaCalls, MpesaPayment, StkPushInitiation, MpesaTransactionStatusQuery
+from mpesa_api.models import CallbackInbox, DailyTransactionRollup, MpesaCallBacks, MpesaCalls, MpesaPayment, StkPushInitiation, MpesaTransactionStatusQuery
 from mpesa_api.mpesa_credentials import LipanaMpesaPassword, MpesaC2bCredential
-from services_common.auth import require_oauth2, require_staff
-from services_common.http import json_body, parse_mpesa_timestamp
+from services_common import outbound
+from services_common.auth import get_bound_business, require_oauth2, require_staff
+from services_common.callback_dedup import deduplicated
+from services_common.circuit_breaker import UpstreamUnavailable, unavailable_response
+from services_common.callback_inbox import fast_ack
+from services_common.http import json_body, parse_limit_param, parse_mpesa_timestamp
+from services_common.pagination import InvalidCursor, keyset_page, ndjson_response
+from services_common.rollups import payment_contribution, record_change
 from services_common.tenancy import resolve_business_from_request
 from services_common.status_codes import apply_mapped_status, map_safaricom_status
 
+from .dispatch import apost_stk_push, enqueue_stk_push, post_stk_push
+
 
 def _resolve_shortcode(shortcode: str | None):
     if not shortcode:
@@ -38,17 +48,7 @@ def _resolve_shortcode(shortcode: str | None):
 
 
 def _get_bound_business(request):
-    token_obj = getattr(request, "oauth2_token", None)
-    app = getattr(request, "oauth2_application", None) if token_obj else None
-    if not app:
-        return None
-    try:
-        from business_api.models import OAuthClientBusiness
-
-        binding = OAuthClientBusiness.objects.select_related("business").filter(application=app).first()
-        return binding.business if binding else None
-    except Exception:
-        return None
+    return get_bound_business(request)
 
 
 def _get_default_shortcode_for_business(business):
@@ -121,7 +121,7 @@ def get_access_token(request):
     if not consumer_key or not consumer_secret or not api_url:
         return JsonResponse({"error": "Missing required credentials in environment"}, status=500)
 
-    r = requests.get(api_url, auth=HTTPBasicAuth(consumer_key, consumer_secret), timeout=30)
+    r = outbound.get(api_url, auth=HTTPBasicAuth(consumer_key, consumer_secret))
     try:
         mpesa_access_token = r.json()
     except Exception:
@@ -133,6 +133,15 @@ def get_access_token(request):
     return JsonResponse({"error": "Failed to retrieve access token"}, status=500)
 
 
+def _stk_push_async_requested(body) -> bool:
+    value = body.get("async") if isinstance(body, dict) else None
+    if value is None:
+        return bool(getattr(settings, "STK_PUSH_ASYNC", False))
+    if isinstance(value, str):
+        return value.strip().lower() in {"1", "true", "yes", "y", "on"}
+    return bool(value)
+
+
 @csrf_exempt
 @require_oauth2(scopes=["c2b:write"])
 def stk_push(request):
@@ -140,100 +149,196 @@ def stk_push(request):
     if request.method != "POST":
         return JsonResponse({"error": "Method not allowed"}, status=405)
     try:
+        prepared, response = _prepare_stk_push(request)
+        if response is not None:
+            return response
+        return _stk_push_response(prepared, post_stk_push(prepared["payload"]))
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@require_oauth2(scopes=["c2b:write"])
+async def stk_push_async(request):
+    """`stk_push` for ASGI deployments: the Daraja call is awaited, not blocking a thread."""
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+    try:
+        prepared, response = await sync_to_async(_prepare_stk_push)(request)
+        if response is not None:
+            return response
+        response_data = await apost_stk_push(prepared["payload"])
+        return await sync_to_async(_stk_push_response)(prepared, response_data)
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+def _prepare_stk_push(request):
+    """Validate and log an STK push request.
+
+    Returns `(prepared, None)` when the Daraja call should be made now, or
+    `(None, response)` when the request is rejected or queued (async mode).
+    """
+    body = json_body(request)
+    async_mode = _stk_push_async_requested(body)
+
+    if not async_mode:
         access_token = MpesaC2bCredential.get_access_token()
         api_url = os.getenv("LIPA_NA_MPESA_ONLINE_URL")
-        headers = {"Authorization": f"Bearer {access_token}"}
-
         if not access_token or not api_url:
-            return JsonResponse(
+            return None, JsonResponse(
                 {"error": "Missing access token or LIPA_NA_MPESA_ONLINE_URL"},
                 status=500,
             )
 
-        body = json_body(request)
+    shortcode_value = str(body.get("shortcode") or body.get("business_shortcode") or "").strip()
+    shortcode_obj = _resolve_shortcode(shortcode_value)
 
-        shortcode_value = str(body.get("shortcode") or body.get("business_shortcode") or "").strip()
-        shortcode_obj = _resolve_shortcode(shortcode_value)
+    # Backward compatible fallback to env-based config if shortcode not provided.
+    effective_shortcode = shortcode_obj.shortcode if shortcode_obj else LipanaMpesaPassword.BUSINESS_SHORT_CODE
+    effective_passkey = shortcode_obj.lipa_passkey if shortcode_obj else None
+    password, timestamp = LipanaMpesaPassword.generate_password(
+        business_shortcode=effective_shortcode,
+        passkey=effective_passkey,
+    )
 
-        # Backward compatible fallback to env-based config if shortcode not provided.
-        effective_shortcode = shortcode_obj.shortcode if shortcode_obj else LipanaMpesaPassword.BUSINESS_SHORT_CODE
-        effective_passkey = shortcode_obj.lipa_passkey if shortcode_obj else None
-        password, timestamp = LipanaMpesaPassword.generate_password(
-            business_shortcode=effective_shortcode,
-            passkey=effective_passkey,
-        )
+    callback_url = (
+        str(body.get("callback_url") or "").strip()
+        or (shortcode_obj.default_stk_callback_url if shortcode_obj else "")
+        or os.getenv("STK_CALLBACK_URL", "")
+    )
+    account_reference = str(body.get("account_reference") or "").strip()[:64] or os.getenv("ACCOUNT_REFERENCE")
+    product_type = str(body.get("product_type") or "").strip()[:60]
 
-        callback_url = (
-            str(body.get("callback_url") or "").strip()
-            or (shortcode_obj.default_stk_callback_url if shortcode_obj else "")
-            or os.getenv("STK_CALLBACK_URL", "")
-        )
-        account_reference = str(body.get("account_reference") or "").strip()[:64] or os.getenv("ACCOUNT_REFERENCE")
-        product_type = str(body.get("product_type") or "").strip()[:60]
+    payload = {
+        "BusinessShortCode": effective_shortcode,
+        "Password": password,
+        "Timestamp": timestamp,
+        "TransactionType": "CustomerPayBillOnline",
+        "Amount": body.get("amount", 1),
+        "PartyA": body.get("party_a") or os.getenv("PARTY_A"),
+        "PartyB": effective_shortcode,
+        "PhoneNumber": body.get("phone_number") or os.getenv("PHONE_NUMBER"),
+        "CallBackURL": callback_url,
+        "AccountReference": account_reference,
+        "TransactionDesc": "Testing STK push",
+    }
 
-        payload = {
-            "BusinessShortCode": effective_shortcode,
-            "Password": password,
-            "Timestamp": timestamp,
-            "TransactionType": "CustomerPayBillOnline",
-            "Amount": body.get("amount", 1),
-            "PartyA": body.get("party_a") or os.getenv("PARTY_A"),
-            "PartyB": effective_shortcode,
-            "PhoneNumber": body.get("phone_number") or os.getenv("PHONE_NUMBER"),
-            "CallBackURL": callback_url,
-            "AccountReference": account_reference,
-            "TransactionDesc": "Testing STK push",
-        }
+    if not payload.get("CallBackURL"):
+        return None, JsonResponse({"error": "STK_CALLBACK_URL is not set"}, status=500)
 
-        if not payload.get("CallBackURL"):
-            return JsonResponse({"error": "STK_CALLBACK_URL is not set"}, status=500)
+    MpesaCalls.objects.create(
+        ip_address=request.META.get("REMOTE_ADDR"),
+        caller="STK Push Request",
+        conversation_id=payload.get("AccountReference", ""),
+        content=json.dumps(payload),
+        business=shortcode_obj.business if shortcode_obj else None,
+        shortcode=shortcode_obj,
+    )
 
-        MpesaCalls.objects.create(
-            ip_address=request.META.get("REMOTE_ADDR"),
-            caller="STK Push Request",
-            conversation_id=payload.get("AccountReference", ""),
-            content=json.dumps(payload),
+    if async_mode:
+        initiation = StkPushInitiation.objects.create(
+            status=StkPushInitiation.STATUS_QUEUED,
             business=shortcode_obj.business if shortcode_obj else None,
             shortcode=shortcode_obj,
+            account_reference=account_reference or "",
+            product_type=product_type,
+            request_payload=payload,
+        )
+        enqueue_stk_push(initiation.id)
+        return None, JsonResponse(
+            {
+                "tracking_id": str(initiation.tracking_id),
+                "status": initiation.status,
+                "status_url": reverse("c2b_stk_push_status", args=[initiation.tracking_id]),
+            },
+            status=202,
         )
 
-        response = requests.post(api_url, json=payload, headers=headers, timeout=30)
-        try:
-            response_data = response.json()
-        except Exception:
-            response_data = {"error": "Invalid JSON response", "status_code": response.status_code}
+    return {
+        "payload": payload,
+        "shortcode_obj": shortcode_obj,
+        "account_reference": account_reference,
+        "product_type": product_type,
+    }, None
 
-        # Persist mapping for tenancy resolution on callback.
-        if isinstance(response_data, dict):
-            merchant_request_id = response_data.get("MerchantRequestID")
-            checkout_request_id = response_data.get("CheckoutRequestID")
-            if merchant_request_id or checkout_request_id:
-                StkPushInitiation.objects.create(
-                    business=shortcode_obj.business if shortcode_obj else None,
-                    shortcode=shortcode_obj,
-                    merchant_request_id=merchant_request_id,
-                    checkout_request_id=checkout_request_id,
-                    account_reference=account_reference or "",
-                    product_type=product_type,
-                    request_payload=payload,
-                    response_payload=response_data,
-                )
 
-        # Integrator-facing response: include our simplified mapped status.
-        if isinstance(response_data, dict):
-            mapped = map_safaricom_status(
-                code=response_data.get("ResponseCode") or response_data.get("responseCode"),
-                message=response_data.get("ResponseDescription") or response_data.get("responseDescription"),
+def _stk_push_response(prepared: dict, response_data):
+    shortcode_obj = prepared["shortcode_obj"]
+
+    # Persist mapping for tenancy resolution on callback.
+    if isinstance(response_data, dict):
+        merchant_request_id = response_data.get("MerchantRequestID")
+        checkout_request_id = response_data.get("CheckoutRequestID")
+        if merchant_request_id or checkout_request_id:
+            StkPushInitiation.objects.create(
+                business=shortcode_obj.business if shortcode_obj else None,
+                shortcode=shortcode_obj,
+                merchant_request_id=merchant_request_id,
+                checkout_request_id=checkout_request_id,
+                account_reference=prepared["account_reference"] or "",
+                product_type=prepared["product_type"],
+                request_payload=prepared["payload"],
+                response_payload=response_data,
             )
-            response_data = {
-                **response_data,
-                "status_code": mapped.status_code,
-                "status_message": mapped.status_message,
-            }
 
-        return JsonResponse(response_data)
-    except Exception as e:
-        return JsonResponse({"error": str(e)}, status=500)
+    # Integrator-facing response: include our simplified mapped status.
+    if isinstance(response_data, dict):
+        mapped = map_safaricom_status(
+            code=response_data.get("ResponseCode") or response_data.get("responseCode"),
+            message=response_data.get("ResponseDescription") or response_data.get("responseDescription"),
+        )
+        response_data = {
+            **response_data,
+            "status_code": mapped.status_code,
+            "status_message": mapped.status_message,
+        }
+
+    return JsonResponse(response_data)
+
+
+@require_oauth2(scopes=["c2b:write"])
+def stk_push_status(request, tracking_id):
+    """Report the state of an STK push initiation (mainly for async submissions)."""
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    initiation = StkPushInitiation.objects.filter(tracking_id=tracking_id).first()
+    if initiation and getattr(request, "oauth2_token", None) is not None and initiation.business_id:
+        bound_business = _get_bound_business(request)
+        if not bound_business or bound_business.id != initiation.business_id:
+            initiation = None
+    if not initiation:
+        return JsonResponse({"error": "Not found"}, status=404)
+
+    data = {
+        "tracking_id": str(initiation.tracking_id),
+        "status": initiation.status,
+        "merchant_request_id": initiation.merchant_request_id,
+        "checkout_request_id": initiation.checkout_request_id,
+        "error": initiation.last_error or None,
+        "response": None,
+        "created_at": initiation.created_at.isoformat() if initiation.created_at else None,
+        "dispatched_at": initiation.dispatched_at.isoformat() if initiation.dispatched_at else None,
+    }
+
+    response_data = initiation.response_payload
+    if initiation.status in (StkPushInitiation.STATUS_SENT, StkPushInitiation.STATUS_REJECTED) and isinstance(response_data, dict):
+        mapped = map_safaricom_status(
+            code=response_data.get("ResponseCode") or response_data.get("responseCode"),
+            message=response_data.get("ResponseDescription") or response_data.get("responseDescription"),
+        )
+        data["response"] = {
+            **response_data,
+            "status_code": mapped.status_code,
+            "status_message": mapped.status_message,
+        }
+
+    return JsonResponse(data)
 
 
 @require_oauth2(
@@ -249,19 +354,94 @@ def transaction_status_query(request):
         return JsonResponse({"error": "Method not allowed"}, status=405)
 
     body = json_body(request)
-    transaction_id = str(body.get("transaction_id") or body.get("TransID") or body.get("mpesa_receipt_number") or "").strip()
-    if not transaction_id:
-        return JsonResponse({"error": "transaction_id is required"}, status=400)
+    if not isinstance(body, dict):
+        body = {}
+    shortcode_obj = _transaction_status_query_shortcode(request, body)
+
+    data, status = submit_transaction_status_query(body, shortcode_obj=shortcode_obj)
+    return JsonResponse(data, status=status)
 
+
+@require_oauth2(
+    scopes=["transactions:write"],
+    message="Please sign in with a staff account to reconcile transactions.",
+)
+async def transaction_status_query_async(request):
+    """`transaction_status_query` for ASGI deployments."""
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    body = json_body(request)
+    if not isinstance(body, dict):
+        body = {}
+    shortcode_obj = await sync_to_async(_transaction_status_query_shortcode)(request, body)
+
+    data, status = await asubmit_transaction_status_query(body, shortcode_obj=shortcode_obj)
+    return JsonResponse(data, status=status)
+
+
+def _transaction_status_query_shortcode(request, body: dict):
     shortcode_value = str(body.get("shortcode") or body.get("business_shortcode") or "").strip()
     shortcode_obj = _resolve_shortcode(shortcode_value)
     if not shortcode_obj:
         bound_business = _get_bound_business(request)
         shortcode_obj = _get_default_shortcode_for_business(bound_business)
+    return shortcode_obj
+
+
+def submit_transaction_status_query(body: dict, *, shortcode_obj=None) -> tuple[dict, int]:
+    """Create a `MpesaTransactionStatusQuery` and submit it to Daraja.
+
+    Returns `(response_body, http_status)`. Shared by the API view and the
+    `reconcile_pending_payments` sweeper; results arrive on `transaction_status_result`
+    and are correlated through the stored OriginatorConversationID.
+
+    `original_conversation_id` queries by the Daraja ConversationID instead of a
+    transaction id (used for B2C requests that never got a result).
+    """
+    row, api_url, error = _create_transaction_status_query(body, shortcode_obj=shortcode_obj)
+    if error is not None:
+        return error
+
+    try:
+        headers = _transaction_status_query_headers(row)
+        if headers is None:
+            return {"error": "Failed to get access token"}, 502
+        resp = outbound.post(api_url, json=row.request_payload, headers=headers)
+        return _record_transaction_status_query_response(row, resp)
+    except Exception as e:
+        return _record_transaction_status_query_failure(row, e)
+
+
+async def asubmit_transaction_status_query(body: dict, *, shortcode_obj=None) -> tuple[dict, int]:
+    """Async `submit_transaction_status_query()`: only the Daraja call is awaited natively."""
+    row, api_url, error = await sync_to_async(_create_transaction_status_query)(body, shortcode_obj=shortcode_obj)
+    if error is not None:
+        return error
+
+    try:
+        headers = await sync_to_async(_transaction_status_query_headers)(row)
+        if headers is None:
+            return {"error": "Failed to get access token"}, 502
+        resp = await outbound.apost(api_url, json=row.request_payload, headers=headers)
+        return await sync_to_async(_record_transaction_status_query_response)(row, resp)
+    except Exception as e:
+        return await sync_to_async(_record_transaction_status_query_failure)(row, e)
+
+
+def _create_transaction_status_query(body: dict, *, shortcode_obj=None):
+    """Validate `body` and store the pending query row.
+
+    Returns `(row, api_url, None)` or `(None, None, (error_body, http_status))`.
+    """
+    transaction_id = str(body.get("transaction_id") or body.get("TransID") or body.get("mpesa_receipt_number") or "").strip()
+    original_conversation_id = str(body.get("original_conversation_id") or "").strip()
+    if not transaction_id and not original_conversation_id:
+        return None, None, ({"error": "transaction_id is required"}, 400)
 
     api_url = str(os.getenv("MPESA_TXN_STATUS_QUERY_URL") or "").strip()
     if not api_url:
-        return JsonResponse({"error": "MPESA_TXN_STATUS_QUERY_URL is not set"}, status=500)
+        return None, None, ({"error": "MPESA_TXN_STATUS_QUERY_URL is not set"}, 500)
 
     initiator_name = str(body.get("initiator_name") or "").strip() or str(
         (getattr(shortcode_obj, "txn_status_initiator_name", "") if shortcode_obj else "")
@@ -270,12 +450,9 @@ def transaction_status_query(request):
         (getattr(shortcode_obj, "txn_status_security_credential", "") if shortcode_obj else "")
     ).strip() or str(os.getenv("MPESA_TXN_STATUS_SECURITY_CREDENTIAL") or "").strip()
     if not initiator_name or not security_credential:
-        return JsonResponse(
-            {
-                "error": "initiator_name and security_credential are required (or set MPESA_TXN_STATUS_INITIATOR_NAME / MPESA_TXN_STATUS_SECURITY_CREDENTIAL)",
-            },
-            status=400,
-        )
+        return None, None, ({
+            "error": "initiator_name and security_credential are required (or set MPESA_TXN_STATUS_INITIATOR_NAME / MPESA_TXN_STATUS_SECURITY_CREDENTIAL)",
+        }, 400)
 
     result_url = str(body.get("result_url") or "").strip() or str(
         (getattr(shortcode_obj, "txn_status_result_url", "") if shortcode_obj else "")
@@ -284,18 +461,15 @@ def transaction_status_query(request):
         (getattr(shortcode_obj, "txn_status_timeout_url", "") if shortcode_obj else "")
     ).strip() or str(os.getenv("MPESA_TXN_STATUS_TIMEOUT_URL") or "").strip()
     if not result_url or not timeout_url:
-        return JsonResponse(
-            {
-                "error": "result_url and timeout_url are required (or set MPESA_TXN_STATUS_RESULT_URL / MPESA_TXN_STATUS_TIMEOUT_URL)",
-            },
-            status=400,
-        )
+        return None, None, ({
+            "error": "result_url and timeout_url are required (or set MPESA_TXN_STATUS_RESULT_URL / MPESA_TXN_STATUS_TIMEOUT_URL)",
+        }, 400)
 
     party_a = str(body.get("party_a") or os.getenv("MPESA_TXN_STATUS_PARTY_A") or "").strip()
     if not party_a and shortcode_obj:
         party_a = str(shortcode_obj.shortcode)
     if not party_a:
-        return JsonResponse({"error": "party_a is required (or set MPESA_TXN_STATUS_PARTY_A)"}, status=400)
+        return None, None, ({"error": "party_a is required (or set MPESA_TXN_STATUS_PARTY_A)"}, 400)
 
     identifier_type = str(body.get("identifier_type") or "").strip() or str(
         (getattr(shortcode_obj, "txn_status_identifier_type", "") if shortcode_obj else "")
@@ -318,64 +492,64 @@ def transaction_status_query(request):
         "Occasion": occasion,
         "OriginatorConversationID": originator_conversation_id,
     }
+    if original_conversation_id:
+        payload["OriginalConversationID"] = original_conversation_id
 
     row = MpesaTransactionStatusQuery.objects.create(
         business=shortcode_obj.business if shortcode_obj else None,
         shortcode=shortcode_obj,
-        transaction_id=transaction_id,
+        transaction_id=transaction_id or None,
         originator_conversation_id=originator_conversation_id,
         request_payload=payload,
         status="pending",
     )
+    return row, api_url, None
 
-    try:
-        access_token = MpesaC2bCredential.get_access_token()
-        if not access_token:
-            row.response_payload = {"error": "Failed to get access token"}
-            row.status = "failed"
-            row.save(update_fields=["response_payload", "status", "updated_at"])
-            return JsonResponse({"error": "Failed to get access token"}, status=502)
-
-        resp = requests.post(
-            api_url,
-            json=payload,
-            headers={"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"},
-            timeout=30,
-        )
-        try:
-            data = resp.json()
-        except Exception:
-            data = {"raw": (resp.text or ""), "status_code": resp.status_code}
-
-        row.response_payload = data if isinstance(data, dict) else {"data": data}
-        if isinstance(data, dict):
-            row.conversation_id = str(data.get("ConversationID") or row.conversation_id or "")
-            row.originator_conversation_id = str(data.get("OriginatorConversationID") or row.originator_conversation_id or "")
-        row.save(update_fields=["response_payload", "conversation_id", "originator_conversation_id", "updated_at"])
-
-        mapped = None
-        if isinstance(row.response_payload, dict):
-            mapped = map_safaricom_status(
-                code=row.response_payload.get("ResponseCode") or row.response_payload.get("responseCode"),
-                message=row.response_payload.get("ResponseDescription")
-                or row.response_payload.get("responseDescription"),
-            )
 
-        return JsonResponse(
-            {
-                "ok": True,
-                "query_id": row.id,
-                "status_code": mapped.status_code if mapped else None,
-                "status_message": mapped.status_message if mapped else "",
-                "response": row.response_payload,
-            },
-            status=201,
-        )
-    except Exception as e:
-        row.response_payload = {"error": str(e)}
+def _transaction_status_query_headers(row):
+    access_token = MpesaC2bCredential.get_access_token()
+    if not access_token:
+        row.response_payload = {"error": "Failed to get access token"}
         row.status = "failed"
         row.save(update_fields=["response_payload", "status", "updated_at"])
-        return JsonResponse({"error": "Failed to submit", "details": row.response_payload}, status=502)
+        return None
+    return {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
+
+
+def _record_transaction_status_query_response(row, resp) -> tuple[dict, int]:
+    try:
+        data = resp.json()
+    except Exception:
+        data = {"raw": (resp.text or ""), "status_code": resp.status_code}
+
+    row.response_payload = data if isinstance(data, dict) else {"data": data}
+    if isinstance(data, dict):
+        row.conversation_id = str(data.get("ConversationID") or row.conversation_id or "")
+        row.originator_conversation_id = str(data.get("OriginatorConversationID") or row.originator_conversation_id or "")
+    row.save(update_fields=["response_payload", "conversation_id", "originator_conversation_id", "updated_at"])
+
+    mapped = None
+    if isinstance(row.response_payload, dict):
+        mapped = map_safaricom_status(
+            code=row.response_payload.get("ResponseCode") or row.response_payload.get("responseCode"),
+            message=row.response_payload.get("ResponseDescription")
+            or row.response_payload.get("responseDescription"),
+        )
+
+    return {
+        "ok": True,
+        "query_id": row.id,
+        "status_code": mapped.status_code if mapped else None,
+        "status_message": mapped.status_message if mapped else "",
+        "response": row.response_payload,
+    }, 201
+
+
+def _record_transaction_status_query_failure(row, error: Exception) -> tuple[dict, int]:
+    row.response_payload = {"error": str(error)}
+    row.status = "failed"
+    row.save(update_fields=["response_payload", "status", "updated_at"])
+    return {"error": "Failed to submit", "details": row.response_payload}, 502
 
 
 @csrf_exempt
@@ -383,8 +557,15 @@ def transaction_status_result(request):
     """ResultURL callback for Transaction Status Query."""
     if request.method != "POST":
         return JsonResponse({"error": "Method not allowed"}, status=405)
+    ack = fast_ack(request, CallbackInbox.KIND_TRANSACTION_STATUS_RESULT)
+    if ack is not None:
+        return ack
+    return apply_transaction_status_result(json_body(request), remote_addr=request.META.get("REMOTE_ADDR"))
 
-    body = json_body(request)
+
+@deduplicated(CallbackInbox.KIND_TRANSACTION_STATUS_RESULT)
+def apply_transaction_status_result(body, *, remote_addr):
+    """Apply a Transaction Status result payload (also replayed by the callback inbox worker)."""
     if not isinstance(body, dict):
         return JsonResponse({"error": "Invalid JSON"}, status=400)
 
@@ -394,25 +575,20 @@ def transaction_status_result(request):
     result_code = result.get("ResultCode") if isinstance(result.get("ResultCode"), int) else None
     result_desc = str(result.get("ResultDesc") or "").strip()
 
-    cb = MpesaCallBacks.objects.create(
-        ip_address=request.META.get("REMOTE_ADDR"),
+    # Resolve the mapping once; every row below is then written with a single statement.
+    mapped = map_safaricom_status(code=result_code, message=result_desc) if result_code is not None else None
+
+    cb = MpesaCallBacks(
+        ip_address=remote_addr,
         caller="Transaction Status Result",
         conversation_id=originator_id or conversation_id,
         content=body,
         result_code=result_code,
         result_description=result_desc,
     )
-
-    if result_code is not None:
-        apply_mapped_status(
-            cb,
-            external_system="safaricom",
-            external_code=result_code,
-            external_message=result_desc,
-            code_field="internal_status_code",
-            message_field="internal_status_message",
-        )
-        cb.save(update_fields=["internal_status_code", "internal_status_message", "updated_at"])
+    if mapped is not None:
+        cb.internal_status_code = mapped.status_code
+        cb.internal_status_message = mapped.status_message
 
     row = None
     if originator_id:
@@ -430,62 +606,72 @@ def transaction_status_result(request):
         txn_id = params.get("ReceiptNo") or params.get("TransactionID") or ""
     txn_id = str(txn_id or "").strip()
 
+    now = timezone.now()
     if row:
         row.result_payload = body
         row.result_code = result_code
         row.result_description = result_desc
-        if result_code is not None:
-            apply_mapped_status(
-                row,
-                external_system="safaricom",
-                external_code=result_code,
-                external_message=result_desc,
-            )
-        row.resolved_at = timezone.now()
+        if mapped is not None:
+            row.internal_status_code = mapped.status_code
+            row.internal_status_message = mapped.status_message
+        row.resolved_at = now
         if txn_id and not row.transaction_id:
             row.transaction_id = txn_id
         if isinstance(result_code, int):
             row.status = "successful" if result_code == 0 else "failed"
-        row.save(
-            update_fields=[
-                "result_payload",
-                "result_code",
-                "result_description",
-                "internal_status_code",
-                "internal_status_message",
-                "resolved_at",
-                "transaction_id",
-                "status",
-                "updated_at",
-            ]
-        )
 
+    changes = []
     if txn_id:
         payments = MpesaPayment.objects.filter(models.Q(transaction_id=txn_id) | models.Q(mpesa_receipt_number=txn_id))
         for p in payments:
-            if (p.status or "").lower() == "pending":
-                p.status = "successful" if result_code == 0 else "failed"
-                p.result_code = result_code
-                p.result_description = result_desc
-                if result_code is not None:
-                    apply_mapped_status(
-                        p,
-                        external_system="safaricom",
-                        external_code=result_code,
-                        external_message=result_desc,
-                    )
-                    p.save(
-                        update_fields=[
-                            "status",
-                            "result_code",
-                            "result_description",
-                            "internal_status_code",
-                            "internal_status_message",
-                            "updated_at",
-                        ]
-                    )
-                else:
-                    p.save(update_fields=["status", "result_code", "result_description", "updated_at"])
+            if (p.status or "").lower() != "pending":
+                continue
+            before = payment_contribution(p)
+            p.status = "successful" if result_code == 0 else "failed"
+            p.result_code = result_code
+            p.result_description = result_desc
+            if mapped is not None:
+                p.internal_status_code = mapped.status_code
+                p.internal_status_message = mapped.status_message
+            p.updated_at = now
+            changes.append((p, before))
+
+    payment_fields = ["status", "result_code", "result_description", "updated_at"]
+    if mapped is not None:
+        payment_fields += ["internal_status_code", "internal_status_message"]
+
+    with transaction.atomic():
+        cb.save()
+        if row:
+            row.save(
+                update_fields=[
+                    "result_payload",
+                    "result_code",
+                    "result_description",
+                    "internal_status_code",
+                    "internal_status_message",
+                    "resolved_at",
+                    "transaction_id",
+                    "status",
+                    "updated_at",
+                ]
+            )
+        if changes:
+            MpesaPayment.objects.bulk_update([p for p, _ in changes], payment_fields)
+        for p, before in changes:
+            record_change(before, payment_contribution(p))
+
+        original_conversation_id = row.request_payload.get("OriginalConversationID") if row and isinstance(row.request_payload, dict) else None
+        if original_conversation_id:
+            from b2c_api.views import apply_status_query_result
+
+            apply_status_query_result(
+                original_conversation_id,
+                result_code=result_code,
+                result_desc=result_desc,
+                result_parameters=_extract_result_parameters(body),
+                body=body,
+            )
 
     return JsonResponse({"ok": True})
 
@@ -502,7 +688,7 @@ def transaction_status_timeout(request):
 
     originator_id = _extract_originator_conversation_id(body)
     conversation_id = _extract_conversation_id(body)
-    cb = MpesaCallBacks.objects.create(
+    cb = MpesaCallBacks(
         ip_address=request.META.get("REMOTE_ADDR"),
         caller="Transaction Status Timeout",
         conversation_id=originator_id or conversation_id,
@@ -510,8 +696,7 @@ def transaction_status_timeout(request):
         result_code=-1,
         result_description="timeout",
     )
-
-    apply_mapped_status(
+    mapped = apply_mapped_status(
         cb,
         external_system="gateway",
         external_code="TIMEOUT",
@@ -519,7 +704,6 @@ def transaction_status_timeout(request):
         code_field="internal_status_code",
         message_field="internal_status_message",
     )
-    cb.save(update_fields=["internal_status_code", "internal_status_message", "updated_at"])
 
     row = None
     if originator_id:
@@ -531,24 +715,24 @@ def transaction_status_timeout(request):
         row.result_payload = body
         row.result_code = -1
         row.result_description = "timeout"
-        apply_mapped_status(
-            row,
-            external_system="gateway",
-            external_code="TIMEOUT",
-            external_message="timeout",
-        )
+        row.internal_status_code = mapped.status_code
+        row.internal_status_message = mapped.status_message
         row.resolved_at = timezone.now()
-        row.save(
-            update_fields=[
-                "result_payload",
-                "result_code",
-                "result_description",
-                "internal_status_code",
-                "internal_status_message",
-                "resolved_at",
-                "updated_at",
-            ]
-        )
+
+    with transaction.atomic():
+        cb.save()
+        if row:
+            row.save(
+                update_fields=[
+                    "result_payload",
+                    "result_code",
+                    "result_description",
+                    "internal_status_code",
+                    "internal_status_message",
+                    "resolved_at",
+                    "updated_at",
+                ]
+            )
 
     return JsonResponse({"ok": True})
 
@@ -578,7 +762,7 @@ def register_urls(request):
             "ValidationURL": validation_url,
         }
 
-        response = requests.post(api_url, json=payload, headers=headers, timeout=30)
+        response = outbound.post(api_url, json=payload, headers=headers)
         try:
             response_data = response.json()
         except Exception:
@@ -611,13 +795,20 @@ def confirmation(request):
     """Handles confirmation callback and saves transaction details."""
     if request.method != "POST":
         return JsonResponse({"error": "Method not allowed"}, status=405)
-    try:
-        mpesa_body = json_body(request)
+    ack = fast_ack(request, CallbackInbox.KIND_C2B_CONFIRMATION)
+    if ack is not None:
+        return ack
+    return apply_confirmation(json_body(request), remote_addr=request.META.get("REMOTE_ADDR"))
+
 
+@deduplicated(CallbackInbox.KIND_C2B_CONFIRMATION)
+def apply_confirmation(mpesa_body, *, remote_addr):
+    """Apply a C2B confirmation payload (also replayed by the callback inbox worker)."""
+    try:
         shortcode_obj = _resolve_shortcode(mpesa_body.get("BusinessShortCode") or mpesa_body.get("ShortCode"))
 
         MpesaCalls.objects.create(
-            ip_address=request.META.get("REMOTE_ADDR"),
+            ip_address=remote_addr,
             caller="Confirmation Callback",
             conversation_id=mpesa_body.get("TransID", ""),
             content=json.dumps(mpesa_body),
@@ -641,6 +832,7 @@ def confirmation(request):
 
         payment = MpesaPayment.objects.filter(transaction_id=trans_id).first()
         if payment:
+            before = payment_contribution(payment)
             # Don't override a final status (e.g. already reconciled).
             if (payment.status or "").lower() not in {"successful", "failed"}:
                 payment.status = desired_status
@@ -667,8 +859,9 @@ def confirmation(request):
                     "updated_at",
                 ]
             )
+            record_change(before, payment_contribution(payment))
         else:
-            MpesaPayment.objects.create(
+            payment = MpesaPayment.objects.create(
                 transaction_id=trans_id,
                 amount=mpesa_body.get("TransAmount", 0),
                 transaction_date=parse_mpesa_timestamp(mpesa_body.get("TransTime")),
@@ -679,6 +872,7 @@ def confirmation(request):
                 business=shortcode_obj.business if shortcode_obj else None,
                 shortcode=shortcode_obj,
             )
+            record_change(None, payment_contribution(payment))
 
         return JsonResponse({"ResultCode": 0, "ResultDesc": "Accepted"})
     except Exception as e:
@@ -690,8 +884,16 @@ def stk_callback(request):
     """Handles STK Push callback from M-Pesa (Success or Failure)."""
     if request.method != "POST":
         return JsonResponse({"error": "Method not allowed"}, status=405)
+    ack = fast_ack(request, CallbackInbox.KIND_STK_CALLBACK)
+    if ack is not None:
+        return ack
+    return apply_stk_callback(json_body(request), remote_addr=request.META.get("REMOTE_ADDR"))
+
+
+@deduplicated(CallbackInbox.KIND_STK_CALLBACK)
+def apply_stk_callback(raw, *, remote_addr):
+    """Apply an STK callback payload (also replayed by the callback inbox worker)."""
     try:
-        raw = json_body(request)
         stk_callback_data = raw.get("Body", {}).get("stkCallback") if isinstance(raw, dict) else None
         if not stk_callback_data:
             stk_callback_data = raw
@@ -742,17 +944,17 @@ def stk_callback(request):
         if not payment and merchant_request_id:
             payment = MpesaPayment.objects.filter(merchant_request_id=merchant_request_id).first()
 
+        # Resolve the mapping up front so each row below is written with a single statement.
+        mapped = map_safaricom_status(code=result_code, message=result_desc)
+
+        before = payment_contribution(payment) if payment else None
         if payment:
             if (payment.status or "").lower() not in {"successful", "failed"}:
                 payment.status = desired_status
                 payment.result_code = result_code
                 payment.result_description = result_desc
-                apply_mapped_status(
-                    payment,
-                    external_system="safaricom",
-                    external_code=result_code,
-                    external_message=result_desc,
-                )
+                payment.internal_status_code = mapped.status_code
+                payment.internal_status_message = mapped.status_message
             payment.merchant_request_id = merchant_request_id or payment.merchant_request_id
             payment.checkout_request_id = checkout_request_id or payment.checkout_request_id
             payment.amount = amount or payment.amount
@@ -767,28 +969,27 @@ def stk_callback(request):
                 payment.shortcode = initiation.shortcode
             if not (payment.product_type or "").strip() and initiation:
                 payment.product_type = str(initiation.product_type or "").strip()[:60]
-            payment.save(
-                update_fields=[
-                    "merchant_request_id",
-                    "checkout_request_id",
-                    "transaction_id",
-                    "product_type",
-                    "amount",
-                    "mpesa_receipt_number",
-                    "transaction_date",
-                    "phone_number",
-                    "status",
-                    "result_code",
-                    "result_description",
-                    "internal_status_code",
-                    "internal_status_message",
-                    "business",
-                    "shortcode",
-                    "updated_at",
-                ]
-            )
+            update_fields = [
+                "merchant_request_id",
+                "checkout_request_id",
+                "transaction_id",
+                "product_type",
+                "amount",
+                "mpesa_receipt_number",
+                "transaction_date",
+                "phone_number",
+                "status",
+                "result_code",
+                "result_description",
+                "internal_status_code",
+                "internal_status_message",
+                "business",
+                "shortcode",
+                "updated_at",
+            ]
         else:
-            payment = MpesaPayment.objects.create(
+            update_fields = None
+            payment = MpesaPayment(
                 merchant_request_id=merchant_request_id,
                 checkout_request_id=checkout_request_id,
                 transaction_id=txn_id or None,
@@ -802,35 +1003,25 @@ def stk_callback(request):
                 status=desired_status,
                 business=initiation.business if initiation else None,
                 shortcode=initiation.shortcode if initiation else None,
+                internal_status_code=mapped.status_code,
+                internal_status_message=mapped.status_message,
             )
-            apply_mapped_status(
-                payment,
-                external_system="safaricom",
-                external_code=result_code,
-                external_message=result_desc,
-            )
-            payment.save(update_fields=["internal_status_code", "internal_status_message", "updated_at"])
-
-        cb = MpesaCallBacks.objects.create(
-            ip_address=request.META.get("REMOTE_ADDR"),
-            caller="STK Push Callback",
-            conversation_id=merchant_request_id,
-            content=stk_callback_data,
-            result_code=result_code,
-            result_description=result_desc,
-            business=initiation.business if initiation else None,
-            shortcode=initiation.shortcode if initiation else None,
-        )
 
-        apply_mapped_status(
-            cb,
-            external_system="safaricom",
-            external_code=result_code,
-            external_message=result_desc,
-            code_field="internal_status_code",
-            message_field="internal_status_message",
-        )
-        cb.save(update_fields=["internal_status_code", "internal_status_message", "updated_at"])
+        with transaction.atomic():
+            payment.save(update_fields=update_fields)
+            record_change(before, payment_contribution(payment))
+            MpesaCallBacks.objects.create(
+                ip_address=remote_addr,
+                caller="STK Push Callback",
+                conversation_id=merchant_request_id,
+                content=stk_callback_data,
+                result_code=result_code,
+                result_description=result_desc,
+                internal_status_code=mapped.status_code,
+                internal_status_message=mapped.status_message,
+                business=initiation.business if initiation else None,
+                shortcode=initiation.shortcode if initiation else None,
+            )
 
         return JsonResponse({"ResultCode": 0, "ResultDesc": "Received Successfully"})
     except Exception as e:
@@ -873,9 +1064,24 @@ def stk_error(request):
         return JsonResponse({"error": str(e)}, status=500)
 
 
+def _transactions_response(request, transactions):
+    """One page of `transactions` (newest first), or every row as NDJSON with `?format=ndjson`.
+
+    Pass `next_cursor` back as `?cursor=` to fetch the next page.
+    """
+    cursor = request.GET.get("cursor") or None
+    try:
+        if str(request.GET.get("format") or "").strip().lower() == "ndjson":
+            return ndjson_response(transactions, cursor=cursor)
+        rows, next_cursor = keyset_page(transactions, cursor=cursor, limit=parse_limit_param(request, default=200, max_limit=1000))
+    except InvalidCursor as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({"transactions": rows, "next_cursor": next_cursor})
+
+
 @require_oauth2(scopes=["transactions:read"], message="Please sign in with a staff account to view transactions.")
 def transactions_completed(request):
-    """Fetch completed M-Pesa transactions with optional filters."""
+    """Fetch completed M-Pesa transactions with optional filters (cursor-paginated)."""
     if request.method != "GET":
         return JsonResponse({"error": "Method not allowed"}, status=405)
     try:
@@ -891,27 +1097,32 @@ def transactions_completed(request):
         if date_filter:
             try:
                 date_obj = datetime.datetime.strptime(date_filter, "%d/%m/%Y").date()
-                transactions = transactions.filter(transaction_date__date=date_obj)
+                # A range (not __date) so the (business, transaction_date) index can be used.
+                day_start = timezone.make_aware(datetime.datetime.combine(date_obj, datetime.time.min))
+                transactions = transactions.filter(
+                    transaction_date__gte=day_start,
+                    transaction_date__lt=day_start + datetime.timedelta(days=1),
+                )
             except ValueError:
                 return JsonResponse({"error": "Invalid date format. Use dd/mm/yyyy."}, status=400)
 
         if status_filter:
             status_filter = str(status_filter).lower()
             if status_filter in ["failed", "successful"]:
-                transactions = transactions.filter(status__iexact=status_filter)
+                transactions = transactions.filter(status=status_filter)
             else:
                 return JsonResponse({"error": "Invalid status. Use 'failed' or 'successful'."}, status=400)
         else:
             transactions = transactions.filter(status="successful")
 
-        return JsonResponse({"transactions": list(transactions.values())})
+        return _transactions_response(request, transactions)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
 
 
 @require_oauth2(scopes=["transactions:read"], message="Please sign in with a staff account to view transactions.")
 def transactions_all(request):
-    """Fetch all M-Pesa transactions."""
+    """Fetch all M-Pesa transactions (cursor-paginated)."""
     if request.method != "GET":
         return JsonResponse({"error": "Method not allowed"}, status=405)
     try:
@@ -927,16 +1138,24 @@ def transactions_all(request):
             business_id = request.GET.get("business_id")
             if business_id:
                 transactions = transactions.filter(business_id=business_id)
-        return JsonResponse({"transactions": list(transactions.values())})
+        return _transactions_response(request, transactions)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
 
 
+def _parse_day(value: str):
+    try:
+        return datetime.datetime.strptime(str(value).strip(), "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
 @require_oauth2(scopes=["transactions:read"], message="Please sign in with a staff account to view transactions.")
 def transactions_aggregate(request):
-    """Aggregate transactions by product type.
+    """Aggregate transactions by product type (read from the daily rollup table).
 
     OAuth callers are scoped to their bound business; staff can optionally filter by business_id.
+    Optional filters: date_from / date_to (YYYY-MM-DD, inclusive) and shortcode.
     """
     if request.method != "GET":
         return JsonResponse({"error": "Method not allowed"}, status=405)
@@ -951,81 +1170,31 @@ def transactions_aggregate(request):
             if error:
                 return error
 
-        def _pt(value: str) -> str:
-            return str(value or "").strip()[:60]
-
-        def _add(bucket: dict[str, dict[str, Decimal]], product_type: str, key: str, amount: Decimal):
-            pt = _pt(product_type)
-            if pt not in bucket:
-                bucket[pt] = {"c2b_incoming": Decimal("0"), "b2c_outgoing": Decimal("0"), "b2b_outgoing": Decimal("0")}
-            bucket[pt][key] = bucket[pt][key] + amount
-
-        by_product: dict[str, dict[str, Decimal]] = {}
+        date_from, date_to = request.GET.get("date_from"), request.GET.get("date_to")
+        start = _parse_day(date_from) if date_from else None
+        end = _parse_day(date_to) if date_to else None
+        if (date_from and start is None) or (date_to and end is None):
+            return JsonResponse({"error": "Invalid date. Use YYYY-MM-DD."}, status=400)
+        shortcode = str(request.GET.get("shortcode") or "").strip()
 
-        # C2B / STK incoming
-        qs_c2b = MpesaPayment.objects.filter(status__iexact="successful")
+        # Read the incrementally maintained daily rollup instead of the raw payment tables.
+        rollups = DailyTransactionRollup.objects.filter(count__gt=0)
         if business is not None:
-            qs_c2b = qs_c2b.filter(business=business)
-        for p in qs_c2b.only("product_type", "amount"):
-            try:
-                amt = Decimal(str(p.amount or 0))
-            except (InvalidOperation, TypeError):
-                continue
-            _add(by_product, getattr(p, "product_type", ""), "c2b_incoming", amt)
+            rollups = rollups.filter(business=business)
+        if start is not None:
+            rollups = rollups.filter(day__gte=start)
+        if end is not None:
+            rollups = rollups.filter(day__lte=end)
+        if shortcode:
+            rollups = rollups.filter(shortcode=shortcode)
 
-        # B2C outgoing (single requests)
-        from b2c_api.models import B2CPaymentRequest, BulkPayoutItem
-
-        qs_b2c = B2CPaymentRequest.objects.filter(status=B2CPaymentRequest.STATUS_RESULT, result_code=0)
-        if business is not None:
-            qs_b2c = qs_b2c.filter(business=business)
-        for pr in qs_b2c.only("product_type", "request_payload"):
-            payload = pr.request_payload if isinstance(pr.request_payload, dict) else {}
-            amount_raw = payload.get("Amount")
-            try:
-                amt = Decimal(str(amount_raw or 0))
-            except (InvalidOperation, TypeError):
-                continue
-            _add(by_product, getattr(pr, "product_type", ""), "b2c_outgoing", amt)
-
-        # B2C outgoing (bulk items marked completed)
-        qs_b2c_items = BulkPayoutItem.objects.filter(status="completed")
-        if business is not None:
-            qs_b2c_items = qs_b2c_items.filter(batch__business=business)
-        for item in qs_b2c_items.select_related("batch").only("product_type", "amount"):
-            try:
-                amt = Decimal(str(item.amount or 0))
-            except (InvalidOperation, TypeError):
-                continue
-            _add(by_product, getattr(item, "product_type", ""), "b2c_outgoing", amt)
-
-        # B2B outgoing (single USSD push requests)
-        from b2b_api.models import B2BUSSDPushRequest, BulkBusinessPaymentItem
-
-        qs_b2b = B2BUSSDPushRequest.objects.filter(status=B2BUSSDPushRequest.STATUS_SUCCESS)
-        if business is not None:
-            qs_b2b = qs_b2b.filter(business=business)
-        for req in qs_b2b.only("product_type", "amount", "request_payload"):
-            amount_raw = req.amount
-            if not str(amount_raw or "").strip():
-                payload = req.request_payload if isinstance(req.request_payload, dict) else {}
-                amount_raw = payload.get("amount")
-            try:
-                amt = Decimal(str(amount_raw or 0))
-            except (InvalidOperation, TypeError):
-                continue
-            _add(by_product, getattr(req, "product_type", ""), "b2b_outgoing", amt)
-
-        # B2B outgoing (bulk items marked completed)
-        qs_b2b_items = BulkBusinessPaymentItem.objects.filter(status="completed")
-        if business is not None:
-            qs_b2b_items = qs_b2b_items.filter(batch__business=business)
-        for item in qs_b2b_items.select_related("batch").only("product_type", "amount"):
-            try:
-                amt = Decimal(str(item.amount or 0))
-            except (InvalidOperation, TypeError):
-                continue
-            _add(by_product, getattr(item, "product_type", ""), "b2b_outgoing", amt)
+        by_product: dict[str, dict[str, Decimal]] = {}
+        for row in rollups.order_by().values("product_type", "direction").annotate(total=models.Sum("amount")):
+            pt = row["product_type"]
+            if pt not in by_product:
+                by_product[pt] = {"c2b_incoming": Decimal("0"), "b2c_outgoing": Decimal("0"), "b2b_outgoing": Decimal("0")}
+            if row["direction"] in by_product[pt]:
+                by_product[pt][row["direction"]] += Decimal(str(row["total"] or 0)).quantize(Decimal("0.01"))
 
         # Totals
         totals = {"c2b_incoming": Decimal("0"), "b2c_outgoing": Decimal("0"), "b2b_outgoing": Decimal("0")}
@@ -28,6 +28,8 @@ export function TransactionsPage() {
   const [error, setError] = useState<string>("");
   const [mode, setMode] = useState<"all" | "completed">("all");
   const [transactions, setTransactions] = useState<TransactionRecord[]>([]);
+  // Set while the API has more (older) pages; see `next_cursor`.
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
 
   const [txnStatusLoading, setTxnStatusLoading] = useState(false);
   const [txnStatusId, setTxnStatusId] = useState("");
@@ -40,16 +42,19 @@ export function TransactionsPage() {
   const [aggResp, setAggResp] = useState<unknown>(null);
 
   const fetchTransactions = useCallback(
-    async (selectedMode: "all" | "completed") => {
+    async (selectedMode: "all" | "completed", cursor?: string) => {
       setLoading(true);
       setStatus(null);
       setError("");
 
       try {
-        const path =
+        const base =
           selectedMode === "completed"
             ? "/api/v1/c2b/transactions/completed"
             : "/api/v1/c2b/transactions/all";
+        const path = cursor
+          ? `${base}?cursor=${encodeURIComponent(cursor)}`
+          : base;
         const result = await apiRequest(path, { method: "GET" });
         setStatus(result.status);
 
@@ -58,9 +63,16 @@ export function TransactionsPage() {
             ? result.data["transactions"]
             : undefined;
           const list = Array.isArray(tx) ? (tx as TransactionRecord[]) : [];
-          setTransactions(list);
+          const next = isRecord(result.data)
+            ? result.data["next_cursor"]
+            : undefined;
+          setTransactions((prev) => (cursor ? [...prev, ...list] : list));
+          setNextCursor(typeof next === "string" && next ? next : null);
         } else {
-          setTransactions([]);
+          if (!cursor) {
+            setTransactions([]);
+            setNextCursor(null);
+          }
           const apiError = getErrorString(result.data);
 
           if (result.status === 401 && apiError === "Missing API key") {
@@ -192,6 +204,9 @@ export function TransactionsPage() {
           {loading ? "Refreshing…" : "Refresh"}
         </button>
         {status !== null ? <span className='badge'>HTTP {status}</span> : null}
+        <span className='badge'>
+          {transactions.length} loaded{nextCursor ? " (more available)" : ""}
+        </span>
       </div>
 
       <section className='panel' aria-label='Transaction status'>
@@ -292,6 +307,19 @@ export function TransactionsPage() {
           </tbody>
         </table>
       </div>
+
+      {nextCursor ? (
+        <div className='actions'>
+          <button
+            className='button'
+            type='button'
+            onClick={() => fetchTransactions(mode, nextCursor)}
+            disabled={loading}
+          >
+            {loading ? "Loading…" : "Load more"}
+          </button>
+        </div>
+      ) : null}
     </section>
   );
 }
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import MpesaCallBacks, MpesaCalls, MpesaPayment, StkPushCallback, StkPushError
+from .models import CallbackInbox, CallbackReceipt, DailyTransactionRollup, MpesaCallBacks, MpesaCalls, MpesaPayment, StkPushCallback, StkPushError
 
 @admin.register(MpesaPayment)
 class MpesaPaymentAdmin(admin.ModelAdmin):
@@ -83,3 +83,28 @@ class StkPushErrorAdmin(admin.ModelAdmin):
     search_fields = ("merchant_request_id", "error_code", "error_message", "ip_address")
     ordering = ("-created_at",)
     readonly_fields = ("created_at", "updated_at")
+
+
+@admin.register(DailyTransactionRollup)
+class DailyTransactionRollupAdmin(admin.ModelAdmin):
+    list_display = ("day", "direction", "business", "shortcode", "product_type", "amount", "count")
+    list_filter = ("direction", "day", "business")
+    search_fields = ("shortcode", "product_type")
+    ordering = ("-day",)
+    readonly_fields = ("updated_at",)
+
+
+@admin.register(CallbackInbox)
+class CallbackInboxAdmin(admin.ModelAdmin):
+    list_display = ("id", "created_at", "kind", "status", "attempts", "processed_at")
+    list_filter = ("kind", "status", "created_at")
+    ordering = ("-id",)
+    readonly_fields = ("created_at", "updated_at", "payload")
+
+
+@admin.register(CallbackReceipt)
+class CallbackReceiptAdmin(admin.ModelAdmin):
+    list_display = ("id", "created_at", "kind", "natural_key")
+    list_filter = ("kind", "created_at")
+    search_fields = ("natural_key", "content_hash")
+    ordering = ("-id",)
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from services_common.callback_inbox import process_pending, requeue_stale
+
+
+class Command(BaseCommand):
+    help = "Apply callbacks stored by the fast-ack path (CALLBACK_FAST_ACK)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=200, help="Max callbacks to apply per pass (default: 200)")
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling the inbox instead of exiting after one pass",
+        )
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds between passes with --loop (default: 1)")
+        parser.add_argument(
+            "--stale-seconds",
+            type=int,
+            default=300,
+            help="Re-queue callbacks stuck in processing for this long (default: 300)",
+        )
+
+    def handle(self, *args, **options):
+        limit = max(int(options["limit"]), 1)
+        while True:
+            requeued = requeue_stale(older_than_seconds=max(int(options["stale_seconds"]), 1))
+            processed = process_pending(limit=limit)
+            self.stdout.write(f"Processed callback inbox. claimed={processed} requeued={requeued}")
+            if not options["loop"]:
+                return
+            if processed < limit:
+                time.sleep(max(float(options["interval"]), 0.1))
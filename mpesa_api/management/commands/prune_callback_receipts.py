@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from services_common.callback_dedup import prune_receipts
+
+
+class Command(BaseCommand):
+    help = "Delete callback dedup receipts older than CALLBACK_RECEIPT_RETENTION_DAYS"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help="Retention in days (default: CALLBACK_RECEIPT_RETENTION_DAYS; 0 disables)",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows deleted per statement (default: 5000)")
+
+    def handle(self, *args, **options):
+        deleted = prune_receipts(older_than_days=options["days"], batch_size=max(int(options["batch_size"]), 1))
+        self.stdout.write(f"Pruned callback receipts. deleted={deleted}")
@@ -0,0 +1,24 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from services_common.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute DailyTransactionRollup rows from the raw payment tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", default="", help="Only rebuild days from this date on (YYYY-MM-DD)")
+        parser.add_argument("--business-id", default="", help="Only rebuild rows for this business")
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            try:
+                since = datetime.datetime.strptime(options["since"], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("--since must be YYYY-MM-DD")
+
+        written = rebuild_rollups(since=since, business_id=options["business_id"] or None)
+        self.stdout.write(f"Rebuilt daily transaction rollups. rows={written}")
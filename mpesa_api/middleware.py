@@ -1,28 +1,53 @@
-import time
-
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.conf import settings
-from django.core.cache import cache
 from django.http import JsonResponse
 
+from services_common.rate_limit import caller_key, hit, quota_for
+
 
 class InternalEndpointsRateLimitMiddleware:
-    """Very small fixed-window rate limiter for internal endpoints.
+    """Sliding-window rate limiter for internal endpoints.
 
     - Applies to configured paths only.
-    - Keyed by (client_ip, path, window).
-    - Uses Django cache (default LocMemCache if not configured).
+    - Keyed by caller (bound business, OAuth client, staff user or client IP) and by
+      the view's required OAuth scopes, or by path for views without scopes.
+    - Quotas come from RATE_LIMIT_SCOPE_QUOTAS, falling back to INTERNAL_RATE_LIMIT_REQUESTS.
+    - Every limited response carries X-RateLimit-Limit/Remaining/Reset headers.
 
-    This is intentionally simple (dev-friendly) and should be backed by a shared
-    cache like Redis in multi-worker production deployments.
+    Counters live in the Django cache (see `services_common.rate_limit`); use a
+    shared cache like Redis in multi-worker production deployments.
+
+    Sync and async capable: under ASGI the chain stays async, and Django runs
+    `process_view` (cache access) in a thread.
     """
 
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self._add_headers(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self._add_headers(request, await self.get_response(request))
+
+    def _add_headers(self, request, response):
+        result = getattr(request, "_rate_limit_result", None)
+        if result is not None:
+            for header, value in result.headers().items():
+                response[header] = value
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
         enabled = bool(getattr(settings, "INTERNAL_RATE_LIMIT_ENABLED", True))
         if not enabled:
-            return self.get_response(request)
+            return None
 
         paths = getattr(settings, "INTERNAL_RATE_LIMIT_PATHS", None)
         limit = getattr(settings, "INTERNAL_RATE_LIMIT_REQUESTS", None)
@@ -30,53 +55,39 @@ class InternalEndpointsRateLimitMiddleware:
 
         # If not configured, skip (fail open).
         if not paths or not limit or not window_seconds:
-            return self.get_response(request)
+            return None
 
         try:
             paths_set = set(paths)
             limit = int(limit)
             window_seconds = int(window_seconds)
         except Exception:
-            return self.get_response(request)
+            return None
 
         if request.path not in paths_set:
-            return self.get_response(request)
+            return None
 
-        client_ip = self._get_client_ip(request)
-        bucket = int(time.time() // window_seconds)
-        cache_key = f"internal_rl:{client_ip}:{request.path}:{bucket}"
+        scopes = sorted(getattr(view_func, "oauth2_required_scopes", None) or [])
+        limit = quota_for(scopes, limit)
+        bucket = ",".join(scopes) or request.path
 
         try:
-            current = cache.get(cache_key)
-            if current is None:
-                cache.set(cache_key, 1, timeout=window_seconds)
-                current = 1
-            else:
-                # cache.incr is atomic for many backends
-                try:
-                    current = cache.incr(cache_key)
-                except Exception:
-                    current = int(current) + 1
-                    cache.set(cache_key, current, timeout=window_seconds)
+            result = hit(f"{caller_key(request)}:{bucket}", limit=limit, window_seconds=window_seconds)
         except Exception:
             # Fail open on cache errors.
-            return self.get_response(request)
-
-        if current > limit:
-            retry_after = window_seconds - int(time.time() % window_seconds)
-            response = JsonResponse(
-                {
-                    "error": "Rate limit exceeded",
-                    "limit": limit,
-                    "window_seconds": window_seconds,
-                },
-                status=429,
-            )
-            response["Retry-After"] = str(max(retry_after, 1))
-            return response
-
-        return self.get_response(request)
-
-    def _get_client_ip(self, request):
-        # Conservative default: REMOTE_ADDR only (avoids spoofing X-Forwarded-For).
-        return request.META.get("REMOTE_ADDR") or "unknown"
+            return None
+
+        request._rate_limit_result = result
+        if result.allowed:
+            return None
+
+        response = JsonResponse(
+            {
+                "error": "Rate limit exceeded",
+                "limit": limit,
+                "window_seconds": window_seconds,
+            },
+            status=429,
+        )
+        response["Retry-After"] = str(result.reset_seconds)
+        return response
@@ -0,0 +1,51 @@
+import uuid
+
+from django.db import migrations, models
+
+
+def populate_tracking_ids(apps, schema_editor):
+    StkPushInitiation = apps.get_model("mpesa_api", "StkPushInitiation")
+    for row in StkPushInitiation.objects.filter(tracking_id__isnull=True).only("id").iterator():
+        row.tracking_id = uuid.uuid4()
+        row.save(update_fields=["tracking_id"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa_api', '0007_mpesacallbacks_internal_status_code_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stkpushinitiation',
+            name='tracking_id',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(populate_tracking_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='stkpushinitiation',
+            name='tracking_id',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.AddField(
+            model_name='stkpushinitiation',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('dispatching', 'Dispatching'), ('sent', 'Sent'), ('rejected', 'Rejected'), ('failed', 'Failed')], db_index=True, default='sent', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='stkpushinitiation',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='stkpushinitiation',
+            name='last_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='stkpushinitiation',
+            name='dispatched_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
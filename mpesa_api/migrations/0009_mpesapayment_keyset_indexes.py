@@ -0,0 +1,22 @@
+# Generated by Django 5.1.15 on 2026-10-16 23:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business_api', '0005_business_business_type'),
+        ('mpesa_api', '0008_stkpushinitiation_dispatch'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mpesapayment',
+            index=models.Index(fields=['created_at', 'id'], name='mpesa_payment_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mpesapayment',
+            index=models.Index(fields=['business', 'created_at', 'id'], name='mpesa_payment_biz_created_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.15 on 2026-10-16 23:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business_api', '0005_business_business_type'),
+        ('mpesa_api', '0009_mpesapayment_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyTransactionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shortcode', models.CharField(blank=True, default='', max_length=20)),
+                ('product_type', models.CharField(blank=True, default='', max_length=60)),
+                ('direction', models.CharField(choices=[('c2b_incoming', 'C2B incoming'), ('b2c_outgoing', 'B2C outgoing'), ('b2b_outgoing', 'B2B outgoing')], max_length=20)),
+                ('day', models.DateField()),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('business', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='business_api.business')),
+            ],
+            options={
+                'ordering': ['-day'],
+                'indexes': [models.Index(fields=['business', 'day'], name='daily_rollup_business_day_idx'), models.Index(fields=['day'], name='daily_rollup_day_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('business__isnull', False)), fields=('business', 'shortcode', 'product_type', 'direction', 'day'), name='daily_rollup_business_key'), models.UniqueConstraint(condition=models.Q(('business__isnull', True)), fields=('shortcode', 'product_type', 'direction', 'day'), name='daily_rollup_unassigned_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.15 on 2026-10-16 23:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business_api', '0005_business_business_type'),
+        ('mpesa_api', '0010_dailytransactionrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mpesapayment',
+            index=models.Index(fields=['checkout_request_id'], name='mpesa_payment_checkout_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mpesapayment',
+            index=models.Index(fields=['merchant_request_id'], name='mpesa_payment_merchant_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mpesapayment',
+            index=models.Index(fields=['transaction_id'], name='mpesa_payment_txn_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mpesapayment',
+            index=models.Index(fields=['mpesa_receipt_number'], name='mpesa_payment_receipt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mpesapayment',
+            index=models.Index(fields=['business', 'status', 'created_at'], name='mpesa_payment_biz_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mpesapayment',
+            index=models.Index(fields=['business', 'transaction_date'], name='mpesa_payment_biz_txn_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mpesapayment',
+            index=models.Index(fields=['status', 'created_at'], name='mpesa_payment_status_idx'),
+        ),
+    ]
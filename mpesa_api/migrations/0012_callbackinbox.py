@@ -0,0 +1,32 @@
+# Generated by Django 5.1.15 on 2026-10-16 23:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa_api', '0011_mpesapayment_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CallbackInbox',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('kind', models.CharField(choices=[('stk_callback', 'STK callback'), ('c2b_confirmation', 'C2B confirmation'), ('transaction_status_result', 'Transaction status result'), ('b2c_result', 'B2C result'), ('b2b_result', 'B2B result')], max_length=40)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('remote_addr', models.GenericIPAddressField(blank=True, null=True)),
+                ('status', models.CharField(default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['status', 'id'], name='callback_inbox_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.15 on 2026-10-16 23:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa_api', '0012_callbackinbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CallbackReceipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('kind', models.CharField(max_length=40)),
+                ('natural_key', models.CharField(max_length=200)),
+                ('content_hash', models.CharField(max_length=64)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'constraints': [models.UniqueConstraint(fields=('kind', 'natural_key', 'content_hash'), name='callback_receipt_unique')],
+            },
+        ),
+    ]
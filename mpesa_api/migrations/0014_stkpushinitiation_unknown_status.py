@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-17 00:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa_api', '0013_callbackreceipt'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stkpushinitiation',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('dispatching', 'Dispatching'), ('sent', 'Sent'), ('rejected', 'Rejected'), ('failed', 'Failed'), ('unknown', 'Unknown')], db_index=True, default='sent', max_length=20),
+        ),
+    ]
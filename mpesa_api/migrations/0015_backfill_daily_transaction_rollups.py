@@ -0,0 +1,111 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db import migrations
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Cast, TruncDate
+
+
+# Frozen copy of services_common.rollups.rebuild_rollups as of this migration.
+_NUMERIC_AMOUNT_REGEX = r"^[0-9]+(\.[0-9]+)?$"
+
+
+def _amount(value):
+    try:
+        amount = Decimal(str(value).strip()).quantize(Decimal("0.01"))
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+    return amount if amount.is_finite() else None
+
+
+def _group(qs, *, business, shortcode, amount):
+    return (
+        qs.order_by()
+        .annotate(day=TruncDate("created_at"), sc=shortcode, pt=F("product_type"), biz=F(business))
+        .values("biz", "sc", "pt", "day")
+        .annotate(total=Sum(amount), n=Count("pk"))
+    )
+
+
+def backfill_rollups(apps, _schema_editor):
+    """Build the daily rollups from the raw payment tables, so aggregates are right straight after deploy."""
+
+    DailyTransactionRollup = apps.get_model("mpesa_api", "DailyTransactionRollup")
+    MpesaPayment = apps.get_model("mpesa_api", "MpesaPayment")
+    B2CPaymentRequest = apps.get_model("b2c_api", "B2CPaymentRequest")
+    BulkPayoutItem = apps.get_model("b2c_api", "BulkPayoutItem")
+    B2BUSSDPushRequest = apps.get_model("b2b_api", "B2BUSSDPushRequest")
+    BulkBusinessPaymentItem = apps.get_model("b2b_api", "BulkBusinessPaymentItem")
+
+    sources = [
+        ("c2b_incoming", _group(
+            MpesaPayment.objects.filter(status="successful"),
+            business="business",
+            shortcode=F("shortcode__shortcode"),
+            amount="amount",
+        )),
+        ("b2c_outgoing", _group(
+            B2CPaymentRequest.objects.filter(status="result", result_code=0, amount__isnull=False),
+            business="business",
+            shortcode=KeyTextTransform("PartyA", "request_payload"),
+            amount="amount",
+        )),
+        ("b2c_outgoing", _group(
+            BulkPayoutItem.objects.filter(status="completed", payment_requests__isnull=True),
+            business="batch__business",
+            shortcode=KeyTextTransform("party_a", "batch__meta"),
+            amount="amount",
+        )),
+        ("b2b_outgoing", _group(
+            B2BUSSDPushRequest.objects.filter(status="success", amount__regex=_NUMERIC_AMOUNT_REGEX),
+            business="business",
+            shortcode=KeyTextTransform("primaryShortCode", "request_payload"),
+            amount=Cast("amount", output_field=DecimalField(max_digits=14, decimal_places=2)),
+        )),
+        ("b2b_outgoing", _group(
+            BulkBusinessPaymentItem.objects.filter(status="completed", ussd_push_requests__isnull=True),
+            business="batch__business",
+            shortcode=KeyTextTransform("primary_short_code", "batch__meta"),
+            amount="amount",
+        )),
+    ]
+
+    totals = {}
+    for direction, rows in sources:
+        for row in rows.iterator():
+            if row["day"] is None:
+                continue
+            key = (row["biz"], str(row["sc"] or "").strip()[:20], str(row["pt"] or "").strip()[:60], direction, row["day"])
+            bucket = totals.setdefault(key, [Decimal("0"), 0])
+            bucket[0] += _amount(row["total"] or 0) or Decimal("0")
+            bucket[1] += row["n"]
+
+    DailyTransactionRollup.objects.all().delete()
+    DailyTransactionRollup.objects.bulk_create(
+        [
+            DailyTransactionRollup(
+                business_id=business,
+                shortcode=shortcode,
+                product_type=product_type,
+                direction=direction,
+                day=day,
+                amount=amount,
+                count=count,
+            )
+            for (business, shortcode, product_type, direction, day), (amount, count) in totals.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('b2b_api', '0007_backfill_b2bussdpushrequest_amount'),
+        ('b2c_api', '0007_b2cpaymentrequest_status_idx'),
+        ('mpesa_api', '0014_stkpushinitiation_unknown_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.15 on 2026-10-17 00:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa_api', '0015_backfill_daily_transaction_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='callbackreceipt',
+            index=models.Index(fields=['created_at'], name='callback_receipt_created_idx'),
+        ),
+    ]
@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 
 class BaseModel(models.Model):
@@ -73,6 +75,23 @@ class MpesaPayment(BaseModel):
     internal_status_code = models.IntegerField(null=True, blank=True)
     internal_status_message = models.TextField(blank=True, default="")
 
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            # Keyset pagination of the transactions endpoints (see services_common.pagination).
+            models.Index(fields=["created_at", "id"], name="mpesa_payment_created_id_idx"),
+            models.Index(fields=["business", "created_at", "id"], name="mpesa_payment_biz_created_idx"),
+            # Callback correlation (stk_callback, confirmation, transaction_status_result).
+            models.Index(fields=["checkout_request_id"], name="mpesa_payment_checkout_idx"),
+            models.Index(fields=["merchant_request_id"], name="mpesa_payment_merchant_idx"),
+            models.Index(fields=["transaction_id"], name="mpesa_payment_txn_id_idx"),
+            models.Index(fields=["mpesa_receipt_number"], name="mpesa_payment_receipt_idx"),
+            # Listings and reports.
+            models.Index(fields=["business", "status", "created_at"], name="mpesa_payment_biz_status_idx"),
+            models.Index(fields=["business", "transaction_date"], name="mpesa_payment_biz_txn_date_idx"),
+            models.Index(fields=["status", "created_at"], name="mpesa_payment_status_idx"),
+        ]
+
     def __str__(self):
         return f"Transaction {self.transaction_id} - {self.status}"
 
@@ -112,8 +131,33 @@ class StkPushInitiation(BaseModel):
 
     STK callbacks do not reliably include BusinessShortCode, so we persist the
     CheckoutRequestID at initiation time and use it to resolve tenancy later.
+
+    In async mode the row is created first (status=queued) and `tracking_id` is
+    returned to the caller; the Daraja response is filled in by the dispatcher.
     """
 
+    STATUS_QUEUED = "queued"
+    STATUS_DISPATCHING = "dispatching"
+    STATUS_SENT = "sent"
+    STATUS_REJECTED = "rejected"
+    STATUS_FAILED = "failed"
+    STATUS_UNKNOWN = "unknown"
+
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_DISPATCHING, "Dispatching"),
+        (STATUS_SENT, "Sent"),
+        (STATUS_REJECTED, "Rejected"),
+        (STATUS_FAILED, "Failed"),
+        (STATUS_UNKNOWN, "Unknown"),
+    ]
+
+    tracking_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_SENT, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+
     business = models.ForeignKey(
         "business_api.Business",
         null=True,
@@ -219,3 +263,137 @@ class MpesaTransactionStatusQuery(BaseModel):
 
     def __str__(self):
         return f"Txn Status Query - {self.transaction_id or self.originator_conversation_id or ''}"
+
+
+class DailyTransactionRollup(models.Model):
+    """Per-day money totals by business, shortcode, product type and direction.
+
+    Kept up to date by the payment callbacks (see `services_common.rollups`) so reports
+    never have to scan the raw payment tables. Rebuild with
+    `python manage.py rebuild_transaction_rollups`.
+    """
+
+    DIRECTION_C2B_INCOMING = "c2b_incoming"
+    DIRECTION_B2C_OUTGOING = "b2c_outgoing"
+    DIRECTION_B2B_OUTGOING = "b2b_outgoing"
+
+    business = models.ForeignKey(
+        "business_api.Business",
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name="daily_rollups",
+    )
+    shortcode = models.CharField(max_length=20, blank=True, default="")
+    product_type = models.CharField(max_length=60, blank=True, default="")
+    direction = models.CharField(
+        max_length=20,
+        choices=[
+            (DIRECTION_C2B_INCOMING, "C2B incoming"),
+            (DIRECTION_B2C_OUTGOING, "B2C outgoing"),
+            (DIRECTION_B2B_OUTGOING, "B2B outgoing"),
+        ],
+    )
+    day = models.DateField()
+    amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-day"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["business", "shortcode", "product_type", "direction", "day"],
+                condition=models.Q(business__isnull=False),
+                name="daily_rollup_business_key",
+            ),
+            models.UniqueConstraint(
+                fields=["shortcode", "product_type", "direction", "day"],
+                condition=models.Q(business__isnull=True),
+                name="daily_rollup_unassigned_key",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["business", "day"], name="daily_rollup_business_day_idx"),
+            models.Index(fields=["day"], name="daily_rollup_day_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.direction} {self.product_type or '-'}: {self.amount} ({self.count})"
+
+
+class CallbackInbox(models.Model):
+    """Raw Safaricom callbacks stored by the fast-ack path (CALLBACK_FAST_ACK).
+
+    The callback views append one row and answer immediately; `python manage.py
+    process_callback_inbox` applies them later through the normal handlers.
+    """
+
+    KIND_STK_CALLBACK = "stk_callback"
+    KIND_C2B_CONFIRMATION = "c2b_confirmation"
+    KIND_TRANSACTION_STATUS_RESULT = "transaction_status_result"
+    KIND_B2C_RESULT = "b2c_result"
+    KIND_B2B_RESULT = "b2b_result"
+
+    STATUS_PENDING = "pending"
+    STATUS_PROCESSING = "processing"
+    STATUS_PROCESSED = "processed"
+    STATUS_FAILED = "failed"
+
+    id = models.BigAutoField(primary_key=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    kind = models.CharField(
+        max_length=40,
+        choices=[
+            (KIND_STK_CALLBACK, "STK callback"),
+            (KIND_C2B_CONFIRMATION, "C2B confirmation"),
+            (KIND_TRANSACTION_STATUS_RESULT, "Transaction status result"),
+            (KIND_B2C_RESULT, "B2C result"),
+            (KIND_B2B_RESULT, "B2B result"),
+        ],
+    )
+    payload = models.JSONField(default=dict, blank=True)
+    remote_addr = models.GenericIPAddressField(null=True, blank=True)
+
+    status = models.CharField(max_length=20, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(fields=["status", "id"], name="callback_inbox_status_idx"),
+        ]
+
+    def __str__(self):
+        return f"Callback {self.id} {self.kind} ({self.status})"
+
+
+class CallbackReceipt(models.Model):
+    """One row per distinct callback applied (see `services_common.callback_dedup`).
+
+    The unique constraint is the source of truth for "already applied"; a cache
+    entry in front of it answers most redeliveries without touching the database.
+    Rows older than CALLBACK_RECEIPT_RETENTION_DAYS are deleted by
+    `manage.py prune_callback_receipts`.
+    """
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    kind = models.CharField(max_length=40)
+    natural_key = models.CharField(max_length=200)
+    content_hash = models.CharField(max_length=64)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["created_at"], name="callback_receipt_created_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "natural_key", "content_hash"], name="callback_receipt_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.natural_key}"
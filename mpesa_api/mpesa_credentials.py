@@ -1,10 +1,12 @@
-import requests
 from requests.auth import HTTPBasicAuth
 from datetime import datetime
 import base64
 from dotenv import load_dotenv
 import os
 
+from services_common import outbound
+from services_common.daraja_tokens import get_access_token as get_cached_access_token, token_cache_key
+
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -18,22 +20,39 @@ class MpesaC2bCredential:
     TOKEN_URL = os.getenv('TOKEN_URL')
 
     @staticmethod
-    def get_access_token():
-        """Fetches and returns the Mpesa access token"""
-        if not MpesaC2bCredential.TOKEN_URL:
-            return None
-        if not MpesaC2bCredential.CONSUMER_KEY or not MpesaC2bCredential.CONSUMER_SECRET:
-            return None
-        response = requests.get(
+    def token_cache_key():
+        """Cache key for the env-configured credential's access token."""
+        return token_cache_key(
+            environment="env",
+            consumer_key=MpesaC2bCredential.CONSUMER_KEY or "",
+            token_url=MpesaC2bCredential.TOKEN_URL or "",
+        )
+
+    @staticmethod
+    def _fetch_access_token():
+        response = outbound.get(
             MpesaC2bCredential.TOKEN_URL,
             auth=HTTPBasicAuth(MpesaC2bCredential.CONSUMER_KEY, MpesaC2bCredential.CONSUMER_SECRET),
-            timeout=30,
         )
         try:
             response_data = response.json()
         except Exception:
+            return None, None
+        if not isinstance(response_data, dict):
+            return None, None
+        return response_data.get('access_token'), response_data.get('expires_in')
+
+    @staticmethod
+    def get_access_token():
+        """Returns the Mpesa access token, reusing a cached one until it nears expiry"""
+        if not MpesaC2bCredential.TOKEN_URL:
+            return None
+        if not MpesaC2bCredential.CONSUMER_KEY or not MpesaC2bCredential.CONSUMER_SECRET:
             return None
-        return response_data.get('access_token')
+        return get_cached_access_token(
+            MpesaC2bCredential.token_cache_key(),
+            MpesaC2bCredential._fetch_access_token,
+        )
 
 
 class LipanaMpesaPassword:
@@ -1,18 +1,35 @@
+import asyncio
 import json
 import os
+import time
 from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import skipUnless
 from unittest.mock import patch
 
+import httpx
+import requests
+
 from django.core.cache import cache
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
 from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db.models import Q
 from django.utils import timezone
 
 from oauth2_provider.models import AccessToken, Application
 
 from business_api.models import Business, MpesaShortcode, OAuthClientBusiness
 
-from .models import MpesaCallBacks, MpesaCalls, MpesaPayment, StkPushInitiation
+from services_common import circuit_breaker, outbound
+from services_common.daraja_tokens import clear_local_tokens
+from services_common.status_codes import allocate_internal_code, invalidate_status_code_cache, map_safaricom_status
+from status_codes.models import StatusCodeMapping
+
+from .models import DailyTransactionRollup, MpesaCallBacks, MpesaCalls, MpesaPayment, StkPushInitiation
 from .models import MpesaTransactionStatusQuery
 from .views import (
     admin_calls_log,
@@ -203,8 +220,9 @@ class MpesaViewsTests(TestCase):
             content_type="application/json",
         )
 
-        resp1 = stk_push_callback(req1)
-        resp2 = stk_push_callback(req2)
+        with self.captureOnCommitCallbacks(execute=True):
+            resp1 = stk_push_callback(req1)
+            resp2 = stk_push_callback(req2)
         self.assertEqual(resp1.status_code, 200)
         self.assertEqual(resp2.status_code, 200)
 
@@ -216,6 +234,11 @@ class MpesaViewsTests(TestCase):
         # Callback rows may be duplicated; payment should not.
         self.assertGreaterEqual(MpesaCallBacks.objects.count(), 1)
 
+        # ... and neither may the daily rollup.
+        rollup = DailyTransactionRollup.objects.get()
+        self.assertEqual((rollup.business_id, rollup.shortcode, rollup.direction), (biz.id, "174379", "c2b_incoming"))
+        self.assertEqual((rollup.amount, rollup.count), (Decimal("1.00"), 1))
+
     def test_stk_callback_endpoint_is_csrf_exempt(self):
         """M-Pesa callbacks won't include CSRF cookies/tokens; endpoint must accept POST."""
         csrf_client = Client(enforce_csrf_checks=True)
@@ -273,6 +296,133 @@ class InternalAuthTests(TestCase):
         response2 = all_transactions(request2)
         self.assertEqual(response2.status_code, 200)
 
+    def test_transactions_are_cursor_paginated_and_streamable(self):
+        payments = [MpesaPayment.objects.create(business=self.business, amount=i + 1, status="successful") for i in range(5)]
+        MpesaPayment.objects.create(amount=99, status="successful")  # other tenant
+        # Identical timestamps must still page deterministically (tie-break on id).
+        MpesaPayment.objects.filter(id__in=[p.id for p in payments[:3]]).update(created_at=timezone.now() - timedelta(hours=1))
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {self.access_token}"}
+
+        seen = []
+        cursor = ""
+        for _ in range(5):
+            resp = self.client.get("/api/v1/c2b/transactions/all", {"limit": 2, "cursor": cursor}, **headers)
+            self.assertEqual(resp.status_code, 200)
+            data = resp.json()
+            self.assertLessEqual(len(data["transactions"]), 2)
+            seen.extend(row["id"] for row in data["transactions"])
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+        expected = [p.id for p in payments[3:][::-1]] + [p.id for p in payments[:3][::-1]]
+        self.assertEqual(seen, expected)
+
+        stream = self.client.get("/api/v1/c2b/transactions/all", {"format": "ndjson"}, **headers)
+        self.assertEqual(stream.status_code, 200)
+        self.assertEqual(stream["Content-Type"], "application/x-ndjson")
+        lines = b"".join(stream.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)["id"] for line in lines], expected)
+
+        bad = self.client.get("/api/v1/c2b/transactions/all", {"cursor": "not-a-cursor"}, **headers)
+        self.assertEqual(bad.status_code, 400)
+
+    def test_transactions_aggregate_reads_rebuilt_rollups_with_filters(self):
+        from b2b_api.models import B2BUSSDPushRequest, BulkBusinessPaymentBatch, BulkBusinessPaymentItem
+        from b2c_api.models import B2CPaymentRequest, BulkPayoutBatch, BulkPayoutItem
+
+        shortcode = MpesaShortcode.objects.create(business=self.business, shortcode="600100")
+        MpesaPayment.objects.create(business=self.business, shortcode=shortcode, amount=100, status="successful", product_type="rent")
+        MpesaPayment.objects.create(business=self.business, amount=50, status="successful", product_type="rent")
+        MpesaPayment.objects.create(business=self.business, amount=999, status="failed", product_type="rent")
+        old = MpesaPayment.objects.create(business=self.business, amount=7, status="successful", product_type="rent")
+        MpesaPayment.objects.filter(id=old.id).update(created_at=timezone.now() - timedelta(days=30))
+
+        batch = BulkPayoutBatch.objects.create(business=self.business)
+        submitted = BulkPayoutItem.objects.create(batch=batch, recipient="2547", amount=20, status="completed", product_type="rent")
+        BulkPayoutItem.objects.create(batch=batch, recipient="2547", amount=5, status="completed", product_type="rent")
+        B2CPaymentRequest.objects.create(
+            business=self.business,
+            bulk_item=submitted,
+            originator_conversation_id="agg-1",
+            status=B2CPaymentRequest.STATUS_RESULT,
+            result_code=0,
+            amount=20,
+            request_payload={"Amount": 20, "PartyA": "600100"},
+            product_type="rent",
+        )
+
+        b2b_batch = BulkBusinessPaymentBatch.objects.create(business=self.business)
+        BulkBusinessPaymentItem.objects.create(batch=b2b_batch, recipient="600200", amount=3, status="completed", product_type="fees")
+        B2BUSSDPushRequest.objects.create(
+            business=self.business,
+            request_ref_id="agg-b2b-1",
+            status=B2BUSSDPushRequest.STATUS_SUCCESS,
+            amount="10.50",
+            request_payload={"primaryShortCode": "600300"},
+            product_type="fees",
+        )
+
+        # Rows above bypass the callbacks, so backfill the rollup as after an upgrade.
+        call_command("rebuild_transaction_rollups", stdout=StringIO())
+        self.assertEqual(DailyTransactionRollup.objects.filter(business=self.business, direction="c2b_incoming").count(), 3)
+
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {self.access_token}"}
+        resp = self.client.get("/api/v1/c2b/transactions/aggregate", {"date_from": timezone.localdate().isoformat()}, **headers)
+        self.assertEqual(resp.status_code, 200, resp.content)
+        data = resp.json()
+        self.assertEqual(data["by_product_type"]["rent"]["c2b_incoming"], "150.00")
+        self.assertEqual(data["by_product_type"]["rent"]["b2c_outgoing"], "25.00")
+        self.assertEqual(data["by_product_type"]["fees"]["b2b_outgoing"], "13.50")
+        self.assertEqual(data["totals"]["net"], "111.50")
+
+        resp = self.client.get("/api/v1/c2b/transactions/aggregate", {"shortcode": "600100"}, **headers)
+        data = resp.json()
+        self.assertEqual(data["totals"]["c2b_incoming"], "100.00")
+        self.assertEqual(data["totals"]["b2c_outgoing"], "20.00")
+        self.assertEqual(data["totals"]["b2b_outgoing"], "0")
+
+        bad = self.client.get("/api/v1/c2b/transactions/aggregate", {"date_to": "31/12/2024"}, **headers)
+        self.assertEqual(bad.status_code, 400)
+
+    def test_upgrade_migration_backfills_the_same_rollups_as_a_rebuild(self):
+        import importlib
+
+        from django.apps import apps
+
+        from b2c_api.models import BulkPayoutBatch, BulkPayoutItem
+
+        migration = importlib.import_module("mpesa_api.migrations.0015_backfill_daily_transaction_rollups")
+        shortcode = MpesaShortcode.objects.create(business=self.business, shortcode="600100")
+        MpesaPayment.objects.create(business=self.business, shortcode=shortcode, amount=100, status="successful", product_type="rent")
+        MpesaPayment.objects.create(business=self.business, amount=50, status="successful", product_type="rent")
+        batch = BulkPayoutBatch.objects.create(business=self.business, meta={"party_a": "600100"})
+        BulkPayoutItem.objects.create(batch=batch, recipient="2547", amount=5, status="completed", product_type="rent")
+
+        fields = ("business_id", "shortcode", "product_type", "direction", "day", "amount", "count")
+        call_command("rebuild_transaction_rollups", stdout=StringIO())
+        expected = sorted(DailyTransactionRollup.objects.values_list(*fields))
+        DailyTransactionRollup.objects.all().delete()
+
+        migration.backfill_rollups(apps, None)
+
+        self.assertEqual(len(expected), 3)
+        self.assertEqual(sorted(DailyTransactionRollup.objects.values_list(*fields)), expected)
+
+    def test_payment_contribution_does_not_load_the_shortcode_per_callback(self):
+        from services_common.rollups import payment_contribution
+
+        shortcode = MpesaShortcode.objects.create(business=self.business, shortcode="600100")
+        created = MpesaPayment.objects.create(business=self.business, shortcode=shortcode, amount=1, status="successful")
+        payments = [MpesaPayment.objects.get(id=created.id) for _ in range(2)]
+
+        self.assertEqual(payment_contribution(payments[0])[0][1], "600100")
+        with self.assertNumQueries(0):
+            self.assertEqual(payment_contribution(payments[1])[0][1], "600100")
+
+        shortcode.shortcode = "600101"
+        shortcode.save()
+        self.assertEqual(payment_contribution(list(MpesaPayment.objects.filter(id=created.id))[0])[0][1], "600101")
+
     def test_transaction_status_query_requires_scope(self):
         with patch.dict(
             os.environ,
@@ -333,7 +483,7 @@ class TransactionStatusQueryDefaultsFromShortcodeTests(TestCase):
         )
 
     @patch("c2b_api.views.MpesaC2bCredential.get_access_token", return_value="token")
-    @patch("c2b_api.views.requests.post")
+    @patch("c2b_api.views.outbound.post")
     def test_uses_active_shortcode_defaults_when_missing(self, post_mock, _tok):
         post_mock.return_value.status_code = 200
         post_mock.return_value.json.return_value = {
@@ -369,6 +519,138 @@ class TransactionStatusQueryDefaultsFromShortcodeTests(TestCase):
         self.assertEqual(sent_payload.get("QueueTimeOutURL"), "https://example.com/timeout")
 
 
+class StkPushAsyncTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username="u-async", password="pw")
+        self.business = Business.objects.create(name="Biz")
+        self.shortcode = MpesaShortcode.objects.create(
+            business=self.business,
+            shortcode="600111",
+            shortcode_type="paybill",
+            is_active=True,
+            lipa_passkey="passkey",
+            default_stk_callback_url="https://example.com/stk/callback",
+        )
+        self.application = Application.objects.create(
+            name="app",
+            client_type=Application.CLIENT_CONFIDENTIAL,
+            authorization_grant_type=Application.GRANT_CLIENT_CREDENTIALS,
+            user=self.user,
+        )
+        OAuthClientBusiness.objects.create(application=self.application, business=self.business)
+        self.token = AccessToken.objects.create(
+            user=self.user,
+            application=self.application,
+            token="t-async",
+            scope="c2b:write",
+            expires=timezone.now() + timedelta(hours=1),
+        )
+
+    @override_settings(STK_PUSH_DISPATCH_WORKERS=0)
+    @patch("c2b_api.dispatch.MpesaC2bCredential.get_access_token", return_value="token")
+    @patch("c2b_api.dispatch.outbound.post")
+    def test_async_push_returns_tracking_id_and_reports_response(self, post_mock, _tok):
+        post_mock.return_value.status_code = 200
+        post_mock.return_value.json.return_value = {
+            "MerchantRequestID": "mr-1",
+            "CheckoutRequestID": "ws_CO_1",
+            "ResponseCode": "0",
+            "ResponseDescription": "Success. Request accepted for processing",
+        }
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {self.token.token}")
+
+        with patch.dict(os.environ, {"LIPA_NA_MPESA_ONLINE_URL": "https://example.invalid/stk"}, clear=False):
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                resp = client.post(
+                    "/api/v1/c2b/stk/push",
+                    data=json.dumps({"shortcode": "600111", "amount": 1, "phone_number": "254700000000", "async": True}),
+                    content_type="application/json",
+                )
+
+            self.assertEqual(resp.status_code, 202, msg=resp.content.decode("utf-8", errors="ignore"))
+            tracking_id = resp.json()["tracking_id"]
+            self.assertFalse(post_mock.called)
+
+            status_resp = client.get(f"/api/v1/c2b/stk/push/{tracking_id}")
+            self.assertEqual(status_resp.json()["status"], StkPushInitiation.STATUS_QUEUED)
+
+            for callback in callbacks:
+                callback()
+
+        self.assertEqual(post_mock.call_count, 1)
+        self.assertEqual(post_mock.call_args.kwargs["json"]["BusinessShortCode"], "600111")
+
+        status_resp = client.get(f"/api/v1/c2b/stk/push/{tracking_id}")
+        self.assertEqual(status_resp.status_code, 200)
+        data = status_resp.json()
+        self.assertEqual(data["status"], StkPushInitiation.STATUS_SENT)
+        self.assertEqual(data["checkout_request_id"], "ws_CO_1")
+        self.assertEqual(data["response"]["status_code"], 0)
+
+        initiation = StkPushInitiation.objects.get(tracking_id=tracking_id)
+        self.assertEqual(initiation.business_id, self.business.id)
+        self.assertEqual(initiation.attempts, 1)
+
+    @patch("c2b_api.dispatch.MpesaC2bCredential.get_access_token", return_value="token")
+    @patch("c2b_api.dispatch.outbound.post")
+    def test_transport_errors_after_the_send_are_unknown_not_failed(self, post_mock, _tok):
+        from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+        from c2b_api.dispatch import dispatch_stk_push
+
+        cases = [
+            (requests.ReadTimeout("read timed out"), StkPushInitiation.STATUS_UNKNOWN),
+            (requests.ConnectionError("Connection reset by peer"), StkPushInitiation.STATUS_UNKNOWN),
+            (requests.ConnectTimeout("connect timed out"), StkPushInitiation.STATUS_FAILED),
+            (requests.ConnectionError(MaxRetryError(None, "/stk", NewConnectionError(None, "refused"))), StkPushInitiation.STATUS_FAILED),
+            (outbound.UpstreamUnavailable("stk", circuit_breaker.REASON_CIRCUIT_OPEN), StkPushInitiation.STATUS_FAILED),
+        ]
+        with patch.dict(os.environ, {"LIPA_NA_MPESA_ONLINE_URL": "https://example.invalid/stk"}, clear=False):
+            for error, expected in cases:
+                post_mock.side_effect = error
+                initiation = StkPushInitiation.objects.create(
+                    status=StkPushInitiation.STATUS_QUEUED,
+                    business=self.business,
+                    shortcode=self.shortcode,
+                    request_payload={"BusinessShortCode": "600111", "Amount": 1},
+                )
+
+                self.assertTrue(dispatch_stk_push(initiation.id))
+
+                initiation.refresh_from_db()
+                self.assertEqual(initiation.status, expected, msg=repr(error))
+                self.assertIn(str(error), initiation.last_error)
+
+    @override_settings(STK_PUSH_DISPATCHING_TIMEOUT_SECONDS=600)
+    @patch("c2b_api.dispatch.outbound.post")
+    def test_stuck_dispatching_rows_are_marked_unknown_not_resent(self, post_mock):
+        now = timezone.now()
+        stuck, in_flight = (
+            StkPushInitiation.objects.create(
+                status=StkPushInitiation.STATUS_DISPATCHING,
+                business=self.business,
+                shortcode=self.shortcode,
+                attempts=1,
+                dispatched_at=dispatched_at,
+            )
+            for dispatched_at in (now - timedelta(minutes=20), now - timedelta(minutes=1))
+        )
+
+        out = StringIO()
+        call_command("dispatch_stk_pushes", stdout=out)
+
+        self.assertIn("sent=0 expired=1", out.getvalue())
+        post_mock.assert_not_called()
+        in_flight.refresh_from_db()
+        self.assertEqual(in_flight.status, StkPushInitiation.STATUS_DISPATCHING)
+
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {self.token.token}")
+        data = client.get(f"/api/v1/c2b/stk/push/{stuck.tracking_id}").json()
+        self.assertEqual(data["status"], StkPushInitiation.STATUS_UNKNOWN)
+        self.assertIn("may or may not", data["error"])
+
+
 class AdminLogsAuthTests(TestCase):
     def setUp(self):
         self.factory = RequestFactory()
@@ -454,6 +736,370 @@ class TransactionStatusCallbackTests(TestCase):
         p = MpesaPayment.objects.get(transaction_id="XYZ123")
         self.assertEqual(p.status, "successful")
 
+    def test_result_writes_each_row_once(self):
+        MpesaPayment.objects.create(transaction_id="BATCH1", status="pending", amount=1)
+        MpesaPayment.objects.create(mpesa_receipt_number="BATCH1", status="pending", amount=2)
+        MpesaTransactionStatusQuery.objects.create(transaction_id="BATCH1", originator_conversation_id="orig-2", status="pending")
+        payload = {"Result": {"OriginatorConversationID": "orig-2", "ResultCode": 0, "ResultDesc": "OK"}}
+
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.post("/api/v1/c2b/transaction-status/result", data=json.dumps(payload), content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+
+        payment_updates = [q["sql"] for q in ctx.captured_queries if q["sql"].startswith('UPDATE "mpesa_api_mpesapayment"')]
+        callback_writes = [q["sql"] for q in ctx.captured_queries if '"mpesa_api_mpesacallbacks"' in q["sql"] and not q["sql"].startswith("SELECT")]
+        self.assertEqual(len(payment_updates), 1)
+        self.assertEqual(len(callback_writes), 1)
+        self.assertEqual(set(MpesaPayment.objects.values_list("status", flat=True)), {"successful"})
+        self.assertIsNotNone(MpesaCallBacks.objects.get().internal_status_code)
+
+    @patch.dict(
+        os.environ,
+        {
+            "MPESA_TXN_STATUS_QUERY_URL": "https://example.invalid/query",
+            "MPESA_TXN_STATUS_INITIATOR_NAME": "initiator",
+            "MPESA_TXN_STATUS_SECURITY_CREDENTIAL": "cred",
+            "MPESA_TXN_STATUS_RESULT_URL": "https://example.invalid/result",
+            "MPESA_TXN_STATUS_TIMEOUT_URL": "https://example.invalid/timeout",
+            "MPESA_TXN_STATUS_PARTY_A": "600000",
+        },
+    )
+    @patch("c2b_api.views.MpesaC2bCredential.get_access_token", return_value="token")
+    @patch("c2b_api.views.outbound.post")
+    def test_reconcile_sweeper_queries_stale_rows_once(self, post_mock, _tok):
+        from b2c_api.models import B2CPaymentRequest
+
+        post_mock.return_value.status_code = 200
+        post_mock.return_value.json.return_value = {"ResponseCode": "0", "ResponseDescription": "Accepted"}
+
+        business = Business.objects.create(name="Biz")
+        stale = timezone.now() - timedelta(hours=1)
+        MpesaPayment.objects.create(transaction_id="STALE1", status="pending", amount=1)
+        MpesaPayment.objects.create(transaction_id="FRESH1", status="pending", amount=1)
+        MpesaPayment.objects.create(checkout_request_id="chk-no-txn", status="pending", amount=1)
+        pr = B2CPaymentRequest.objects.create(
+            business=business,
+            originator_conversation_id="b2c-oc",
+            conversation_id="b2c-conv",
+            status=B2CPaymentRequest.STATUS_SUBMITTED,
+            request_payload={"PartyA": "600000", "Amount": "25"},
+            amount=Decimal("25"),
+        )
+        MpesaPayment.objects.exclude(transaction_id="FRESH1").update(created_at=stale)
+        B2CPaymentRequest.objects.update(created_at=stale)
+
+        out = StringIO()
+        call_command("reconcile_pending_payments", "--concurrency", "1", stdout=out)
+        self.assertIn("submitted=2", out.getvalue())
+        sent = [c.kwargs["json"] for c in post_mock.call_args_list]
+        self.assertEqual({p["TransactionID"] for p in sent}, {"STALE1", ""})
+        self.assertEqual([p["OriginalConversationID"] for p in sent if "OriginalConversationID" in p], ["b2c-conv"])
+
+        # Rows queried recently are left alone until their result has had time to arrive.
+        out = StringIO()
+        call_command("reconcile_pending_payments", "--concurrency", "1", stdout=out)
+        self.assertIn("submitted=0", out.getvalue())
+        self.assertEqual(post_mock.call_count, 2)
+
+        # The B2C result is correlated through the same transaction status ResultURL.
+        # A failed query (e.g. a bad initiator credential) says nothing about the payout.
+        query = MpesaTransactionStatusQuery.objects.get(transaction_id__isnull=True)
+        oc = query.originator_conversation_id
+        failed_query = {"Result": {"OriginatorConversationID": oc, "ResultCode": 2001, "ResultDesc": "The initiator information is invalid."}}
+        resp = self.client.post("/api/v1/c2b/transaction-status/result", data=json.dumps(failed_query), content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        pr.refresh_from_db()
+        self.assertEqual(pr.status, B2CPaymentRequest.STATUS_SUBMITTED)
+
+        params = [{"Key": "TransactionStatus", "Value": "Completed"}, {"Key": "ReceiptNo", "Value": "RCPT123"}]
+        result = {"Result": {"OriginatorConversationID": oc, "ResultCode": 0, "ResultDesc": "OK", "ResultParameters": {"ResultParameter": params}}}
+        resp = self.client.post("/api/v1/c2b/transaction-status/result", data=json.dumps(result), content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        pr.refresh_from_db()
+        self.assertEqual((pr.status, pr.result_code, pr.transaction_id), (B2CPaymentRequest.STATUS_RESULT, 0, "RCPT123"))
+
+    @patch.dict(
+        os.environ,
+        {
+            "MPESA_TXN_STATUS_QUERY_URL": "https://example.invalid/query",
+            "MPESA_TXN_STATUS_INITIATOR_NAME": "initiator",
+            "MPESA_TXN_STATUS_SECURITY_CREDENTIAL": "cred",
+            "MPESA_TXN_STATUS_RESULT_URL": "https://example.invalid/result",
+            "MPESA_TXN_STATUS_TIMEOUT_URL": "https://example.invalid/timeout",
+            "MPESA_TXN_STATUS_PARTY_A": "600000",
+        },
+    )
+    @patch("c2b_api.views.MpesaC2bCredential.get_access_token", return_value="token")
+    @patch("c2b_api.views.outbound.post")
+    def test_reconcile_sweeper_reaches_past_recently_queried_b2c_rows(self, post_mock, _tok):
+        from b2c_api.models import B2CPaymentRequest
+
+        post_mock.return_value.status_code = 200
+        post_mock.return_value.json.return_value = {"ResponseCode": "0", "ResponseDescription": "Accepted"}
+
+        business = Business.objects.create(name="Biz")
+        for conversation_id in ("old-conv", "new-conv"):
+            B2CPaymentRequest.objects.create(
+                business=business,
+                originator_conversation_id=f"{conversation_id}-oc",
+                conversation_id=conversation_id,
+                status=B2CPaymentRequest.STATUS_SUBMITTED,
+                request_payload={"PartyA": "600000", "Amount": "25"},
+                amount=Decimal("25"),
+            )
+        B2CPaymentRequest.objects.filter(conversation_id="old-conv").update(created_at=timezone.now() - timedelta(hours=2))
+        B2CPaymentRequest.objects.filter(conversation_id="new-conv").update(created_at=timezone.now() - timedelta(hours=1))
+
+        call_command("reconcile_pending_payments", "--concurrency", "1", "--limit", "1", stdout=StringIO())
+        call_command("reconcile_pending_payments", "--concurrency", "1", "--limit", "1", stdout=StringIO())
+
+        sent = [c.kwargs["json"]["OriginalConversationID"] for c in post_mock.call_args_list]
+        self.assertEqual(sent, ["old-conv", "new-conv"])
+
+
+@skipUnless(connection.vendor == "postgresql", "query plans are only checked on PostgreSQL")
+class MpesaPaymentQueryPlanTests(TestCase):
+    """Guards against callback/listing lookups regressing to sequential scans."""
+
+    def setUp(self):
+        self.business = Business.objects.create(name="Biz")
+        MpesaPayment.objects.bulk_create(
+            MpesaPayment(
+                business=self.business,
+                checkout_request_id=f"chk-{i}",
+                merchant_request_id=f"merch-{i}",
+                transaction_id=f"TXN{i}",
+                mpesa_receipt_number=f"RCPT{i}",
+                status="successful" if i % 2 else "failed",
+                transaction_date=timezone.now(),
+            )
+            for i in range(50)
+        )
+        with connection.cursor() as cursor:
+            # The test table is tiny; make the planner pick an index whenever one applies.
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("ANALYZE mpesa_api_mpesapayment")
+
+    def test_callback_correlation_lookups_use_indexes(self):
+        cases = {
+            "mpesa_payment_checkout_idx": MpesaPayment.objects.filter(checkout_request_id="chk-1"),
+            "mpesa_payment_merchant_idx": MpesaPayment.objects.filter(merchant_request_id="merch-1"),
+            "mpesa_payment_txn_id_idx": MpesaPayment.objects.filter(transaction_id="TXN1"),
+            "mpesa_payment_receipt_idx": MpesaPayment.objects.filter(mpesa_receipt_number="RCPT1"),
+        }
+        for index_name, qs in cases.items():
+            with self.subTest(index=index_name):
+                self.assertIn(index_name, qs.explain())
+
+        plan = MpesaPayment.objects.filter(Q(transaction_id="TXN1") | Q(mpesa_receipt_number="TXN1")).explain()
+        self.assertIn("mpesa_payment_txn_id_idx", plan)
+        self.assertIn("mpesa_payment_receipt_idx", plan)
+
+    def test_listing_filters_avoid_sequential_scans(self):
+        day_start = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        queries = [
+            MpesaPayment.objects.filter(business=self.business, status="successful").order_by("-created_at"),
+            MpesaPayment.objects.filter(
+                business=self.business,
+                transaction_date__gte=day_start,
+                transaction_date__lt=day_start + timedelta(days=1),
+            ),
+            MpesaPayment.objects.filter(status="successful").order_by("-created_at"),
+        ]
+        for qs in queries:
+            with self.subTest(query=str(qs.query)):
+                self.assertNotIn("Seq Scan", qs.explain())
+
+
+@override_settings(CALLBACK_FAST_ACK=True)
+class CallbackInboxTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.business = Business.objects.create(name="Biz")
+        self.shortcode = MpesaShortcode.objects.create(business=self.business, shortcode="174379", lipa_passkey="pass")
+        StkPushInitiation.objects.create(
+            business=self.business,
+            shortcode=self.shortcode,
+            merchant_request_id="merch-inbox",
+            checkout_request_id="chk-inbox",
+        )
+
+    def test_stk_callback_is_acked_with_one_insert_and_applied_by_the_worker(self):
+        from c2b_api.views import stk_callback
+        from services_common.callback_inbox import process_pending
+
+        from .models import CallbackInbox
+
+        payload = {
+            "Body": {
+                "stkCallback": {
+                    "MerchantRequestID": "merch-inbox",
+                    "CheckoutRequestID": "chk-inbox",
+                    "ResultCode": 0,
+                    "ResultDesc": "Success",
+                    "CallbackMetadata": {"Item": [{"Name": "Amount", "Value": 5}, {"Name": "MpesaReceiptNumber", "Value": "INB1"}]},
+                }
+            }
+        }
+        request = self.factory.post("/api/v1/c2b/stk/callback", data=json.dumps(payload), content_type="application/json")
+        with self.assertNumQueries(1):
+            response = stk_callback(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["ResultCode"], 0)
+        self.assertFalse(MpesaPayment.objects.exists())
+
+        entry = CallbackInbox.objects.get()
+        self.assertEqual((entry.kind, entry.status), (CallbackInbox.KIND_STK_CALLBACK, CallbackInbox.STATUS_PENDING))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(process_pending(limit=10), 1)
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts), (CallbackInbox.STATUS_PROCESSED, 1))
+        payment = MpesaPayment.objects.get()
+        self.assertEqual((payment.status, payment.business_id, payment.mpesa_receipt_number), ("successful", self.business.id, "INB1"))
+
+        # Replaying the same entry (e.g. after a worker crash) is harmless.
+        CallbackInbox.objects.filter(id=entry.id).update(status=CallbackInbox.STATUS_PENDING)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(process_pending(limit=10), 1)
+        self.assertEqual(MpesaPayment.objects.count(), 1)
+        self.assertEqual(DailyTransactionRollup.objects.get().count, 1)
+
+    def test_unknown_b2c_result_is_recorded_without_retrying(self):
+        from services_common.callback_inbox import process_pending
+
+        from .models import CallbackInbox
+
+        response = self.client.post(
+            "/api/v1/b2c/callback/result",
+            data=json.dumps({"Result": {"OriginatorConversationID": "nope", "ResultCode": 0}}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+        process_pending(limit=10)
+        entry = CallbackInbox.objects.get()
+        self.assertEqual(entry.status, CallbackInbox.STATUS_PROCESSED)
+        self.assertIn("Unknown OriginatorConversationID", entry.last_error)
+
+
+class CallbackDedupTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.business = Business.objects.create(name="Biz")
+        self.shortcode = MpesaShortcode.objects.create(business=self.business, shortcode="174379", lipa_passkey="pass")
+        StkPushInitiation.objects.create(
+            business=self.business,
+            shortcode=self.shortcode,
+            merchant_request_id="merch-dup",
+            checkout_request_id="chk-dup",
+        )
+
+    def _stk_payload(self, result_code=0):
+        return {
+            "Body": {
+                "stkCallback": {
+                    "MerchantRequestID": "merch-dup",
+                    "CheckoutRequestID": "chk-dup",
+                    "ResultCode": result_code,
+                    "ResultDesc": "Success" if result_code == 0 else "Cancelled",
+                    "CallbackMetadata": {"Item": [{"Name": "Amount", "Value": 7}, {"Name": "MpesaReceiptNumber", "Value": "DUP1"}]},
+                }
+            }
+        }
+
+    def _post_stk(self, result_code=0):
+        payload = self._stk_payload(result_code)
+        return self.client.post("/api/v1/c2b/stk/callback", data=json.dumps(payload), content_type="application/json")
+
+    def test_redelivered_stk_callback_is_applied_once(self):
+        from .models import CallbackReceipt
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self._post_stk().status_code, 200)
+        callbacks = MpesaCallBacks.objects.count()
+
+        # The database constraint catches the redelivery even with a cold cache...
+        cache.clear()
+        response = self._post_stk()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.content)["duplicate"])
+        self.assertEqual(MpesaCallBacks.objects.count(), callbacks)
+
+        # ...and once cached it is answered without a query.
+        from c2b_api.views import stk_callback
+
+        request = RequestFactory().post(
+            "/api/v1/c2b/stk/callback",
+            data=json.dumps(self._stk_payload()),
+            content_type="application/json",
+        )
+        with self.assertNumQueries(0):
+            self.assertTrue(json.loads(stk_callback(request).content)["duplicate"])
+
+        self.assertEqual(CallbackReceipt.objects.count(), 1)
+        self.assertEqual(MpesaPayment.objects.get().mpesa_receipt_number, "DUP1")
+        self.assertEqual(DailyTransactionRollup.objects.get().count, 1)
+
+    def test_new_result_for_same_checkout_is_applied(self):
+        from .models import CallbackReceipt
+
+        self._post_stk(result_code=1032)
+        response = self._post_stk(result_code=0)
+        self.assertNotIn("duplicate", json.loads(response.content))
+        self.assertEqual(CallbackReceipt.objects.count(), 2)
+
+    def test_failed_callback_releases_its_receipt(self):
+        from .models import CallbackReceipt
+
+        payload = {"Result": {"OriginatorConversationID": "unknown-oc", "ResultCode": 0}}
+        for _ in range(2):
+            response = self.client.post("/api/v1/b2c/callback/result", data=json.dumps(payload), content_type="application/json")
+            self.assertEqual(response.status_code, 404)
+        self.assertFalse(CallbackReceipt.objects.exists())
+
+    def test_crash_before_commit_does_not_swallow_the_redelivery(self):
+        from services_common import callback_dedup
+
+        from .models import CallbackInbox, CallbackReceipt
+
+        # The worker dies after the receipt is inserted, while the handler runs.
+        # SystemExit is not an Exception, so no cleanup code in the wrapper sees it.
+        @callback_dedup.deduplicated(CallbackInbox.KIND_STK_CALLBACK)
+        def dying_apply(body):
+            raise SystemExit("worker killed")
+
+        with self.assertRaises(SystemExit):
+            dying_apply(self._stk_payload())
+        self.assertFalse(CallbackReceipt.objects.exists())
+
+        response = self._post_stk()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("duplicate", json.loads(response.content))
+        self.assertEqual(MpesaPayment.objects.get().mpesa_receipt_number, "DUP1")
+
+    @override_settings(CALLBACK_RECEIPT_RETENTION_DAYS=30)
+    def test_prune_command_deletes_receipts_past_the_retention_window(self):
+        from datetime import timedelta
+
+        from django.utils import timezone
+
+        from .models import CallbackReceipt
+
+        old = CallbackReceipt.objects.create(kind="stk_callback", natural_key="old", content_hash="a")
+        CallbackReceipt.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=31))
+        CallbackReceipt.objects.create(kind="stk_callback", natural_key="new", content_hash="b")
+
+        out = StringIO()
+        call_command("prune_callback_receipts", "--batch-size", "1", stdout=out)
+        self.assertIn("deleted=1", out.getvalue())
+        self.assertEqual(list(CallbackReceipt.objects.values_list("natural_key", flat=True)), ["new"])
+
+        call_command("prune_callback_receipts", "--days", "0", stdout=out)
+        self.assertEqual(CallbackReceipt.objects.count(), 1)
+
 
 class SessionAuthCsrfTests(TestCase):
 
@@ -556,6 +1202,305 @@ class RateLimitMiddlewareTests(TestCase):
         self.assertEqual(r2.status_code, 200)
         self.assertEqual(r3.status_code, 429)
 
+    @override_settings(
+        INTERNAL_RATE_LIMIT_ENABLED=True,
+        INTERNAL_RATE_LIMIT_REQUESTS=100,
+        INTERNAL_RATE_LIMIT_WINDOW_SECONDS=60,
+        INTERNAL_RATE_LIMIT_PATHS=["/api/v1/c2b/transactions/all"],
+        RATE_LIMIT_SCOPE_QUOTAS={"transactions:read": 2},
+    )
+    def test_scope_quota_is_shared_by_the_client_across_ips(self):
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {self.access_token}"}
+        r1 = self.client.get("/api/v1/c2b/transactions/all", REMOTE_ADDR="10.0.0.1", **headers)
+        r2 = self.client.get("/api/v1/c2b/transactions/all", REMOTE_ADDR="10.0.0.2", **headers)
+        r3 = self.client.get("/api/v1/c2b/transactions/all", REMOTE_ADDR="10.0.0.3", **headers)
+
+        self.assertEqual([r.status_code for r in (r1, r2, r3)], [200, 200, 429])
+        self.assertEqual(r1["X-RateLimit-Limit"], "2")
+        self.assertEqual((r1["X-RateLimit-Remaining"], r2["X-RateLimit-Remaining"]), ("1", "0"))
+        self.assertEqual(r3["Retry-After"], r3["X-RateLimit-Reset"])
+
+    @override_settings(
+        INTERNAL_RATE_LIMIT_ENABLED=True,
+        INTERNAL_RATE_LIMIT_REQUESTS=1,
+        INTERNAL_RATE_LIMIT_WINDOW_SECONDS=60,
+        INTERNAL_RATE_LIMIT_PATHS=["/api/v1/transactions/all"],
+    )
+    async def test_rate_limit_applies_on_the_async_path(self):
+        headers = {"authorization": f"Bearer {self.access_token}"}
+        r1 = await self.async_client.get("/api/v1/transactions/all", headers=headers)
+        r2 = await self.async_client.get("/api/v1/transactions/all", headers=headers)
+
+        self.assertEqual([r1.status_code, r2.status_code], [200, 429])
+        self.assertEqual(r1["X-RateLimit-Remaining"], "0")
+
+        from asgiref.sync import iscoroutinefunction
+
+        from .middleware import InternalEndpointsRateLimitMiddleware
+
+        async def get_response(request):
+            return None
+
+        # No sync/async adapter needed in front of an async chain.
+        self.assertTrue(iscoroutinefunction(InternalEndpointsRateLimitMiddleware(get_response)))
+
+    def test_previous_window_is_weighted_into_the_current_one(self):
+        from services_common.rate_limit import hit
+
+        start = 6000.0  # start of a 60s window
+        for _ in range(4):
+            self.assertTrue(hit("sliding", limit=4, window_seconds=60, now=start + 50).allowed)
+
+        # 15s into the next window, 75% of the previous window still counts: 3 + 1 = 4.
+        self.assertTrue(hit("sliding", limit=4, window_seconds=60, now=start + 75).allowed)
+        self.assertFalse(hit("sliding", limit=4, window_seconds=60, now=start + 76).allowed)
+        # Once the previous window has slid out, only the current count matters.
+        self.assertTrue(hit("sliding", limit=4, window_seconds=60, now=start + 119).allowed)
+
+
+class DarajaTokenCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        clear_local_tokens()
+
+    @override_settings(DARAJA_TOKEN_REFRESH_MARGIN_SECONDS=60)
+    @patch("mpesa_api.mpesa_credentials.MpesaC2bCredential.TOKEN_URL", "https://example.invalid/token")
+    @patch("mpesa_api.mpesa_credentials.MpesaC2bCredential.CONSUMER_SECRET", "cs")
+    @patch("mpesa_api.mpesa_credentials.MpesaC2bCredential.CONSUMER_KEY", "ck")
+    @patch("mpesa_api.mpesa_credentials.outbound.get")
+    def test_env_token_is_cached_and_refreshed_ahead_of_expiry(self, get_mock):
+        from mpesa_api.mpesa_credentials import MpesaC2bCredential
+
+        get_mock.return_value.json.side_effect = [
+            {"access_token": "tok-1", "expires_in": "3599"},
+            {"access_token": "tok-2", "expires_in": "3599"},
+        ]
+
+        with patch("services_common.daraja_tokens.time.time", return_value=1000.0):
+            self.assertEqual(MpesaC2bCredential.get_access_token(), "tok-1")
+            self.assertEqual(MpesaC2bCredential.get_access_token(), "tok-1")
+        self.assertEqual(get_mock.call_count, 1)
+
+        # Still inside expires_in, but past the refresh margin.
+        with patch("services_common.daraja_tokens.time.time", return_value=1000.0 + 3599 - 30):
+            self.assertEqual(MpesaC2bCredential.get_access_token(), "tok-2")
+        self.assertEqual(get_mock.call_count, 2)
+
+
+class StatusCodeMappingCacheTests(TestCase):
+
+    def setUp(self):
+        invalidate_status_code_cache()
+
+    def test_known_code_is_mapped_without_queries(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = map_safaricom_status(code="1032", message="Request cancelled by user")
+        map_safaricom_status(code="1032")  # reloads the snapshot after the commit-time bump
+
+        with self.assertNumQueries(0):
+            again = map_safaricom_status(code="1032", message="Request cancelled by user")
+            success = map_safaricom_status(code="0", message="ok")
+
+        self.assertEqual(again.status_code, first.status_code)
+        self.assertEqual(success.status_code, 0)
+
+    def test_saving_a_mapping_invalidates_the_cache(self):
+        map_safaricom_status(code="1032", message="Request cancelled by user")
+        mapping = StatusCodeMapping.objects.get(external_system=StatusCodeMapping.SYSTEM_SAFARICOM, external_code="1032")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            mapping.default_message = "Cancelled"
+            mapping.save(update_fields=["default_message"])
+
+        self.assertEqual(map_safaricom_status(code="1032").status_message, "Cancelled")
+
+    def test_new_codes_skip_internal_codes_assigned_by_hand(self):
+        taken = allocate_internal_code() + 1
+        StatusCodeMapping.objects.create(
+            external_system=StatusCodeMapping.SYSTEM_GATEWAY,
+            external_code="MANUAL",
+            internal_code=taken,
+        )
+
+        mapped = map_safaricom_status(code="2001", message="Wrong PIN")
+
+        self.assertGreater(mapped.status_code, taken)
+        self.assertEqual(
+            StatusCodeMapping.objects.get(external_system=StatusCodeMapping.SYSTEM_SAFARICOM, external_code="2001").internal_code,
+            mapped.status_code,
+        )
+
+
+class OutboundClientTests(TestCase):
+
+    def tearDown(self):
+        outbound.reset_session()
+
+    def test_session_is_shared_and_pooled(self):
+        outbound.reset_session()
+        session = outbound.get_session()
+        self.assertIs(session, outbound.get_session())
+        adapter = session.get_adapter("https://api.safaricom.co.ke/mpesa/")
+        self.assertEqual(adapter._pool_maxsize, 20)
+        self.assertEqual(adapter.max_retries.total, 0)
+
+    @override_settings(OUTBOUND_HTTP_CONNECT_TIMEOUT_SECONDS=3, OUTBOUND_HTTP_READ_TIMEOUT_SECONDS=25)
+    def test_requests_use_split_timeouts(self):
+        with patch.object(outbound.get_session(), "request") as request_mock:
+            outbound.post("https://example.invalid/a", json={})
+            self.assertEqual(request_mock.call_args.kwargs["timeout"], (3.0, 25.0))
+
+            outbound.get("https://example.invalid/b", timeout=10)
+            self.assertEqual(request_mock.call_args.kwargs["timeout"], (3.0, 10.0))
+
+    @override_settings(OUTBOUND_HTTP_CONNECT_TIMEOUT_SECONDS=3, OUTBOUND_HTTP_READ_TIMEOUT_SECONDS=25)
+    async def test_async_requests_share_timeouts_and_map_transport_errors(self):
+        seen = []
+
+        def handler(request):
+            seen.append(request.extensions["timeout"])
+            if request.url.path == "/down":
+                raise httpx.ConnectError("refused", request=request)
+            return httpx.Response(200, json={"ok": True})
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with patch.object(outbound, "_build_async_client", return_value=client):
+            resp = await outbound.apost("https://example.invalid/a", json={})
+            self.assertEqual(resp.json(), {"ok": True})
+            self.assertEqual(seen[0], {"connect": 3.0, "read": 25.0, "write": 25.0, "pool": 25.0})
+
+            with self.assertRaises(requests.ConnectionError):
+                await outbound.aget("https://example.invalid/down")
+            await outbound.areset_client()
+
+    async def test_asgi_lifespan_shutdown_closes_the_async_client(self):
+        from Mpesa.asgi import application
+
+        client = outbound.get_async_client()
+        messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message["type"])
+
+        await application({"type": "lifespan"}, receive, send)
+
+        self.assertEqual(sent, ["lifespan.startup.complete", "lifespan.shutdown.complete"])
+        self.assertTrue(client.is_closed)
+        self.assertIsNot(outbound.get_async_client(), client)
+        await outbound.areset_client()
+
+
+@override_settings(
+    UPSTREAM_BREAKER_MIN_REQUESTS=4,
+    UPSTREAM_BREAKER_ERROR_RATE=0.5,
+    UPSTREAM_BREAKER_OPEN_SECONDS=30,
+    UPSTREAM_CONCURRENCY_INITIAL=2,
+    UPSTREAM_CONCURRENCY_MIN=1,
+)
+class UpstreamCircuitBreakerTests(TestCase):
+
+    url = "https://sandbox.example.invalid/mpesa/stkpush/v1/processrequest"
+
+    def setUp(self):
+        circuit_breaker.reset_guards()
+
+    def tearDown(self):
+        circuit_breaker.reset_guards()
+        outbound.reset_session()
+
+    def _fail_upstream(self, times):
+        with patch.object(outbound.get_session(), "request", side_effect=requests.ConnectionError("down")):
+            for _ in range(times):
+                with self.assertRaises(requests.ConnectionError):
+                    outbound.post(self.url, json={})
+
+    def test_circuit_opens_on_errors_and_closes_after_a_good_probe(self):
+        self._fail_upstream(4)
+
+        with patch.object(outbound.get_session(), "request") as request_mock:
+            with self.assertRaises(outbound.UpstreamUnavailable) as ctx:
+                outbound.post(self.url, json={})
+            self.assertEqual(ctx.exception.reason, circuit_breaker.REASON_CIRCUIT_OPEN)
+            request_mock.assert_not_called()
+
+            # Other endpoints (and environments) keep their own circuit.
+            request_mock.return_value.status_code = 200
+            outbound.post("https://api.example.invalid/mpesa/stkpush/v1/processrequest", json={})
+
+        guard = circuit_breaker.guard_for(self.url)
+        guard.opened_at -= 31
+        with patch.object(outbound.get_session(), "request") as request_mock:
+            request_mock.return_value.status_code = 200
+            outbound.post(self.url, json={})
+        self.assertEqual(guard.state, circuit_breaker.STATE_CLOSED)
+
+    def test_in_flight_calls_are_capped_and_the_limit_halves_on_failure(self):
+        guard = circuit_breaker.guard_for(self.url)
+        guard.acquire()
+        guard.acquire()
+        with self.assertRaises(outbound.UpstreamUnavailable) as ctx:
+            guard.acquire()
+        self.assertEqual(ctx.exception.reason, circuit_breaker.REASON_CONCURRENCY_LIMIT)
+
+        guard.release(failed=True, elapsed=0.1)
+        self.assertEqual(guard.limit, 1)
+        with self.assertRaises(outbound.UpstreamUnavailable):
+            guard.acquire()
+
+        guard.release(failed=False, elapsed=0.1)
+        self.assertEqual(guard.limit, 2)
+
+    async def test_cancelled_call_releases_its_slot_and_the_half_open_probe(self):
+        guard = circuit_breaker.guard_for(self.url)
+        guard.state, guard.opened_at = circuit_breaker.STATE_OPEN, time.monotonic() - 31
+        in_flight = asyncio.Event()
+
+        async def send():
+            in_flight.set()
+            await asyncio.sleep(60)
+
+        task = asyncio.ensure_future(circuit_breaker.acall(self.url, send))
+        await in_flight.wait()
+        self.assertEqual((guard.in_flight, guard._probing), (1, True))
+
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        self.assertEqual((guard.in_flight, guard._probing), (0, False))
+        self.assertEqual(guard.state, circuit_breaker.STATE_OPEN)
+        guard.opened_at -= 31
+        self.assertTrue(guard.acquire())
+
+    def test_stk_push_fails_fast_with_a_mapped_gateway_status(self):
+        from c2b_api.views import stk_push
+
+        self._fail_upstream(4)
+        biz = Business.objects.create(name="Biz CB")
+        MpesaShortcode.objects.create(business=biz, shortcode="174379", lipa_passkey="pass")
+        user = get_user_model().objects.create_user(username="staff-cb", password="pw", is_staff=True)
+        request = RequestFactory().post(
+            "/api/v1/c2b/stk/push",
+            data=json.dumps({"phone_number": "254700000000", "amount": 1, "shortcode": "174379"}),
+            content_type="application/json",
+        )
+        request.user = user
+        env = {"LIPA_NA_MPESA_ONLINE_URL": self.url, "STK_CALLBACK_URL": "https://example.invalid/cb"}
+        with patch.dict(os.environ, env), patch(
+            "mpesa_api.mpesa_credentials.MpesaC2bCredential.get_access_token", return_value="token"
+        ):
+            response = stk_push(request)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response)
+        mapping = StatusCodeMapping.objects.get(external_system="gateway", external_code="CIRCUIT_OPEN")
+        self.assertEqual(json.loads(response.content)["status_code"], mapping.internal_code)
+
 
 class BootstrapSuperuserTests(TestCase):
     def setUp(self):
@@ -0,0 +1,67 @@
+import base64
+import binascii
+
+from django.db import migrations, models
+
+
+def _image_bytes(value: str) -> bytes:
+    try:
+        return base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        return value.encode("utf-8")
+
+
+def offload_qr_images(apps, _schema_editor):
+    """Move inline base64 QR images into the blob store; drop the copy in response_payload."""
+
+    from services_common import blob_store
+
+    QrCode = apps.get_model("qr_api", "QrCode")
+
+    pending = []
+    rows = QrCode.objects.exclude(qr_code_base64="").only("id", "qr_code_base64", "response_payload")
+    for rec in rows.iterator(chunk_size=500):
+        rec.qr_image_sha256, rec.qr_image_size = blob_store.put(_image_bytes(rec.qr_code_base64))
+        if isinstance(rec.response_payload, dict):
+            rec.response_payload.pop("QRCode", None)
+        pending.append(rec)
+        if len(pending) >= 500:
+            QrCode.objects.bulk_update(pending, ["qr_image_sha256", "qr_image_size", "response_payload"])
+            pending = []
+    if pending:
+        QrCode.objects.bulk_update(pending, ["qr_image_sha256", "qr_image_size", "response_payload"])
+
+
+def restore_qr_images(apps, _schema_editor):
+    from services_common import blob_store
+
+    QrCode = apps.get_model("qr_api", "QrCode")
+
+    for rec in QrCode.objects.exclude(qr_image_sha256="").iterator(chunk_size=500):
+        rec.qr_code_base64 = base64.b64encode(blob_store.read(rec.qr_image_sha256)).decode("ascii")
+        rec.save(update_fields=["qr_code_base64"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qr_api', '0004_qrcode_internal_status_code_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='qrcode',
+            name='qr_image_sha256',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='qrcode',
+            name='qr_image_size',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(offload_qr_images, restore_qr_images),
+        migrations.RemoveField(
+            model_name='qrcode',
+            name='qr_code_base64',
+        ),
+    ]
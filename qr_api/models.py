@@ -44,7 +44,9 @@ class QrCode(BaseModel):
     request_payload = models.JSONField(default=dict)
     response_status = models.IntegerField(blank=True, null=True)
     response_payload = models.JSONField(default=dict)
-    qr_code_base64 = models.TextField(blank=True)
+    # The image itself lives in the content-addressed blob store (services_common.blob_store).
+    qr_image_sha256 = models.CharField(max_length=64, blank=True, default="")
+    qr_image_size = models.PositiveIntegerField(null=True, blank=True)
     error = models.TextField(blank=True)
 
     internal_status_code = models.IntegerField(null=True, blank=True)
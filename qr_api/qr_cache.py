@@ -0,0 +1,109 @@
+"""Result cache for deterministic QR generation.
+
+Merchants regenerate the same static QR over and over. A Daraja QR response is
+a pure function of (MerchantName, RefNo, Amount, TrxCode, CPI, Size) and the
+shortcode, so successful results are cached under a hash of those fields:
+
+- a per-process LRU (`QR_CACHE_MAX_ENTRIES`, least recently used evicted first),
+- the Django cache, shared by all workers when `REDIS_URL` is set.
+
+Both tiers expire entries after `QR_CACHE_TTL_SECONDS`. Entries are small: the
+image is referenced by its blob-store digest (`services_common.blob_store`), not
+embedded.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+_CACHE_PREFIX = "qr_result"
+KEY_FIELDS = ("MerchantName", "RefNo", "Amount", "TrxCode", "CPI", "Size")
+
+_local: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def _setting_int(name: str, default: int) -> int:
+    try:
+        return max(int(getattr(settings, name, default)), 0)
+    except (TypeError, ValueError):
+        return default
+
+
+def enabled() -> bool:
+    return bool(getattr(settings, "QR_CACHE_ENABLED", True)) and _setting_int("QR_CACHE_TTL_SECONDS", 86400) > 0
+
+
+def _canonical(value):
+    text = str(value if value is not None else "").strip()
+    try:
+        # 100, "100" and "100.00" are the same amount.
+        return format(Decimal(text).normalize(), "f")
+    except (InvalidOperation, ValueError):
+        return text
+
+
+def cache_key(payload: dict, shortcode=None) -> str:
+    canonical = {field: _canonical(payload.get(field)) for field in KEY_FIELDS}
+    canonical["shortcode"] = _canonical(getattr(shortcode, "shortcode", shortcode))
+    raw = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return f"{_CACHE_PREFIX}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+
+def get(key: str) -> dict | None:
+    now = time.monotonic()
+    with _local_lock:
+        entry = _local.get(key)
+        if entry is not None:
+            if entry[1] > now:
+                _local.move_to_end(key)
+                return entry[0]
+            del _local[key]
+
+    try:
+        shared = cache.get(key)
+    except Exception:
+        shared = None
+    if isinstance(shared, dict) and isinstance(shared.get("value"), dict):
+        remaining = float(shared.get("expires_at") or 0) - time.time()
+        if remaining > 0:
+            _remember(key, shared["value"], now + remaining)
+            return shared["value"]
+    return None
+
+
+def put(key: str, value: dict) -> None:
+    ttl = _setting_int("QR_CACHE_TTL_SECONDS", 86400)
+    _remember(key, value, time.monotonic() + ttl)
+    try:
+        cache.set(key, {"value": value, "expires_at": time.time() + ttl}, timeout=ttl)
+    except Exception:
+        # The local tier still serves this worker.
+        pass
+
+
+def _remember(key: str, value: dict, expires_at: float) -> None:
+    max_entries = _setting_int("QR_CACHE_MAX_ENTRIES", 1024)
+    if not max_entries:
+        return
+    with _local_lock:
+        _local[key] = (value, expires_at)
+        _local.move_to_end(key)
+        while len(_local) > max_entries:
+            _local.popitem(last=False)
+
+
+def clear_local() -> None:
+    """Drop the per-process tier (tests, or after changing cache settings)."""
+
+    with _local_lock:
+        _local.clear()
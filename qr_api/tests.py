@@ -1,21 +1,35 @@
+import base64
 import json
 import os
+import tempfile
 from datetime import timedelta
 from unittest.mock import patch
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.utils import timezone
 
 from oauth2_provider.models import AccessToken, Application
 
 from business_api.models import Business, MpesaShortcode, OAuthClientBusiness
+from mpesa_api.models import MpesaCalls
+from services_common import blob_store
 
+from . import qr_cache
 from .models import QrCode
 
 
 class QrApiTests(TestCase):
     def setUp(self):
+        # Keep blobs written by these tests out of BLOB_STORAGE_ROOT.
+        blob_root = self.enterContext(tempfile.TemporaryDirectory())
+        blobs = {"BACKEND": "django.core.files.storage.FileSystemStorage", "OPTIONS": {"location": blob_root}}
+        self.enterContext(override_settings(STORAGES={**settings.STORAGES, "blobs": blobs}))
+        cache.clear()
+        qr_cache.clear_local()
+
         os.environ["MPESA_QR_CODE_URL"] = "https://example.invalid/mpesa/qrcode"
         self.business = Business.objects.create(name="My Shop")
         self.shortcode = MpesaShortcode.objects.create(business=self.business, shortcode="174379", is_active=True)
@@ -50,7 +64,7 @@ class QrApiTests(TestCase):
         self.assertEqual(resp.status_code, 401)
 
     @patch("qr_api.views.MpesaC2bCredential.get_access_token", return_value="token")
-    @patch("qr_api.views.requests.post")
+    @patch("qr_api.views.outbound.post")
     def test_generate_success(self, post, _tok):
         post.return_value.status_code = 200
         post.return_value.json.return_value = {"QRCode": "BASE64"}
@@ -78,7 +92,8 @@ class QrApiTests(TestCase):
         self.assertEqual(record.merchant_name, "My Shop")
         self.assertEqual(record.cpi, "174379")
         self.assertEqual(record.response_status, 200)
-        self.assertEqual(record.qr_code_base64, "BASE64")
+        self.assertEqual(blob_store.read(record.qr_image_sha256), b"BASE64")
+        self.assertNotIn("QRCode", record.response_payload)
 
         # Ensure upstream call used bearer token.
         _args, kwargs = post.call_args
@@ -97,8 +112,8 @@ class QrApiTests(TestCase):
             trx_code="BG",
             request_payload={"RefNo": "INV-9"},
             response_status=200,
-            response_payload={"QRCode": "X"},
-            qr_code_base64="X",
+            response_payload={},
+            qr_image_sha256=blob_store.put(b"X")[0],
         )
 
         User = get_user_model()
@@ -112,3 +127,93 @@ class QrApiTests(TestCase):
         payload = resp.json()
         self.assertIn("results", payload)
         self.assertGreaterEqual(len(payload["results"]), 1)
+        self.assertTrue(payload["results"][0]["has_qr_code"])
+
+    @patch("qr_api.views.MpesaC2bCredential.get_access_token", return_value="token")
+    @patch("qr_api.views.outbound.post")
+    def test_identical_images_are_stored_once_and_streamed(self, post, _tok):
+        png = b"\x89PNG\r\n\x1a\nfake-image"
+        post.return_value.status_code = 200
+        post.return_value.json.return_value = {"QRCode": base64.b64encode(png).decode("ascii")}
+
+        for ref in ("INV-1", "INV-2"):
+            resp = self.client.post(
+                "/api/v1/qr/generate",
+                data=json.dumps({"RefNo": ref, "Amount": 1, "TrxCode": "BG"}),
+                content_type="application/json",
+                HTTP_AUTHORIZATION=f"Bearer {self.access_token}",
+            )
+            self.assertEqual(resp.status_code, 200)
+
+        digests = set(QrCode.objects.values_list("qr_image_sha256", flat=True))
+        self.assertEqual(len(digests), 1)
+        record = QrCode.objects.first()
+        self.assertEqual(record.qr_image_size, len(png))
+
+        User = get_user_model()
+        self.client.force_login(User.objects.create_user(username="staff", password="pw", is_staff=True))
+        detail = self.client.get(f"/api/v1/qr/{record.id}").json()
+        self.assertNotIn("qr_code_base64", detail)
+        image = self.client.get(detail["qr_image_url"])
+        self.assertEqual(image.status_code, 200)
+        self.assertEqual(image["Content-Type"], "image/png")
+        self.assertEqual(b"".join(image.streaming_content), png)
+
+    @patch("qr_api.views.MpesaC2bCredential.get_access_token", return_value="token")
+    @patch("qr_api.views.outbound.post")
+    def test_repeat_generate_is_served_from_cache(self, post, tok):
+        qr = base64.b64encode(b"\x89PNG-static-till").decode("ascii")
+        post.return_value.status_code = 200
+        post.return_value.json.return_value = {"ResponseCode": "AG_1", "ResponseDescription": "QR Code Successfully Generated.", "QRCode": qr}
+
+        responses = []
+        for amount in (100, "100.00"):
+            resp = self.client.post(
+                "/api/v1/qr/generate",
+                data=json.dumps({"RefNo": "TILL", "Amount": amount, "TrxCode": "BG", "Size": "300"}),
+                content_type="application/json",
+                HTTP_AUTHORIZATION=f"Bearer {self.access_token}",
+            )
+            self.assertEqual(resp.status_code, 200)
+            responses.append(resp.json())
+
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(tok.call_count, 1)
+        self.assertFalse(responses[0]["cache_hit"])
+        self.assertTrue(responses[1]["cache_hit"])
+        self.assertEqual(responses[1]["QRCode"], qr)
+        self.assertEqual(responses[1]["status_code"], responses[0]["status_code"])
+        self.assertTrue(MpesaCalls.objects.filter(caller="QR Generate Cache Hit", conversation_id="TILL").exists())
+        self.assertEqual(QrCode.objects.count(), 2)
+
+    @patch("qr_api.views.MpesaC2bCredential.get_access_token", return_value="token")
+    @patch("qr_api.views.outbound.post")
+    def test_cached_local_renders_are_not_served(self, post, _tok):
+        post.return_value.status_code = 200
+        post.return_value.json.return_value = {"QRCode": base64.b64encode(b"\x89PNG-daraja").decode("ascii")}
+        body = json.dumps({"RefNo": "COUNTER-2", "Amount": 0, "TrxCode": "BG", "CPI": "5123456", "Size": "300"})
+
+        # An entry written by the removed in-tree renderer, still within its TTL.
+        real_get = qr_cache.get
+        with patch("qr_api.views.qr_cache.get", side_effect=lambda key: {**(real_get(key) or {}), "rendered_locally": True}):
+            for _ in range(2):
+                resp = self.client.post(
+                    "/api/v1/qr/generate", data=body, content_type="application/json", HTTP_AUTHORIZATION=f"Bearer {self.access_token}"
+                )
+                self.assertEqual(resp.status_code, 200)
+                self.assertFalse(resp.json()["cache_hit"])
+
+        self.assertEqual(post.call_count, 2)
+
+    @override_settings(QR_CACHE_MAX_ENTRIES=2)
+    def test_local_cache_evicts_least_recently_used(self):
+        keys = [qr_cache.cache_key({"RefNo": ref}) for ref in ("A", "B", "C")]
+        qr_cache.put(keys[0], {"n": 0})
+        qr_cache.put(keys[1], {"n": 1})
+        qr_cache.get(keys[0])
+        qr_cache.put(keys[2], {"n": 2})
+        cache.clear()
+
+        self.assertEqual(qr_cache.get(keys[0]), {"n": 0})
+        self.assertIsNone(qr_cache.get(keys[1]))
+        self.assertEqual(qr_cache.get(keys[2]), {"n": 2})
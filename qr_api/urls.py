@@ -1,13 +1,20 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
 
+# Daraja-bound endpoints use their async views under ASGI (see ASYNC_VIEWS_ENABLED).
+generate_qr = views.generate_qr_async if settings.ASYNC_VIEWS_ENABLED else views.generate_qr
+
+
 urlpatterns = [
-    path("generate", views.generate_qr, name="qr_generate"),
-    path("generate/", views.generate_qr),
+    path("generate", generate_qr, name="qr_generate"),
+    path("generate/", generate_qr),
     path("history", views.qr_history, name="qr_history"),
     path("history/", views.qr_history),
     path("<uuid:qr_id>", views.qr_detail, name="qr_detail"),
     path("<uuid:qr_id>/", views.qr_detail),
+    path("<uuid:qr_id>/image", views.qr_image, name="qr_image"),
+    path("<uuid:qr_id>/image/", views.qr_image),
 ]
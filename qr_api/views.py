@@ -1,17 +1,23 @@
+import base64
+import binascii
 import json
 import os
 
-import requests
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.http import FileResponse, JsonResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 
 from mpesa_api.models import MpesaCalls
 from mpesa_api.mpesa_credentials import MpesaC2bCredential
-from services_common.auth import require_oauth2, require_staff
+from services_common import blob_store, outbound
+from services_common.auth import get_bound_business, require_oauth2, require_staff
+from services_common.circuit_breaker import UpstreamUnavailable, unavailable_response
 from services_common.http import json_body
 from services_common.status_codes import apply_mapped_status
 
+from . import qr_cache
 from .models import QrCode
 
 
@@ -27,17 +33,7 @@ def _resolve_shortcode(shortcode: str | None):
 
 
 def _get_bound_business(request):
-    token_obj = getattr(request, "oauth2_token", None)
-    app = getattr(request, "oauth2_application", None) if token_obj else None
-    if app is None:
-        return None
-    try:
-        from business_api.models import OAuthClientBusiness
-
-        binding = OAuthClientBusiness.objects.select_related("business").filter(application=app).first()
-        return binding.business if binding else None
-    except Exception:
-        return None
+    return get_bound_business(request)
 
 
 def _get_default_shortcode_for_business(business):
@@ -67,7 +63,7 @@ def _serialize_qr(record: QrCode, include_payloads: bool = False):
         "cpi": record.cpi,
         "size": record.size,
         "response_status": record.response_status,
-        "has_qr_code": bool(record.qr_code_base64),
+        "has_qr_code": bool(record.qr_image_sha256),
         "error": record.error or "",
         "status_code": record.internal_status_code,
         "status_message": record.internal_status_message or "",
@@ -75,10 +71,20 @@ def _serialize_qr(record: QrCode, include_payloads: bool = False):
     if include_payloads:
         data["request_payload"] = record.request_payload
         data["response_payload"] = record.response_payload
-        data["qr_code_base64"] = record.qr_code_base64
+        data["qr_image_sha256"] = record.qr_image_sha256
+        data["qr_image_size"] = record.qr_image_size
+        data["qr_image_url"] = reverse("qr_image", args=[record.id]) if record.qr_image_sha256 else None
     return data
 
 
+def _decode_qr_image(qr_base64: str) -> bytes | None:
+    # Daraja returns a base64 PNG.
+    try:
+        return base64.b64decode(qr_base64, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+
+
 @require_oauth2(scopes=["qr:write"])
 @csrf_exempt
 def generate_qr(request):
@@ -97,13 +103,48 @@ def generate_qr(request):
     if request.method != "POST":
         return JsonResponse({"error": "Method not allowed"}, status=405)
 
+    prepared, response = _prepare_generate_qr(request)
+    if response is not None:
+        return response
+
+    try:
+        resp = outbound.post(prepared["api_url"], json=prepared["payload"], headers=prepared["headers"])
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except Exception as e:
+        return _qr_request_failed(request, prepared, e)
+    return _qr_response(request, prepared, resp)
+
+
+@require_oauth2(scopes=["qr:write"])
+@csrf_exempt
+async def generate_qr_async(request):
+    """`generate_qr` for ASGI deployments."""
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    prepared, response = await sync_to_async(_prepare_generate_qr)(request)
+    if response is not None:
+        return response
+
+    try:
+        resp = await outbound.apost(prepared["api_url"], json=prepared["payload"], headers=prepared["headers"])
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except Exception as e:
+        return await sync_to_async(_qr_request_failed)(request, prepared, e)
+    return await sync_to_async(_qr_response)(request, prepared, resp)
+
+
+def _prepare_generate_qr(request):
+    """Validate the request and log it.
+
+    Returns (prepared, None) when Daraja must be called, or (None, response) for
+    errors and for results served from the QR cache.
+    """
     api_url = os.getenv("MPESA_QR_CODE_URL")
     if not api_url:
-        return JsonResponse({"error": "MPESA_QR_CODE_URL is not set"}, status=500)
-
-    access_token = MpesaC2bCredential.get_access_token()
-    if not access_token:
-        return JsonResponse({"error": "Failed to retrieve access token"}, status=500)
+        return None, JsonResponse({"error": "MPESA_QR_CODE_URL is not set"}, status=500)
 
     body = json_body(request)
     if not isinstance(body, dict):
@@ -135,66 +176,135 @@ def generate_qr(request):
 
     # Basic validation (keep it minimal).
     if not str(payload.get("MerchantName") or "").strip():
-        return JsonResponse({"error": "MerchantName is required"}, status=400)
+        return None, JsonResponse({"error": "MerchantName is required"}, status=400)
     if not str(payload.get("RefNo") or "").strip():
-        return JsonResponse({"error": "RefNo is required"}, status=400)
+        return None, JsonResponse({"error": "RefNo is required"}, status=400)
     if payload.get("Amount") in (None, ""):
-        return JsonResponse({"error": "Amount is required"}, status=400)
+        return None, JsonResponse({"error": "Amount is required"}, status=400)
     if not str(payload.get("TrxCode") or "").strip():
-        return JsonResponse({"error": "TrxCode is required"}, status=400)
+        return None, JsonResponse({"error": "TrxCode is required"}, status=400)
 
-    headers = {
+    MpesaCalls.objects.create(
+        ip_address=request.META.get("REMOTE_ADDR"),
+        caller="QR Generate Request",
+        conversation_id=str(payload.get("RefNo") or ""),
+        content=json.dumps(payload),
+    )
+
+    prepared = {
+        "api_url": api_url,
+        "payload": payload,
+        "business": business,
+        "shortcode_obj": shortcode_obj,
+        "cache_key": qr_cache.cache_key(payload, shortcode_obj) if qr_cache.enabled() else None,
+    }
+
+    if prepared["cache_key"]:
+        cached = _qr_from_cache(request, prepared)
+        if cached is not None:
+            return None, cached
+
+    access_token = MpesaC2bCredential.get_access_token()
+    if not access_token:
+        return None, JsonResponse({"error": "Failed to retrieve access token"}, status=500)
+    prepared["headers"] = {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json",
     }
+    return prepared, None
+
+
+def _qr_from_cache(request, prepared: dict):
+    """Answer from the QR cache without calling Daraja; None on a miss."""
+    cached = qr_cache.get(prepared["cache_key"])
+    if cached is None or cached.get("rendered_locally"):
+        # Entries left by the removed in-tree renderer are never served.
+        return None
+    try:
+        image = blob_store.read(cached["qr_image_sha256"])
+    except (KeyError, OSError):
+        return None
+
+    payload = prepared["payload"]
+    stored_payload = cached.get("response") or {}
+    data = {**stored_payload, "QRCode": base64.b64encode(image).decode("ascii"), "cache_hit": True}
 
     MpesaCalls.objects.create(
         ip_address=request.META.get("REMOTE_ADDR"),
-        caller="QR Generate Request",
+        caller="QR Generate Cache Hit",
         conversation_id=str(payload.get("RefNo") or ""),
-        content=json.dumps(payload),
+        content=json.dumps({"status": cached.get("status"), "cache": "hit", "data": stored_payload}),
+    )
+    QrCode.objects.create(
+        ip_address=request.META.get("REMOTE_ADDR"),
+        requested_by=_maybe_user_id(request),
+        business=prepared["business"],
+        shortcode=prepared["shortcode_obj"],
+        merchant_name=str(payload.get("MerchantName") or ""),
+        ref_no=str(payload.get("RefNo") or ""),
+        amount=payload.get("Amount") or 0,
+        trx_code=str(payload.get("TrxCode") or ""),
+        cpi=str(payload.get("CPI") or ""),
+        size=str(payload.get("Size") or ""),
+        request_payload=payload,
+        response_status=cached.get("status"),
+        response_payload=stored_payload,
+        qr_image_sha256=cached["qr_image_sha256"],
+        qr_image_size=len(image),
+        internal_status_code=stored_payload.get("status_code"),
+        internal_status_message=str(stored_payload.get("status_message") or ""),
+    )
+    return JsonResponse(data, status=cached.get("status") or 200)
+
+
+def _qr_request_failed(request, prepared: dict, e: Exception):
+    payload = prepared["payload"]
+    business = prepared["business"]
+    shortcode_obj = prepared["shortcode_obj"]
+
+    rec = QrCode.objects.create(
+        ip_address=request.META.get("REMOTE_ADDR"),
+        requested_by=_maybe_user_id(request),
+        business=business,
+        shortcode=shortcode_obj,
+        merchant_name=str(payload.get("MerchantName") or ""),
+        ref_no=str(payload.get("RefNo") or ""),
+        amount=payload.get("Amount") or 0,
+        trx_code=str(payload.get("TrxCode") or ""),
+        cpi=str(payload.get("CPI") or ""),
+        size=str(payload.get("Size") or ""),
+        request_payload=payload,
+        response_status=502,
+        response_payload={},
+        error=str(e),
+    )
+    apply_mapped_status(
+        rec,
+        external_system="gateway",
+        external_code="REQUEST_ERROR",
+        external_message=str(e),
+    )
+    rec.save(update_fields=["internal_status_code", "internal_status_message", "updated_at"])
+    MpesaCalls.objects.create(
+        ip_address=request.META.get("REMOTE_ADDR"),
+        caller="QR Generate Error",
+        conversation_id=str(payload.get("RefNo") or ""),
+        content=json.dumps({"error": str(e)}),
+    )
+    return JsonResponse(
+        {
+            "error": str(e),
+            "status_code": rec.internal_status_code,
+            "status_message": rec.internal_status_message or str(e),
+        },
+        status=502,
     )
 
-    try:
-        resp = requests.post(api_url, json=payload, headers=headers, timeout=30)
-    except Exception as e:
-        rec = QrCode.objects.create(
-            ip_address=request.META.get("REMOTE_ADDR"),
-            requested_by=_maybe_user_id(request),
-            business=business,
-            shortcode=shortcode_obj,
-            merchant_name=str(payload.get("MerchantName") or ""),
-            ref_no=str(payload.get("RefNo") or ""),
-            amount=payload.get("Amount") or 0,
-            trx_code=str(payload.get("TrxCode") or ""),
-            cpi=str(payload.get("CPI") or ""),
-            size=str(payload.get("Size") or ""),
-            request_payload=payload,
-            response_status=502,
-            response_payload={},
-            error=str(e),
-        )
-        apply_mapped_status(
-            rec,
-            external_system="gateway",
-            external_code="REQUEST_ERROR",
-            external_message=str(e),
-        )
-        rec.save(update_fields=["internal_status_code", "internal_status_message", "updated_at"])
-        MpesaCalls.objects.create(
-            ip_address=request.META.get("REMOTE_ADDR"),
-            caller="QR Generate Error",
-            conversation_id=str(payload.get("RefNo") or ""),
-            content=json.dumps({"error": str(e)}),
-        )
-        return JsonResponse(
-            {
-                "error": str(e),
-                "status_code": rec.internal_status_code,
-                "status_message": rec.internal_status_message or str(e),
-            },
-            status=502,
-        )
+
+def _qr_response(request, prepared: dict, resp):
+    payload = prepared["payload"]
+    business = prepared["business"]
+    shortcode_obj = prepared["shortcode_obj"]
 
     try:
         data = resp.json()
@@ -212,6 +322,15 @@ def generate_qr(request):
     if isinstance(data, dict) and isinstance(data.get("QRCode"), str):
         qr_base64 = data.get("QRCode") or ""
 
+    # Store the image once in the blob store; the row keeps only its digest and size.
+    stored_payload = data if isinstance(data, dict) else {"data": data}
+    qr_image = _decode_qr_image(qr_base64) if qr_base64 else None
+    qr_image_sha256, qr_image_size = "", None
+    if qr_base64:
+        # Anything that is not base64 is kept verbatim.
+        qr_image_sha256, qr_image_size = blob_store.put(qr_image if qr_image is not None else qr_base64.encode("utf-8"))
+        stored_payload = {k: v for k, v in stored_payload.items() if k != "QRCode"}
+
     rec = QrCode.objects.create(
         ip_address=request.META.get("REMOTE_ADDR"),
         requested_by=_maybe_user_id(request),
@@ -225,8 +344,9 @@ def generate_qr(request):
         size=str(payload.get("Size") or ""),
         request_payload=payload,
         response_status=resp.status_code,
-        response_payload=data if isinstance(data, dict) else {"data": data},
-        qr_code_base64=qr_base64,
+        response_payload=stored_payload,
+        qr_image_sha256=qr_image_sha256,
+        qr_image_size=qr_image_size,
     )
 
     response_code = None
@@ -255,6 +375,17 @@ def generate_qr(request):
     if isinstance(data, dict):
         data["status_code"] = mapped.status_code
         data["status_message"] = mapped.status_message
+        data["cache_hit"] = False
+
+    if prepared.get("cache_key") and qr_image is not None and 200 <= resp.status_code < 300:
+        qr_cache.put(
+            prepared["cache_key"],
+            {
+                "status": resp.status_code,
+                "qr_image_sha256": qr_image_sha256,
+                "response": {**stored_payload, "status_code": mapped.status_code, "status_message": mapped.status_message},
+            },
+        )
 
     return JsonResponse(data, status=resp.status_code)
 
@@ -264,7 +395,7 @@ def qr_history(request):
     if request.method != "GET":
         return JsonResponse({"error": "Method not allowed"}, status=405)
 
-    items = QrCode.objects.all()[:50]
+    items = QrCode.objects.defer("request_payload", "response_payload")[:50]
     return JsonResponse({"results": [_serialize_qr(r) for r in items]}, status=200)
 
 
@@ -275,3 +406,24 @@ def qr_detail(request, qr_id):
 
     record = get_object_or_404(QrCode, id=qr_id)
     return JsonResponse(_serialize_qr(record, include_payloads=True), status=200)
+
+
+@require_staff
+def qr_image(request, qr_id):
+    """Stream the stored QR image (PNG) from the blob store."""
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    record = get_object_or_404(QrCode.objects.only("id", "qr_image_sha256"), id=qr_id)
+    if not record.qr_image_sha256:
+        return JsonResponse({"error": "No QR image stored for this record"}, status=404)
+    try:
+        fh = blob_store.open_blob(record.qr_image_sha256)
+    except OSError:
+        return JsonResponse({"error": "QR image missing from blob store"}, status=404)
+
+    response = FileResponse(fh, content_type="image/png")
+    # Content-addressed: the bytes behind this digest never change.
+    response["ETag"] = f'"{record.qr_image_sha256}"'
+    response["Cache-Control"] = "private, max-age=31536000, immutable"
+    return response
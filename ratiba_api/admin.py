@@ -1,9 +1,15 @@
 from django.contrib import admin
 
-from .models import RatibaOrder
+from .models import RatibaOrder, RatibaSchedule
 
 
 @admin.register(RatibaOrder)
 class RatibaOrderAdmin(admin.ModelAdmin):
     list_display = ("created_at", "response_status")
     search_fields = ("id",)
+
+
+@admin.register(RatibaSchedule)
+class RatibaScheduleAdmin(admin.ModelAdmin):
+    list_display = ("order", "business", "status", "frequency", "amount", "next_run_date", "end_date")
+    list_filter = ("status", "frequency")
@@ -0,0 +1,23 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ratiba_api.schedule import advance_schedules
+
+
+class Command(BaseCommand):
+    help = "Roll Ratiba schedules' next_run_date forward and mark finished schedules completed (run daily)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date", default="", help="Advance as of this date (YYYY-MM-DD; default: today)")
+
+    def handle(self, *args, **options):
+        today = None
+        if options["date"]:
+            try:
+                today = datetime.datetime.strptime(options["date"], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("--date must be YYYY-MM-DD")
+
+        updated = advance_schedules(today=today)
+        self.stdout.write(f"Advanced Ratiba schedules. rows={updated}")
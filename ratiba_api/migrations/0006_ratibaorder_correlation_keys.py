@@ -0,0 +1,76 @@
+from django.db import migrations, models
+
+
+def _account_reference(payload) -> str:
+    if not isinstance(payload, dict):
+        return ""
+    for key in ("AccountReference", "accountReference", "account_reference"):
+        value = payload.get(key)
+        if isinstance(value, str) and value.strip():
+            return value.strip()[:100]
+    return ""
+
+
+def _standing_order_id(payload) -> str:
+    if not isinstance(payload, dict):
+        return ""
+    header = payload.get("ResponseHeader")
+    for source in (payload, payload.get("ResponseBody"), header):
+        if not isinstance(source, dict):
+            continue
+        for key in ("StandingOrderID", "StandingOrderId", "standingOrderId", "standing_order_id"):
+            value = source.get(key)
+            if value not in (None, "") and str(value).strip():
+                return str(value).strip()[:100]
+    if isinstance(header, dict) and str(header.get("responseRefID") or "").strip():
+        return str(header["responseRefID"]).strip()[:100]
+    return ""
+
+
+def backfill_correlation_keys(apps, _schema_editor):
+    """Copy AccountReference and the upstream standing order id out of the JSON payloads."""
+
+    RatibaOrder = apps.get_model("ratiba_api", "RatibaOrder")
+
+    pending = []
+    rows = RatibaOrder.objects.only("id", "request_payload", "response_payload")
+    for order in rows.iterator(chunk_size=500):
+        order.account_reference = _account_reference(order.request_payload)
+        order.standing_order_id = _standing_order_id(order.response_payload)
+        if not (order.account_reference or order.standing_order_id):
+            continue
+        pending.append(order)
+        if len(pending) >= 500:
+            RatibaOrder.objects.bulk_update(pending, ["account_reference", "standing_order_id"])
+            pending = []
+    if pending:
+        RatibaOrder.objects.bulk_update(pending, ["account_reference", "standing_order_id"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratiba_api', '0005_ratibaorder_internal_status_code_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ratibaorder',
+            name='account_reference',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='ratibaorder',
+            name='standing_order_id',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.RunPython(backfill_correlation_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='ratibaorder',
+            index=models.Index(fields=['account_reference', 'created_at'], name='ratiba_order_account_ref_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ratibaorder',
+            index=models.Index(fields=['standing_order_id'], name='ratiba_order_standing_id_idx'),
+        ),
+    ]
@@ -0,0 +1,143 @@
+# Generated by Django 5.1.15 on 2026-10-16 23:57
+
+import calendar
+import datetime
+from decimal import Decimal, InvalidOperation
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+# Frozen copies of ratiba_api.schedule helpers as of this migration.
+# Frequency codes: 1 one-off, 2 daily, 3 weekly, 4 monthly, 5 bi-monthly,
+# 6 quarterly, 7 half-yearly, 8 yearly.
+_DAY_STEPS = {2: 1, 3: 7}
+_MONTH_STEPS = {4: 1, 5: 2, 6: 3, 7: 6, 8: 12}
+_KNOWN_FREQUENCIES = {1, 2, 3, 4, 5, 6, 7, 8}
+
+
+def _parse_date(value):
+    try:
+        return datetime.datetime.strptime(str(value or "").strip(), "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+def _add_months(day, months):
+    years, month_index = divmod(day.month - 1 + months, 12)
+    year, month = day.year + years, month_index + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def _run_date(start, frequency, n):
+    if frequency in _DAY_STEPS:
+        return start + datetime.timedelta(days=n * _DAY_STEPS[frequency])
+    if frequency in _MONTH_STEPS:
+        return _add_months(start, n * _MONTH_STEPS[frequency])
+    return start
+
+
+def _next_run(start, end, frequency, on_or_after):
+    if on_or_after <= start:
+        n = 0
+    elif frequency in _DAY_STEPS:
+        n = -(-(on_or_after - start).days // _DAY_STEPS[frequency])
+    elif frequency in _MONTH_STEPS:
+        months = (on_or_after.year - start.year) * 12 + on_or_after.month - start.month
+        n = months // _MONTH_STEPS[frequency]
+        while _run_date(start, frequency, n) < on_or_after:
+            n += 1
+    else:
+        # One-off order that already ran.
+        return None
+    day = _run_date(start, frequency, n)
+    return day if day <= end else None
+
+
+def _schedule_fields(payload):
+    if not isinstance(payload, dict):
+        return None
+    start = _parse_date(payload.get("StartDate"))
+    end = _parse_date(payload.get("EndDate"))
+    try:
+        frequency = int(str(payload.get("Frequency")).strip())
+        amount = Decimal(str(payload.get("Amount")).strip()).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError):
+        return None
+    if start is None or end is None or end < start or frequency not in _KNOWN_FREQUENCIES:
+        return None
+    return {"start_date": start, "end_date": end, "frequency": frequency, "amount": amount}
+
+
+def backfill_schedules(apps, _schema_editor):
+    """Create schedules for orders Daraja already accepted, using their last callback result."""
+
+    RatibaOrder = apps.get_model("ratiba_api", "RatibaOrder")
+    RatibaSchedule = apps.get_model("ratiba_api", "RatibaSchedule")
+
+    today = timezone.localdate()
+    pending = []
+    orders = RatibaOrder.objects.filter(response_status__gte=200, response_status__lt=300).only(
+        "id", "business_id", "shortcode_id", "request_payload", "callback_result_code"
+    )
+    for order in orders.iterator(chunk_size=500):
+        fields = _schedule_fields(order.request_payload)
+        if fields is None:
+            continue
+        next_run_date = _next_run(fields["start_date"], fields["end_date"], fields["frequency"], today)
+        if order.callback_result_code not in (None, 0):
+            status, next_run_date = "failed", None
+        elif next_run_date is None:
+            status = "completed"
+        else:
+            status = "active" if order.callback_result_code == 0 else "pending"
+        pending.append(
+            RatibaSchedule(
+                order_id=order.id,
+                business_id=order.business_id,
+                shortcode_id=order.shortcode_id,
+                status=status,
+                next_run_date=next_run_date,
+                **fields,
+            )
+        )
+        if len(pending) >= 500:
+            RatibaSchedule.objects.bulk_create(pending)
+            pending = []
+    if pending:
+        RatibaSchedule.objects.bulk_create(pending)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business_api', '0005_business_business_type'),
+        ('ratiba_api', '0006_ratibaorder_correlation_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatibaSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('frequency', models.PositiveSmallIntegerField(choices=[(1, 'One Off'), (2, 'Daily'), (3, 'Weekly'), (4, 'Monthly'), (5, 'Bi-Monthly'), (6, 'Quarterly'), (7, 'Half Year'), (8, 'Yearly')])),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('active', 'Active'), ('failed', 'Failed'), ('completed', 'Completed')], default='pending', max_length=20)),
+                ('next_run_date', models.DateField(blank=True, null=True)),
+                ('business', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ratiba_schedules', to='business_api.business')),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='schedule', to='ratiba_api.ratibaorder')),
+                ('shortcode', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ratiba_schedules', to='business_api.mpesashortcode')),
+            ],
+            options={
+                'verbose_name': 'Ratiba Schedule',
+                'verbose_name_plural': 'Ratiba Schedules',
+                'indexes': [models.Index(fields=['status', 'next_run_date'], name='ratiba_sched_status_next_idx'), models.Index(fields=['business', 'status', 'next_run_date'], name='ratiba_sched_biz_next_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_schedules, migrations.RunPython.noop),
+    ]
@@ -34,6 +34,10 @@ class RatibaOrder(BaseModel):
         related_name="ratiba_orders",
     )
 
+    # Correlation keys for callback matching, copied out of the payloads so they can be indexed.
+    account_reference = models.CharField(max_length=100, blank=True, default="")
+    standing_order_id = models.CharField(max_length=100, blank=True, default="")
+
     request_payload = models.JSONField(default=dict)
     response_status = models.IntegerField(blank=True, null=True)
     response_payload = models.JSONField(default=dict)
@@ -50,6 +54,84 @@ class RatibaOrder(BaseModel):
     class Meta:
         verbose_name = "Ratiba Order"
         verbose_name_plural = "Ratiba Orders"
+        indexes = [
+            models.Index(fields=["account_reference", "created_at"], name="ratiba_order_account_ref_idx"),
+            models.Index(fields=["standing_order_id"], name="ratiba_order_standing_id_idx"),
+        ]
 
     def __str__(self):
         return f"RatibaOrder {self.id}"
+
+
+class RatibaSchedule(BaseModel):
+    """Normalised schedule of a Ratiba standing order (one per accepted order).
+
+    `next_run_date` is the next debit date on or after the last time the
+    schedule was synced or advanced. It is indexed so due and forecast queries
+    never parse `request_payload`. See `ratiba_api/schedule.py`.
+    """
+
+    STATUS_PENDING = "pending"  # accepted by Daraja, awaiting the Ratiba callback
+    STATUS_ACTIVE = "active"
+    STATUS_FAILED = "failed"
+    STATUS_COMPLETED = "completed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_ACTIVE, "Active"),
+        (STATUS_FAILED, "Failed"),
+        (STATUS_COMPLETED, "Completed"),
+    ]
+
+    # Daraja Ratiba `Frequency` codes.
+    FREQUENCY_ONE_OFF = 1
+    FREQUENCY_DAILY = 2
+    FREQUENCY_WEEKLY = 3
+    FREQUENCY_MONTHLY = 4
+    FREQUENCY_BI_MONTHLY = 5
+    FREQUENCY_QUARTERLY = 6
+    FREQUENCY_HALF_YEARLY = 7
+    FREQUENCY_YEARLY = 8
+    FREQUENCY_CHOICES = [
+        (FREQUENCY_ONE_OFF, "One Off"),
+        (FREQUENCY_DAILY, "Daily"),
+        (FREQUENCY_WEEKLY, "Weekly"),
+        (FREQUENCY_MONTHLY, "Monthly"),
+        (FREQUENCY_BI_MONTHLY, "Bi-Monthly"),
+        (FREQUENCY_QUARTERLY, "Quarterly"),
+        (FREQUENCY_HALF_YEARLY, "Half Year"),
+        (FREQUENCY_YEARLY, "Yearly"),
+    ]
+
+    order = models.OneToOneField(RatibaOrder, on_delete=models.CASCADE, related_name="schedule")
+    business = models.ForeignKey(
+        "business_api.Business",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="ratiba_schedules",
+    )
+    shortcode = models.ForeignKey(
+        "business_api.MpesaShortcode",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="ratiba_schedules",
+    )
+
+    start_date = models.DateField()
+    end_date = models.DateField()
+    frequency = models.PositiveSmallIntegerField(choices=FREQUENCY_CHOICES)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    next_run_date = models.DateField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Ratiba Schedule"
+        verbose_name_plural = "Ratiba Schedules"
+        indexes = [
+            models.Index(fields=["status", "next_run_date"], name="ratiba_sched_status_next_idx"),
+            models.Index(fields=["business", "status", "next_run_date"], name="ratiba_sched_biz_next_idx"),
+        ]
+
+    def __str__(self):
+        return f"RatibaSchedule {self.order_id} next={self.next_run_date}"
@@ -0,0 +1,241 @@
+"""Ratiba schedule lifecycle and run-date projection.
+
+Each accepted `RatibaOrder` gets one `RatibaSchedule` row, normalised from the
+order's StartDate, EndDate, Frequency and Amount:
+
+- `sync_schedule(order)` creates it when Daraja accepts the order (`pending`).
+- `record_callback(order, result_code)` moves it to `active` (ResultCode 0) or
+  `failed` as the Ratiba callback arrives.
+- `advance_schedules()` (`python manage.py advance_ratiba_schedules`, run daily)
+  rolls `next_run_date` forward and marks finished schedules `completed`.
+
+`forecast_inflows()` reads the schedules that can run inside a date range with
+one indexed query on (business, status, next_run_date) and expands their run
+dates in Python. Monthly-type frequencies keep the start day, clamped to the
+end of shorter months.
+"""
+
+from __future__ import annotations
+
+import calendar
+import datetime
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.utils import timezone
+
+from .models import RatibaSchedule
+
+
+_DAY_STEPS = {
+    RatibaSchedule.FREQUENCY_DAILY: 1,
+    RatibaSchedule.FREQUENCY_WEEKLY: 7,
+}
+_MONTH_STEPS = {
+    RatibaSchedule.FREQUENCY_MONTHLY: 1,
+    RatibaSchedule.FREQUENCY_BI_MONTHLY: 2,
+    RatibaSchedule.FREQUENCY_QUARTERLY: 3,
+    RatibaSchedule.FREQUENCY_HALF_YEARLY: 6,
+    RatibaSchedule.FREQUENCY_YEARLY: 12,
+}
+_KNOWN_FREQUENCIES = {code for code, _ in RatibaSchedule.FREQUENCY_CHOICES}
+_OPEN_STATUSES = (RatibaSchedule.STATUS_PENDING, RatibaSchedule.STATUS_ACTIVE)
+
+MAX_FORECAST_DAYS = 366
+
+
+def parse_ratiba_date(value) -> datetime.date | None:
+    try:
+        return datetime.datetime.strptime(str(value or "").strip(), "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+def _add_months(day: datetime.date, months: int) -> datetime.date:
+    years, month_index = divmod(day.month - 1 + months, 12)
+    year, month = day.year + years, month_index + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def run_date(start: datetime.date, frequency: int, n: int) -> datetime.date:
+    """Date of the n-th run (0-based) of a schedule starting on `start`."""
+
+    if frequency in _DAY_STEPS:
+        return start + datetime.timedelta(days=n * _DAY_STEPS[frequency])
+    if frequency in _MONTH_STEPS:
+        return _add_months(start, n * _MONTH_STEPS[frequency])
+    return start
+
+
+def _first_run_index(start: datetime.date, frequency: int, on_or_after: datetime.date) -> int | None:
+    if on_or_after <= start:
+        return 0
+    if frequency in _DAY_STEPS:
+        return -(-(on_or_after - start).days // _DAY_STEPS[frequency])
+    if frequency in _MONTH_STEPS:
+        months = (on_or_after.year - start.year) * 12 + on_or_after.month - start.month
+        n = months // _MONTH_STEPS[frequency]
+        while run_date(start, frequency, n) < on_or_after:
+            n += 1
+        return n
+    # One-off order that already ran.
+    return None
+
+
+def next_run(start: datetime.date, end: datetime.date, frequency: int, on_or_after: datetime.date) -> datetime.date | None:
+    n = _first_run_index(start, frequency, on_or_after)
+    if n is None:
+        return None
+    day = run_date(start, frequency, n)
+    return day if day <= end else None
+
+
+def run_dates(start: datetime.date, end: datetime.date, frequency: int, date_from: datetime.date, date_to: datetime.date):
+    """Yield the run dates between date_from and date_to (inclusive)."""
+
+    n = _first_run_index(start, frequency, date_from)
+    if n is None:
+        return
+    last = min(end, date_to)
+    while True:
+        day = run_date(start, frequency, n)
+        if day > last:
+            return
+        yield day
+        if frequency not in _DAY_STEPS and frequency not in _MONTH_STEPS:
+            return
+        n += 1
+
+
+def schedule_fields(payload) -> dict | None:
+    """StartDate/EndDate/Frequency/Amount of a create request, or None when unusable."""
+
+    if not isinstance(payload, dict):
+        return None
+    start = parse_ratiba_date(payload.get("StartDate"))
+    end = parse_ratiba_date(payload.get("EndDate"))
+    try:
+        frequency = int(str(payload.get("Frequency")).strip())
+        amount = Decimal(str(payload.get("Amount")).strip()).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError):
+        return None
+    if start is None or end is None or end < start or frequency not in _KNOWN_FREQUENCIES:
+        return None
+    return {"start_date": start, "end_date": end, "frequency": frequency, "amount": amount}
+
+
+def sync_schedule(order, today: datetime.date | None = None) -> RatibaSchedule | None:
+    """Create or refresh the schedule of an accepted order (status is only set on create)."""
+
+    fields = schedule_fields(order.request_payload)
+    if fields is None:
+        return None
+
+    today = today or timezone.localdate()
+    next_run_date = next_run(fields["start_date"], fields["end_date"], fields["frequency"], today)
+    schedule, _ = RatibaSchedule.objects.update_or_create(
+        order=order,
+        defaults={
+            **fields,
+            "business": order.business,
+            "shortcode": order.shortcode,
+            "next_run_date": next_run_date,
+        },
+        create_defaults={
+            **fields,
+            "business": order.business,
+            "shortcode": order.shortcode,
+            "next_run_date": next_run_date,
+            "status": RatibaSchedule.STATUS_PENDING if next_run_date else RatibaSchedule.STATUS_COMPLETED,
+        },
+    )
+    return schedule
+
+
+def record_callback(order, result_code, today: datetime.date | None = None) -> RatibaSchedule | None:
+    """Apply a Ratiba callback result to the order's schedule."""
+
+    schedule = RatibaSchedule.objects.filter(order=order).first() or sync_schedule(order, today)
+    if schedule is None or result_code is None:
+        return schedule
+
+    if result_code == 0:
+        schedule.status = RatibaSchedule.STATUS_ACTIVE if schedule.next_run_date else RatibaSchedule.STATUS_COMPLETED
+    else:
+        schedule.status = RatibaSchedule.STATUS_FAILED
+        schedule.next_run_date = None
+    schedule.save(update_fields=["status", "next_run_date", "updated_at"])
+    return schedule
+
+
+def advance_schedules(today: datetime.date | None = None, batch_size: int = 500) -> int:
+    """Roll past-due `next_run_date`s forward to today or later. Returns rows updated."""
+
+    today = today or timezone.localdate()
+    stale = RatibaSchedule.objects.filter(status__in=_OPEN_STATUSES, next_run_date__lt=today).only(
+        "id", "start_date", "end_date", "frequency", "status", "next_run_date"
+    )
+
+    updated = 0
+    pending = []
+    now = timezone.now()
+    for schedule in stale.iterator(chunk_size=batch_size):
+        schedule.next_run_date = next_run(schedule.start_date, schedule.end_date, schedule.frequency, today)
+        if schedule.next_run_date is None:
+            schedule.status = RatibaSchedule.STATUS_COMPLETED
+        schedule.updated_at = now
+        pending.append(schedule)
+        if len(pending) >= batch_size:
+            RatibaSchedule.objects.bulk_update(pending, ["next_run_date", "status", "updated_at"])
+            updated += len(pending)
+            pending = []
+    if pending:
+        RatibaSchedule.objects.bulk_update(pending, ["next_run_date", "status", "updated_at"])
+        updated += len(pending)
+    return updated
+
+
+def forecast_inflows(date_from: datetime.date, date_to: datetime.date, business=None) -> dict:
+    """Expected standing order debits between date_from and date_to (inclusive).
+
+    Active schedules count as expected; schedules still awaiting their callback
+    are reported separately as pending.
+    """
+
+    schedules = RatibaSchedule.objects.filter(
+        status__in=_OPEN_STATUSES,
+        next_run_date__lte=date_to,
+        end_date__gte=date_from,
+    )
+    if business is not None:
+        schedules = schedules.filter(business=business)
+    rows = schedules.order_by().values_list(
+        "business_id", "status", "start_date", "end_date", "frequency", "amount", "next_run_date"
+    )
+
+    def bucket():
+        return {"expected_amount": Decimal("0"), "expected_runs": 0, "pending_amount": Decimal("0"), "pending_runs": 0}
+
+    by_business = defaultdict(bucket)
+    by_day = defaultdict(bucket)
+    totals = bucket()
+    for business_id, status, start, end, frequency, amount, next_run_date in rows:
+        kind = "expected" if status == RatibaSchedule.STATUS_ACTIVE else "pending"
+        for day in run_dates(start, end, frequency, max(date_from, next_run_date), date_to):
+            for target in (by_business[business_id], by_day[day], totals):
+                target[f"{kind}_amount"] += amount
+                target[f"{kind}_runs"] += 1
+
+    def serialize(values: dict) -> dict:
+        return {k: str(v) if isinstance(v, Decimal) else v for k, v in values.items()}
+
+    return {
+        "date_from": date_from.isoformat(),
+        "date_to": date_to.isoformat(),
+        "totals": serialize(totals),
+        "by_business": [
+            {"business_id": str(business_id) if business_id else None, **serialize(values)}
+            for business_id, values in sorted(by_business.items(), key=lambda kv: str(kv[0] or ""))
+        ],
+        "by_day": [{"date": day.isoformat(), **serialize(values)} for day, values in sorted(by_day.items())],
+    }
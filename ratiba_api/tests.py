@@ -1,6 +1,8 @@
+import datetime
 import json
 import os
 from datetime import timedelta
+from decimal import Decimal
 from unittest.mock import patch
 
 from django.contrib.auth import get_user_model
@@ -11,7 +13,8 @@ from oauth2_provider.models import AccessToken, Application
 
 from business_api.models import Business, MpesaShortcode, OAuthClientBusiness
 
-from .models import RatibaOrder
+from . import schedule
+from .models import RatibaOrder, RatibaSchedule
 
 
 class RatibaApiTests(TestCase):
@@ -55,7 +58,7 @@ class RatibaApiTests(TestCase):
         self.assertEqual(resp.status_code, 401)
 
     @patch("ratiba_api.views.MpesaC2bCredential.get_access_token", return_value="token")
-    @patch("ratiba_api.views.requests.post")
+    @patch("ratiba_api.views.outbound.post")
     def test_create_persists_success(self, post, _tok):
         post.return_value.status_code = 200
         post.return_value.json.return_value = {"status": "ok"}
@@ -87,6 +90,7 @@ class RatibaApiTests(TestCase):
         self.assertEqual(row.shortcode_id, self.shortcode.id)
         self.assertEqual(row.request_payload.get("BusinessShortCode"), "174379")
         self.assertEqual(row.request_payload.get("CallBackURL"), "https://example.invalid/ratiba/callback")
+        self.assertEqual(row.account_reference, "Test")
 
     @patch("ratiba_api.views.MpesaC2bCredential.get_access_token", return_value="token")
     def test_create_validates_required_fields(self, _tok):
@@ -116,7 +120,7 @@ class RatibaApiTests(TestCase):
         self.assertIn("results", resp.json())
 
     def test_callback_is_csrf_exempt_and_updates_order(self):
-        order = RatibaOrder.objects.create(request_payload={"AccountReference": "AR-CB-1"})
+        order = RatibaOrder.objects.create(request_payload={"AccountReference": "AR-CB-1"}, account_reference="AR-CB-1")
 
         payload = {
             "AccountReference": "AR-CB-1",
@@ -137,3 +141,136 @@ class RatibaApiTests(TestCase):
         self.assertEqual(order.callback_result_code, 0)
         self.assertEqual(order.callback_result_description, "Standing order registered")
         self.assertEqual(order.callback_payload.get("Extra"), "value")
+
+    def test_callback_matches_standing_order_id_before_account_reference(self):
+        order = RatibaOrder.objects.create(
+            request_payload={"AccountReference": "AR-SO"},
+            account_reference="AR-SO",
+            response_payload={"ResponseHeader": {"responseRefID": "ref-123", "responseCode": "200"}},
+            standing_order_id="ref-123",
+        )
+        RatibaOrder.objects.create(request_payload={"AccountReference": "AR-OTHER"}, account_reference="AR-OTHER")
+
+        payload = {
+            "AccountReference": "AR-OTHER",
+            "ResponseHeader": {"responseRefID": "ref-123"},
+            "ResultCode": 0,
+            "ResultDesc": "Standing order registered",
+        }
+        resp = self.client.post(
+            "/api/v1/ratiba/callback",
+            data=json.dumps(payload),
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 200)
+
+        order.refresh_from_db()
+        self.assertEqual(order.callback_result_code, 0)
+        self.assertFalse(RatibaOrder.objects.filter(account_reference="AR-OTHER", callback_received_at__isnull=False).exists())
+
+    @patch("ratiba_api.views.MpesaC2bCredential.get_access_token", return_value="token")
+    @patch("ratiba_api.views.outbound.post")
+    def test_schedule_follows_order_lifecycle_and_feeds_forecast(self, post, _tok):
+        post.return_value.status_code = 200
+        post.return_value.json.return_value = {"ResponseHeader": {"responseRefID": "ref-sched", "responseCode": "200"}}
+        start = timezone.localdate() + timedelta(days=1)
+
+        resp = self.client.post(
+            "/api/v1/ratiba/create",
+            data=json.dumps(
+                {
+                    "StandingOrderName": "Rent",
+                    "StartDate": start.strftime("%Y%m%d"),
+                    "EndDate": (start + timedelta(days=60)).strftime("%Y%m%d"),
+                    "TransactionType": "Standing Order Customer Pay Bill",
+                    "ReceiverPartyIdentifierType": "4",
+                    "Amount": "1000",
+                    "PartyA": "254708374149",
+                    "AccountReference": "RENT-1",
+                    "TransactionDesc": "Rent",
+                    "Frequency": "3",
+                }
+            ),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {self.access_token}",
+        )
+        self.assertEqual(resp.status_code, 200)
+
+        sched = RatibaSchedule.objects.get(order__account_reference="RENT-1")
+        self.assertEqual(sched.status, RatibaSchedule.STATUS_PENDING)
+        self.assertEqual(sched.next_run_date, start)
+        self.assertEqual(sched.business_id, self.business.id)
+        self.assertEqual(sched.amount, Decimal("1000.00"))
+
+        self.client.post(
+            "/api/v1/ratiba/callback",
+            data=json.dumps({"ResponseHeader": {"responseRefID": "ref-sched"}, "ResultCode": 0, "ResultDesc": "OK"}),
+            content_type="application/json",
+        )
+        sched.refresh_from_db()
+        self.assertEqual(sched.status, RatibaSchedule.STATUS_ACTIVE)
+
+        staff = get_user_model().objects.create_user(username="forecast-staff", password="pw", is_staff=True)
+        self.client.force_login(staff)
+        resp = self.client.get(
+            "/api/v1/ratiba/forecast",
+            {
+                "business_id": str(self.business.id),
+                "date_from": start.isoformat(),
+                "date_to": (start + timedelta(days=14)).isoformat(),
+            },
+        )
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual(data["business_id"], str(self.business.id))
+        self.assertEqual(data["totals"]["expected_runs"], 3)
+        self.assertEqual(data["totals"]["expected_amount"], "3000.00")
+        self.assertEqual([d["date"] for d in data["by_day"]], [(start + timedelta(days=7 * i)).isoformat() for i in range(3)])
+        self.assertEqual(data["by_business"][0]["business_id"], str(self.business.id))
+
+    def test_failed_callback_drops_schedule_from_forecast(self):
+        start = timezone.localdate()
+        order = RatibaOrder.objects.create(
+            business=self.business,
+            request_payload={"StartDate": start.strftime("%Y%m%d"), "EndDate": "20991231", "Frequency": "4", "Amount": "250"},
+            account_reference="AR-FAIL",
+            response_status=200,
+        )
+        schedule.sync_schedule(order)
+
+        self.client.post(
+            "/api/v1/ratiba/callback",
+            data=json.dumps({"AccountReference": "AR-FAIL", "ResultCode": 1, "ResultDesc": "Insufficient funds"}),
+            content_type="application/json",
+        )
+
+        sched = RatibaSchedule.objects.get(order=order)
+        self.assertEqual(sched.status, RatibaSchedule.STATUS_FAILED)
+        self.assertIsNone(sched.next_run_date)
+        self.assertEqual(schedule.forecast_inflows(start, start + timedelta(days=90))["totals"]["pending_runs"], 0)
+
+
+class RatibaScheduleTests(TestCase):
+    def test_monthly_runs_keep_the_start_day_clamped_to_month_end(self):
+        start = datetime.date(2024, 1, 31)
+        runs = list(schedule.run_dates(start, datetime.date(2024, 12, 31), RatibaSchedule.FREQUENCY_MONTHLY, datetime.date(2024, 2, 1), datetime.date(2024, 4, 30)))
+        self.assertEqual(runs, [datetime.date(2024, 2, 29), datetime.date(2024, 3, 31), datetime.date(2024, 4, 30)])
+        self.assertEqual(
+            schedule.next_run(start, datetime.date(2025, 1, 31), RatibaSchedule.FREQUENCY_QUARTERLY, datetime.date(2024, 5, 1)),
+            datetime.date(2024, 7, 31),
+        )
+        self.assertIsNone(schedule.next_run(start, start, RatibaSchedule.FREQUENCY_ONE_OFF, datetime.date(2024, 2, 1)))
+
+    def test_advance_rolls_next_run_forward_and_completes_finished(self):
+        order = RatibaOrder.objects.create(request_payload={"StartDate": "20240101", "EndDate": "20240115", "Frequency": "3", "Amount": "10"})
+        sched = schedule.sync_schedule(order, today=datetime.date(2024, 1, 1))
+        self.assertEqual(sched.next_run_date, datetime.date(2024, 1, 1))
+
+        schedule.advance_schedules(today=datetime.date(2024, 1, 9))
+        sched.refresh_from_db()
+        self.assertEqual(sched.next_run_date, datetime.date(2024, 1, 15))
+
+        schedule.advance_schedules(today=datetime.date(2024, 1, 16))
+        sched.refresh_from_db()
+        self.assertIsNone(sched.next_run_date)
+        self.assertEqual(sched.status, RatibaSchedule.STATUS_COMPLETED)
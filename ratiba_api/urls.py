@@ -1,15 +1,22 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
 
+# Daraja-bound endpoints use their async views under ASGI (see ASYNC_VIEWS_ENABLED).
+create_ratiba = views.create_ratiba_async if settings.ASYNC_VIEWS_ENABLED else views.create_ratiba
+
+
 urlpatterns = [
-    path("create", views.create_ratiba, name="ratiba_create"),
-    path("create/", views.create_ratiba),
+    path("create", create_ratiba, name="ratiba_create"),
+    path("create/", create_ratiba),
     path("callback", views.ratiba_callback, name="ratiba_callback"),
     path("callback/", views.ratiba_callback),
     path("history", views.ratiba_history, name="ratiba_history"),
     path("history/", views.ratiba_history),
+    path("forecast", views.ratiba_forecast, name="ratiba_forecast"),
+    path("forecast/", views.ratiba_forecast),
     path("<uuid:order_id>", views.ratiba_detail, name="ratiba_detail"),
     path("<uuid:order_id>/", views.ratiba_detail),
 ]
@@ -1,18 +1,24 @@
+import datetime
 import os
 import re
 import uuid
 
 import requests
+from asgiref.sync import sync_to_async
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 
 from mpesa_api.mpesa_credentials import MpesaC2bCredential
-from services_common.auth import require_oauth2, require_staff
+from services_common import outbound
+from services_common.auth import get_bound_business, require_oauth2, require_staff
+from services_common.circuit_breaker import UpstreamUnavailable, unavailable_response
 from services_common.http import json_body
 from services_common.status_codes import apply_mapped_status
+from services_common.tenancy import resolve_business_from_request
 
+from . import schedule
 from .models import RatibaOrder
 
 
@@ -28,17 +34,7 @@ def _resolve_shortcode(shortcode: str | None):
 
 
 def _get_bound_business(request):
-    token_obj = getattr(request, "oauth2_token", None)
-    app = getattr(request, "oauth2_application", None) if token_obj else None
-    if app is None:
-        return None
-    try:
-        from business_api.models import OAuthClientBusiness
-
-        binding = OAuthClientBusiness.objects.select_related("business").filter(application=app).first()
-        return binding.business if binding else None
-    except Exception:
-        return None
+    return get_bound_business(request)
 
 
 def _get_default_shortcode_for_business(business):
@@ -82,7 +78,24 @@ def _extract_account_reference(payload: dict) -> str:
     for key in ("AccountReference", "accountReference", "account_reference"):
         value = payload.get(key)
         if isinstance(value, str) and value.strip():
-            return value.strip()
+            return value.strip()[:100]
+    return ""
+
+
+def _extract_standing_order_id(payload: dict) -> str:
+    """Upstream standing order id: an explicit StandingOrderID, else the Daraja responseRefID."""
+    if not isinstance(payload, dict):
+        return ""
+    header = payload.get("ResponseHeader")
+    for source in (payload, payload.get("ResponseBody"), header):
+        if not isinstance(source, dict):
+            continue
+        for key in ("StandingOrderID", "StandingOrderId", "standingOrderId", "standing_order_id"):
+            value = source.get(key)
+            if value not in (None, "") and str(value).strip():
+                return str(value).strip()[:100]
+    if isinstance(header, dict) and str(header.get("responseRefID") or "").strip():
+        return str(header["responseRefID"]).strip()[:100]
     return ""
 
 
@@ -180,17 +193,52 @@ def create_ratiba(request):
     if request.method != "POST":
         return JsonResponse({"error": "Method not allowed"}, status=405)
 
+    prepared, response = _prepare_create_ratiba(request)
+    if response is not None:
+        return response
+
+    try:
+        resp = outbound.post(prepared["api_url"], json=prepared["payload"], headers=prepared["headers"])
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except requests.RequestException as e:
+        return _ratiba_request_failed(request, prepared, e)
+    return _ratiba_response(request, prepared, resp)
+
+
+@require_oauth2(scopes=["ratiba:write"])
+@csrf_exempt
+async def create_ratiba_async(request):
+    """`create_ratiba` for ASGI deployments."""
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    prepared, response = await sync_to_async(_prepare_create_ratiba)(request)
+    if response is not None:
+        return response
+
+    try:
+        resp = await outbound.apost(prepared["api_url"], json=prepared["payload"], headers=prepared["headers"])
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except requests.RequestException as e:
+        return await sync_to_async(_ratiba_request_failed)(request, prepared, e)
+    return await sync_to_async(_ratiba_response)(request, prepared, resp)
+
+
+def _prepare_create_ratiba(request):
+    """Validate and normalize the order. Returns (prepared, None) or (None, error_response)."""
     api_url = os.getenv("MPESA_RATIBA_URL")
     if not api_url:
-        return JsonResponse({"error": "MPESA_RATIBA_URL is not set"}, status=500)
+        return None, JsonResponse({"error": "MPESA_RATIBA_URL is not set"}, status=500)
 
     access_token = MpesaC2bCredential.get_access_token()
     if not access_token:
-        return JsonResponse({"error": "Failed to retrieve access token"}, status=500)
+        return None, JsonResponse({"error": "Failed to retrieve access token"}, status=500)
 
     payload = json_body(request)
     if not isinstance(payload, dict) or not payload:
-        return JsonResponse({"error": "Request body must be a non-empty JSON object"}, status=400)
+        return None, JsonResponse({"error": "Request body must be a non-empty JSON object"}, status=400)
 
     # Normalize common alias keys to Daraja canonical keys.
     payload = dict(payload)
@@ -220,40 +268,64 @@ def create_ratiba(request):
 
     validation_error = _validate_ratiba_payload(payload)
     if validation_error:
-        return JsonResponse({"error": validation_error}, status=400)
+        return None, JsonResponse({"error": validation_error}, status=400)
 
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
 
-    try:
-        resp = requests.post(api_url, json=payload, headers=headers, timeout=30)
-    except requests.RequestException as e:
-        RatibaOrder.objects.create(
-            ip_address=request.META.get("REMOTE_ADDR"),
-            requested_by=_maybe_user(request),
-            business=business,
-            shortcode=shortcode_obj,
-            request_payload=payload,
-            response_status=502,
-            response_payload={},
-            error=str(e),
-        )
-        return JsonResponse({"error": "Upstream request failed"}, status=502)
+    prepared = {
+        "api_url": api_url,
+        "headers": headers,
+        "payload": payload,
+        "business": business,
+        "shortcode_obj": shortcode_obj,
+    }
+    return prepared, None
+
+
+def _ratiba_request_failed(request, prepared: dict, e: Exception):
+    payload = prepared["payload"]
+    business = prepared["business"]
+    shortcode_obj = prepared["shortcode_obj"]
+
+    RatibaOrder.objects.create(
+        ip_address=request.META.get("REMOTE_ADDR"),
+        requested_by=_maybe_user(request),
+        business=business,
+        shortcode=shortcode_obj,
+        request_payload=payload,
+        account_reference=_extract_account_reference(payload),
+        response_status=502,
+        response_payload={},
+        error=str(e),
+    )
+    return JsonResponse({"error": "Upstream request failed"}, status=502)
+
+
+def _ratiba_response(request, prepared: dict, resp):
+    payload = prepared["payload"]
+    business = prepared["business"]
+    shortcode_obj = prepared["shortcode_obj"]
 
     try:
         data = resp.json()
     except ValueError:
         data = {"raw": (resp.text or "")}
 
-    RatibaOrder.objects.create(
+    response_payload = data if isinstance(data, dict) else {"data": data}
+    order = RatibaOrder.objects.create(
         ip_address=request.META.get("REMOTE_ADDR"),
         requested_by=_maybe_user(request),
         business=business,
         shortcode=shortcode_obj,
         request_payload=payload,
+        account_reference=_extract_account_reference(payload),
+        standing_order_id=_extract_standing_order_id(response_payload),
         response_status=resp.status_code,
-        response_payload=data if isinstance(data, dict) else {"data": data},
+        response_payload=response_payload,
         error="" if resp.status_code < 400 else "Upstream returned an error",
     )
+    if 200 <= resp.status_code < 300:
+        schedule.sync_schedule(order)
 
     return JsonResponse(data, status=resp.status_code)
 
@@ -265,9 +337,10 @@ def ratiba_callback(request):
     This endpoint is intentionally unauthenticated/CSRF-exempt so Safaricom can reach it.
     It updates the most relevant `RatibaOrder` record when possible.
 
-    Matching strategy:
+    Matching strategy (indexed columns only):
     - If query param `order_id=<uuid>` is present, update that order.
-    - Else, try to match by `AccountReference` in the callback payload.
+    - Else, match the upstream standing order id in the callback payload.
+    - Else, match the latest order with the callback's `AccountReference`.
     """
 
     if request.method != "POST":
@@ -287,14 +360,14 @@ def ratiba_callback(request):
         except ValueError:
             matched_order = None
 
+    standing_order_id = _extract_standing_order_id(payload)
+    if matched_order is None and standing_order_id:
+        matched_order = RatibaOrder.objects.filter(standing_order_id=standing_order_id).order_by("-created_at").first()
+
     if matched_order is None:
         account_ref = _extract_account_reference(payload)
         if account_ref:
-            matched_order = (
-                RatibaOrder.objects.filter(request_payload__AccountReference=account_ref)
-                .order_by("-created_at")
-                .first()
-            )
+            matched_order = RatibaOrder.objects.filter(account_reference=account_ref).order_by("-created_at").first()
 
     result_code = _extract_result_code(payload)
     result_desc = _extract_result_desc(payload)
@@ -318,6 +391,8 @@ def ratiba_callback(request):
     matched_order.callback_result_code = result_code
     matched_order.callback_result_description = result_desc
     matched_order.callback_payload = payload
+    if standing_order_id and not matched_order.standing_order_id:
+        matched_order.standing_order_id = standing_order_id
     if result_code is not None:
         apply_mapped_status(
             matched_order,
@@ -333,9 +408,11 @@ def ratiba_callback(request):
             "internal_status_code",
             "internal_status_message",
             "callback_payload",
+            "standing_order_id",
             "updated_at",
         ]
     )
+    schedule.record_callback(matched_order, result_code)
 
     return JsonResponse({"ResultCode": 0, "ResultDesc": "Accepted"}, status=200)
 
@@ -356,3 +433,43 @@ def ratiba_detail(request, order_id):
 
     order = get_object_or_404(RatibaOrder, id=order_id)
     return JsonResponse(_serialize_order(order, include_payloads=True), status=200)
+
+
+def _parse_day(value: str):
+    try:
+        return datetime.datetime.strptime(str(value).strip(), "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+@require_oauth2(scopes=["transactions:read"], message="Please sign in with a staff account to view forecasts.")
+def ratiba_forecast(request):
+    """Expected standing order inflows per business and per day.
+
+    Query params: date_from / date_to (YYYY-MM-DD, inclusive; default today and
+    the next 30 days), business_id. OAuth callers are scoped to their bound business.
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    token_obj = getattr(request, "oauth2_token", None)
+    provided_business_id = request.GET.get("business_id")
+    business = None
+    if token_obj is not None or provided_business_id:
+        business, error = resolve_business_from_request(request, provided_business_id)
+        if error:
+            return error
+
+    raw_from, raw_to = request.GET.get("date_from"), request.GET.get("date_to")
+    date_from = _parse_day(raw_from) if raw_from else timezone.localdate()
+    date_to = _parse_day(raw_to) if raw_to else (date_from + datetime.timedelta(days=30) if date_from else None)
+    if date_from is None or date_to is None:
+        return JsonResponse({"error": "Invalid date. Use YYYY-MM-DD."}, status=400)
+    if date_to < date_from:
+        return JsonResponse({"error": "date_to must not be before date_from"}, status=400)
+    if (date_to - date_from).days >= schedule.MAX_FORECAST_DAYS:
+        return JsonResponse({"error": f"Date range is limited to {schedule.MAX_FORECAST_DAYS} days"}, status=400)
+
+    data = schedule.forecast_inflows(date_from, date_to, business=business)
+    data["business_id"] = str(business.id) if business is not None else None
+    return JsonResponse(data, status=200)
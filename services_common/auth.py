@@ -1,6 +1,12 @@
+import hashlib
 import os
+from datetime import timedelta
 from functools import wraps
 
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
 from django.http import JsonResponse
 from django.utils import timezone
 
@@ -29,26 +35,169 @@ def _get_bearer_token(request) -> str:
     return ""
 
 
-def _get_oauth2_access_token(token: str):
-    """Return DOT AccessToken object if valid & unexpired, else None."""
+_OAUTH2_TOKEN_CACHE_PREFIX = "oauth2_token"
 
-    if not token:
+# Marker for "no cached binding lookup on this request" (None means "not bound").
+_UNRESOLVED = object()
+
+
+def oauth2_token_cache_key(token: str) -> str:
+    # Hash so raw bearer tokens never appear in cache keys.
+    return f"{_OAUTH2_TOKEN_CACHE_PREFIX}:{hashlib.sha256(token.encode('utf-8')).hexdigest()}"
+
+
+def invalidate_oauth2_tokens(tokens) -> None:
+    """Drop cached validations for the given raw token strings."""
+
+    keys = [oauth2_token_cache_key(t) for t in tokens if t]
+    if not keys:
+        return
+    try:
+        cache.delete_many(keys)
+    except Exception:
+        pass
+
+
+def _oauth2_token_cache_seconds() -> int:
+    try:
+        return max(int(getattr(settings, "OAUTH2_TOKEN_CACHE_SECONDS", 60)), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _mark_persisted(obj):
+    # Rebuilt from cache, but represents an existing row (safe to use in FK filters/assignments).
+    obj._state.adding = False
+    obj._state.db = router.db_for_read(type(obj))
+    return obj
+
+
+def _token_from_cache_entry(token: str, entry: dict):
+    from oauth2_provider.models import AccessToken, Application  # type: ignore
+
+    app = None
+    if entry.get("application_id") is not None:
+        app = _mark_persisted(
+            Application(
+                id=entry["application_id"],
+                client_id=entry.get("client_id") or "",
+                name=entry.get("application_name") or "",
+            )
+        )
+
+    token_obj = _mark_persisted(
+        AccessToken(
+            id=entry["id"],
+            token=token,
+            scope=entry.get("scope") or "",
+            expires=entry["expires"],
+            user_id=entry.get("user_id"),
+        )
+    )
+    token_obj.application = app
+    return token_obj
+
+
+def _load_bound_business(application_id):
+    if application_id is None:
         return None
+    try:
+        from business_api.models import OAuthClientBusiness
+
+        binding = OAuthClientBusiness.objects.select_related("business").filter(application_id=application_id).first()
+        return binding.business if binding else None
+    except Exception:
+        return None
+
+
+def _resolve_oauth2_token(token: str):
+    """Return (AccessToken, bound Business or None) if valid & unexpired, else (None, None).
+
+    Validations are cached for OAUTH2_TOKEN_CACHE_SECONDS (never past the token's
+    expiry) so authenticated calls skip both the AccessToken and the
+    OAuthClientBusiness lookups. `business_api.signals` drops entries when tokens
+    or bindings change.
+    """
+
+    if not token:
+        return None, None
 
     try:
         from oauth2_provider.models import AccessToken  # type: ignore
     except Exception:
-        return None
+        return None, None
+
+    now = timezone.now()
+    ttl = _oauth2_token_cache_seconds()
+    key = oauth2_token_cache_key(token)
+
+    if ttl:
+        try:
+            entry = cache.get(key)
+        except Exception:
+            entry = None
+        if isinstance(entry, dict) and entry.get("expires") and entry["expires"] > now:
+            return _token_from_cache_entry(token, entry), entry.get("business")
 
     try:
-        return (
+        token_obj = (
             AccessToken.objects.select_related("application")
-            .filter(token=token, expires__gt=timezone.now())
+            .filter(token=token, expires__gt=now)
             .first()
         )
     except Exception:
+        return None, None
+    if not token_obj:
+        return None, None
+
+    business = _load_bound_business(token_obj.application_id)
+
+    remaining = int((token_obj.expires - now) / timedelta(seconds=1))
+    timeout = min(ttl, remaining)
+    if timeout > 0:
+        app = token_obj.application
+        entry = {
+            "id": token_obj.id,
+            "scope": token_obj.scope or "",
+            "expires": token_obj.expires,
+            "user_id": token_obj.user_id,
+            "application_id": token_obj.application_id,
+            "client_id": getattr(app, "client_id", "") if app else "",
+            "application_name": getattr(app, "name", "") if app else "",
+            "business": business,
+        }
+        try:
+            cache.set(key, entry, timeout=timeout)
+        except Exception:
+            pass
+
+    return token_obj, business
+
+
+def _get_oauth2_access_token(token: str):
+    """Return DOT AccessToken object if valid & unexpired, else None."""
+
+    return _resolve_oauth2_token(token)[0]
+
+
+def get_bound_business(request):
+    """Business bound to the calling OAuth client, or None.
+
+    Uses the binding resolved (and cached) alongside the Bearer token when
+    available; falls back to a lookup otherwise.
+    """
+
+    token_obj = getattr(request, "oauth2_token", None)
+    app = getattr(request, "oauth2_application", None) if token_obj else None
+    if app is None:
         return None
 
+    business = getattr(request, "oauth2_business", _UNRESOLVED)
+    if business is _UNRESOLVED:
+        business = _load_bound_business(app.pk)
+        setattr(request, "oauth2_business", business)
+    return business
+
 
 def _token_scopes(token_obj) -> set[str]:
     raw = (getattr(token_obj, "scope", "") or "").strip()
@@ -68,38 +217,57 @@ def require_oauth2(view_func=None, *, scopes: str | list[str] | None = None, mes
 
     - By default, allows logged-in staff users (session auth) for dashboard usage.
     - Does NOT accept INTERNAL_API_KEY.
+    - Works on `async def` views too; the token/session lookups then run in a thread.
     """
 
     required_scopes = [scopes] if isinstance(scopes, str) else (list(scopes) if scopes else [])
 
-    def _decorator(func):
-        @wraps(func)
-        def _wrapped(request, *args, **kwargs):
-            if allow_staff:
-                user = getattr(request, "user", None)
-                if user and getattr(user, "is_authenticated", False) and getattr(user, "is_staff", False):
-                    return func(request, *args, **kwargs)
-
-            bearer = _get_bearer_token(request)
-            if not bearer:
-                return JsonResponse({"error": message or "Missing access token"}, status=401)
-
-            token_obj = _get_oauth2_access_token(bearer)
-            if not token_obj:
-                return JsonResponse({"error": message or "Invalid or expired access token"}, status=401)
+    def _authorize(request):
+        """Return an error response, or None after attaching the token to the request."""
 
-            if required_scopes and not _token_has_scopes(token_obj, required_scopes):
-                return JsonResponse({"error": "Insufficient scope"}, status=403)
-
-            # Make token/application available to downstream handlers.
-            # This enables deriving stable defaults (e.g., bound business) without
-            # forcing callers to resend identifiers on every request.
-            setattr(request, "oauth2_token", token_obj)
-            setattr(request, "oauth2_application", getattr(token_obj, "application", None))
-            setattr(request, "oauth2_scopes", _token_scopes(token_obj))
+        if allow_staff:
+            user = getattr(request, "user", None)
+            if user and getattr(user, "is_authenticated", False) and getattr(user, "is_staff", False):
+                return None
+
+        bearer = _get_bearer_token(request)
+        if not bearer:
+            return JsonResponse({"error": message or "Missing access token"}, status=401)
+
+        token_obj, business = _resolve_oauth2_token(bearer)
+        if not token_obj:
+            return JsonResponse({"error": message or "Invalid or expired access token"}, status=401)
+
+        if required_scopes and not _token_has_scopes(token_obj, required_scopes):
+            return JsonResponse({"error": "Insufficient scope"}, status=403)
+
+        # Make token/application available to downstream handlers.
+        # This enables deriving stable defaults (e.g., bound business) without
+        # forcing callers to resend identifiers on every request.
+        setattr(request, "oauth2_token", token_obj)
+        setattr(request, "oauth2_application", getattr(token_obj, "application", None))
+        setattr(request, "oauth2_scopes", _token_scopes(token_obj))
+        setattr(request, "oauth2_business", business)
+        return None
 
-            return func(request, *args, **kwargs)
+    def _decorator(func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def _wrapped(request, *args, **kwargs):
+                error = await sync_to_async(_authorize)(request)
+                if error is not None:
+                    return error
+                return await func(request, *args, **kwargs)
+        else:
+            @wraps(func)
+            def _wrapped(request, *args, **kwargs):
+                error = _authorize(request)
+                if error is not None:
+                    return error
+                return func(request, *args, **kwargs)
 
+        # Read by the rate-limit middleware to pick the per-scope quota.
+        _wrapped.oauth2_required_scopes = required_scopes
         return _wrapped
 
     return _decorator if view_func is None else _decorator(view_func)
@@ -0,0 +1,103 @@
+"""Building blocks for the bulk (B2C/B2B) batch executors.
+
+- `claim_queued` hands out queued rows with `SELECT ... FOR UPDATE SKIP LOCKED`
+  so several executor processes can drain the same table without overlap.
+- `run_bounded` fans work out to a bounded thread pool (inline when
+  concurrency is 1, which is also what SQLite needs).
+- `PerKeyRateLimiter` spaces out calls per key (e.g. per business) so one
+  large batch cannot exhaust a tenant's Daraja quota.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+
+ITEM_QUEUED = "queued"
+ITEM_PROCESSING = "processing"
+
+
+class PerKeyRateLimiter:
+    """Allow at most `rate_per_second` calls per key (process-local)."""
+
+    def __init__(self, rate_per_second: float):
+        self.interval = 1.0 / rate_per_second if rate_per_second and rate_per_second > 0 else 0.0
+        self._next_slot: dict[object, float] = {}
+        self._lock = threading.Lock()
+
+    def wait(self, key) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(key, now))
+            self._next_slot[key] = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def claim_queued(queryset, *, limit: int, queued: str = ITEM_QUEUED, claimed: str = ITEM_PROCESSING) -> list:
+    """Atomically move up to `limit` queued rows to `claimed` and return their pks.
+
+    Rows locked by another executor are skipped rather than waited on.
+    """
+
+    model = queryset.model
+    with transaction.atomic():
+        pks = list(
+            queryset.select_for_update(skip_locked=True)
+            .filter(status=queued)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:limit]
+        )
+        if pks:
+            model.objects.filter(pk__in=pks, status=queued).update(status=claimed, updated_at=timezone.now())
+    return pks
+
+
+def _call_in_worker(func: Callable, arg):
+    close_old_connections()
+    try:
+        return func(arg)
+    finally:
+        close_old_connections()
+
+
+def run_bounded(func: Callable, args: Iterable, *, concurrency: int) -> list:
+    """Run `func(arg)` for every arg with at most `concurrency` in flight; returns results in order."""
+
+    args = list(args)
+    if concurrency <= 1 or len(args) <= 1:
+        return [func(arg) for arg in args]
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(args)), thread_name_prefix="bulk-exec") as pool:
+        return list(pool.map(lambda arg: _call_in_worker(func, arg), args))
+
+
+def rollup_batch_status(counts: dict[str, int], *, pending: set[str], succeeded: set[str]) -> str:
+    """Derive a batch status from its item status counts.
+
+    queued -> processing -> completed | partially_completed | failed
+    """
+
+    total = sum(counts.values())
+    if total == 0:
+        return "queued"
+
+    pending_count = sum(n for status, n in counts.items() if status in pending)
+    if pending_count:
+        return "queued" if counts.get(ITEM_QUEUED, 0) == total else "processing"
+
+    succeeded_count = sum(n for status, n in counts.items() if status in succeeded)
+    if succeeded_count == total:
+        return "completed"
+    if succeeded_count == 0:
+        return "failed"
+    return "partially_completed"
@@ -0,0 +1,58 @@
+"""Content-addressed blob store for large binary payloads (QR images).
+
+Blobs are written once, under their SHA-256: `ab/cd/abcd...`. Rows keep only the
+digest and size, so identical images are stored once and table scans stay
+small. Reads open the blob lazily and can be streamed straight into a
+`FileResponse`.
+
+The backend is the Django storage configured as `STORAGES["blobs"]`. By default
+that is a `FileSystemStorage` under `BLOB_STORAGE_ROOT`. Any other Django
+storage backend (e.g. S3 via django-storages) plugs in there.
+"""
+
+from __future__ import annotations
+
+import hashlib
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+
+
+STORAGE_ALIAS = "blobs"
+
+
+def get_storage():
+    return storages[STORAGE_ALIAS]
+
+
+def blob_name(digest: str) -> str:
+    return f"{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+def put(data: bytes) -> tuple[str, int]:
+    """Store `data` unless an identical blob exists. Returns (sha256 hex digest, size)."""
+
+    digest = hashlib.sha256(data).hexdigest()
+    name = blob_name(digest)
+    storage = get_storage()
+    if not storage.exists(name):
+        saved = storage.save(name, ContentFile(data))
+        if saved != name:
+            # A concurrent writer stored the same content first; keep theirs.
+            storage.delete(saved)
+    return digest, len(data)
+
+
+def exists(digest: str) -> bool:
+    return bool(digest) and get_storage().exists(blob_name(digest))
+
+
+def open_blob(digest: str):
+    """Open a stored blob for reading (raises FileNotFoundError/OSError when missing)."""
+
+    return get_storage().open(blob_name(digest), "rb")
+
+
+def read(digest: str) -> bytes:
+    with open_blob(digest) as fh:
+        return fh.read()
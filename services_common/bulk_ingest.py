@@ -0,0 +1,152 @@
+"""Streaming ingestion for bulk batch uploads (B2C/B2B `bulk` endpoints).
+
+Accepted bodies:
+- `application/json`: `{"items": [...], ...batch fields}` (original format).
+- `application/x-ndjson` / `application/jsonl`: one item object per line.
+- `text/csv`: header row + one item per row.
+
+For NDJSON/CSV, batch fields (`reference`, `business_id`, ...) come from the
+query string and the body is read line by line, so a large payroll file never
+sits in memory as a whole. Rows are validated in a single pass and inserted with
+chunked `bulk_create`; the caller wraps everything in one transaction.
+"""
+
+from __future__ import annotations
+
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from typing import Callable, Iterable, Iterator
+
+from django.conf import settings
+
+from services_common.http import json_body
+
+
+NDJSON_CONTENT_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines"}
+CSV_CONTENT_TYPES = {"text/csv", "application/csv"}
+
+
+# Bulk item `amount` columns are DecimalField(max_digits=12, decimal_places=2).
+MAX_ITEM_AMOUNT = Decimal("1e10")
+
+
+class BulkUploadError(ValueError):
+    """The upload as a whole is unusable (bad format / missing items)."""
+
+
+def _content_type(request) -> str:
+    return (request.content_type or "").split(";")[0].strip().lower()
+
+
+def _iter_lines(request) -> Iterator[str]:
+    for raw in request:
+        yield raw.decode("utf-8-sig") if isinstance(raw, bytes) else raw
+
+
+def _iter_ndjson(request) -> Iterator[object]:
+    for line in _iter_lines(request):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # Surfaced as a per-row rejection by the caller.
+            yield None
+
+
+def _iter_csv(request) -> Iterator[dict]:
+    reader = csv.DictReader(_iter_lines(request))
+    for row in reader:
+        yield {str(k or "").strip(): (v.strip() if isinstance(v, str) else v) for k, v in row.items()}
+
+
+def read_bulk_upload(request) -> tuple[dict, Iterable]:
+    """Return `(batch_fields, rows)` for a bulk upload.
+
+    `rows` is a lazy iterator for NDJSON/CSV bodies.
+    """
+
+    content_type = _content_type(request)
+    if content_type in NDJSON_CONTENT_TYPES:
+        return request.GET.dict(), _iter_ndjson(request)
+    if content_type in CSV_CONTENT_TYPES:
+        return request.GET.dict(), _iter_csv(request)
+
+    body = json_body(request)
+    if not isinstance(body, dict):
+        body = {}
+    items = body.get("items")
+    if not isinstance(items, list) or len(items) == 0:
+        raise BulkUploadError("items must be a non-empty list")
+    return {k: v for k, v in body.items() if k not in {"items"}}, items
+
+
+def parse_item_amount(value) -> tuple[Decimal | None, str | None]:
+    """Validate a bulk item amount; returns `(amount, None)` or `(None, reason)`."""
+
+    try:
+        amount = Decimal(str(value).strip())
+    except (InvalidOperation, TypeError):
+        return None, "amount must be a number"
+    if not amount.is_finite() or amount <= 0:
+        return None, "amount must be > 0"
+    if amount >= MAX_ITEM_AMOUNT:
+        return None, "amount is too large"
+    if amount != amount.quantize(Decimal("0.01")):
+        return None, "amount must have at most 2 decimal places"
+    return amount, None
+
+
+def _setting_int(name: str, default: int) -> int:
+    try:
+        return max(int(getattr(settings, name, default)), 1)
+    except (TypeError, ValueError):
+        return default
+
+
+def ingest_rows(
+    rows: Iterable,
+    *,
+    parse_row: Callable[[object], tuple[dict | None, str | None]],
+    build: Callable[[dict], object],
+    model,
+    chunk_size: int | None = None,
+) -> tuple[int, int, list[dict]]:
+    """Validate rows and bulk insert the good ones in chunks.
+
+    `parse_row(raw)` returns `(fields, None)` or `(None, reason)`; `build(fields)`
+    returns an unsaved model instance. Call inside `transaction.atomic()`.
+
+    Returns `(accepted, rejected, rejections)`; rejections carry the 1-based row
+    number and reason, capped at BULK_INGEST_MAX_REJECTIONS entries.
+    """
+
+    chunk_size = chunk_size or _setting_int("BULK_INGEST_CHUNK_SIZE", 1000)
+    max_rejections = _setting_int("BULK_INGEST_MAX_REJECTIONS", 1000)
+
+    accepted = 0
+    rejected = 0
+    rejections: list[dict] = []
+    pending: list = []
+
+    for row_number, raw in enumerate(rows, start=1):
+        fields, reason = parse_row(raw) if isinstance(raw, dict) else (None, "row must be an object")
+        if fields is None:
+            rejected += 1
+            if len(rejections) < max_rejections:
+                rejections.append({"row": row_number, "error": reason or "invalid row"})
+            continue
+
+        pending.append(build(fields))
+        if len(pending) >= chunk_size:
+            model.objects.bulk_create(pending, batch_size=chunk_size)
+            accepted += len(pending)
+            pending = []
+
+    if pending:
+        model.objects.bulk_create(pending, batch_size=chunk_size)
+        accepted += len(pending)
+
+    return accepted, rejected, rejections
@@ -0,0 +1,189 @@
+"""Deduplication of redelivered Safaricom callbacks.
+
+Safaricom redelivers STK callbacks, C2B confirmations and result callbacks when
+it misses our ack. Each delivery is identified by its natural key (CheckoutRequestID
+and ResultCode, TransID, OriginatorConversationID or requestId) plus a SHA-256 of
+the canonical JSON body, so a genuinely different callback for the same key (e.g.
+a later result) is still applied.
+
+Two layers answer "seen before?":
+
+- the Django cache, checked first. A hit short-circuits in O(1) without a query.
+  Entries are only written after the applying transaction commits, so the cache
+  never claims a callback that was rolled back.
+- `CallbackReceipt`'s unique constraint, which is authoritative. The receipt is
+  inserted in the same transaction as the handler's writes (the insert runs in
+  a savepoint; an IntegrityError means another delivery already claimed it).
+  If the handler raises or answers >= 400, or the worker dies before commit,
+  the receipt is rolled back with everything else, so Safaricom's next retry
+  is applied normally.
+
+Receipts only need to outlive Safaricom's redelivery window. `prune_receipts()`
+(`manage.py prune_callback_receipts`, run daily) deletes those older than
+`CALLBACK_RECEIPT_RETENTION_DAYS`.
+"""
+
+from __future__ import annotations
+
+import functools
+import hashlib
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.utils import timezone
+
+from mpesa_api.models import CallbackInbox, CallbackReceipt
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = "callback_seen"
+
+
+def _stk_key(body: dict) -> str:
+    data = body.get("Body", {}).get("stkCallback") if isinstance(body.get("Body"), dict) else None
+    if not isinstance(data, dict):
+        data = body
+    checkout_request_id = str(data.get("CheckoutRequestID") or "").strip()
+    if not checkout_request_id:
+        return ""
+    return f"{checkout_request_id}:{data.get('ResultCode')}"
+
+
+def _confirmation_key(body: dict) -> str:
+    return str(body.get("TransID") or "").strip()
+
+
+def _result_key(body: dict) -> str:
+    result = body.get("Result") if isinstance(body.get("Result"), dict) else {}
+    return str(result.get("OriginatorConversationID") or body.get("OriginatorConversationID") or "").strip()
+
+
+def _b2b_key(body: dict) -> str:
+    return str(body.get("requestId") or body.get("RequestRefID") or "").strip()
+
+
+NATURAL_KEYS = {
+    CallbackInbox.KIND_STK_CALLBACK: _stk_key,
+    CallbackInbox.KIND_C2B_CONFIRMATION: _confirmation_key,
+    CallbackInbox.KIND_TRANSACTION_STATUS_RESULT: _result_key,
+    CallbackInbox.KIND_B2C_RESULT: _result_key,
+    CallbackInbox.KIND_B2B_RESULT: _b2b_key,
+}
+
+
+def _cache_seconds() -> int:
+    try:
+        return max(int(getattr(settings, "CALLBACK_DEDUP_CACHE_SECONDS", 86400)), 0)
+    except (TypeError, ValueError):
+        return 86400
+
+
+def _retention_days() -> int:
+    try:
+        return max(int(getattr(settings, "CALLBACK_RECEIPT_RETENTION_DAYS", 30)), 0)
+    except (TypeError, ValueError):
+        return 30
+
+
+def content_hash(body: dict) -> str:
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def fingerprint(kind: str, body) -> tuple[str, str] | None:
+    """`(natural_key, content_hash)` for a callback body, or None if it cannot be keyed."""
+
+    key_func = NATURAL_KEYS.get(kind)
+    if key_func is None or not isinstance(body, dict):
+        return None
+    natural_key = key_func(body)
+    if not natural_key:
+        return None
+    return natural_key[:200], content_hash(body)
+
+
+def _cache_key(kind: str, natural_key: str, digest: str) -> str:
+    token = hashlib.sha256(f"{kind}\0{natural_key}\0{digest}".encode("utf-8")).hexdigest()
+    return f"{CACHE_PREFIX}:{token}"
+
+
+def seen_recently(kind: str, body) -> bool:
+    """Cache-only check, cheap enough for the fast-ack path."""
+
+    fp = fingerprint(kind, body)
+    if fp is None or not _cache_seconds():
+        return False
+    try:
+        return bool(cache.get(_cache_key(kind, *fp)))
+    except Exception:
+        return False
+
+
+def _remember(kind: str, natural_key: str, digest: str) -> None:
+    seconds = _cache_seconds()
+    if not seconds:
+        return
+    try:
+        cache.set(_cache_key(kind, natural_key, digest), 1, seconds)
+    except Exception:
+        logger.warning("Failed to cache callback receipt for %s %s", kind, natural_key)
+
+
+def prune_receipts(*, older_than_days: int | None = None, batch_size: int = 5000) -> int:
+    """Delete receipts older than the retention window, in batches. Returns rows deleted (0 = disabled)."""
+
+    days = _retention_days() if older_than_days is None else max(int(older_than_days), 0)
+    if not days:
+        return 0
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted = 0
+    while True:
+        ids = list(CallbackReceipt.objects.filter(created_at__lt=cutoff).order_by().values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += CallbackReceipt.objects.filter(id__in=ids).delete()[0]
+
+
+def duplicate_response() -> JsonResponse:
+    return JsonResponse({"ok": True, "ResultCode": 0, "ResultDesc": "Duplicate callback ignored", "duplicate": True})
+
+
+def deduplicated(kind: str):
+    """Decorate an `apply_*` callback handler so each distinct callback is applied once."""
+
+    def decorator(apply):
+        @functools.wraps(apply)
+        def wrapper(body, **kwargs):
+            fp = fingerprint(kind, body)
+            if fp is None:
+                return apply(body, **kwargs)
+            natural_key, digest = fp
+
+            if seen_recently(kind, body):
+                return duplicate_response()
+
+            with transaction.atomic():
+                try:
+                    with transaction.atomic():
+                        CallbackReceipt.objects.create(kind=kind, natural_key=natural_key, content_hash=digest)
+                except IntegrityError:
+                    _remember(kind, natural_key, digest)
+                    return duplicate_response()
+
+                # An exception propagates out of the block and rolls the receipt back.
+                response = apply(body, **kwargs)
+                if response.status_code >= 400:
+                    transaction.set_rollback(True)
+                else:
+                    transaction.on_commit(lambda: _remember(kind, natural_key, digest))
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,143 @@
+"""Fast-ack ingestion for Safaricom callbacks.
+
+With `CALLBACK_FAST_ACK` on, the result callbacks (STK, C2B confirmation,
+transaction status, B2C and B2B results) store the raw payload in
+`CallbackInbox` with a single INSERT and answer `ResultCode 0` straight away.
+Safaricom never waits on our own queries.
+
+`python manage.py process_callback_inbox` then claims pending rows in id order
+and applies each one through the same handler the synchronous path uses. The
+handlers are idempotent (payments are upserted on their correlation keys), so a
+row replayed after a crash does no harm.
+"""
+
+from __future__ import annotations
+
+import ipaddress
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.http import JsonResponse
+from django.utils import timezone
+
+from mpesa_api.models import CallbackInbox
+from services_common.batching import claim_queued
+from services_common.callback_dedup import seen_recently
+from services_common.http import json_body
+
+
+logger = logging.getLogger(__name__)
+
+
+def fast_ack_enabled() -> bool:
+    return bool(getattr(settings, "CALLBACK_FAST_ACK", False))
+
+
+def _remote_addr(request) -> str | None:
+    value = str(request.META.get("REMOTE_ADDR") or "").strip()
+    try:
+        return str(ipaddress.ip_address(value))
+    except ValueError:
+        return None
+
+
+def fast_ack(request, kind: str) -> JsonResponse | None:
+    """Store the callback and return the ack, or None to process it synchronously.
+
+    Bodies that are not a JSON object go through the normal path so the caller
+    still gets the usual validation error.
+    """
+
+    if not fast_ack_enabled():
+        return None
+    body = json_body(request)
+    if not isinstance(body, dict) or not body:
+        return None
+    if seen_recently(kind, body):
+        # Known redelivery: ack without queueing it again.
+        return JsonResponse({"ResultCode": 0, "ResultDesc": "Accepted"})
+
+    CallbackInbox.objects.create(kind=kind, payload=body, remote_addr=_remote_addr(request))
+    return JsonResponse({"ResultCode": 0, "ResultDesc": "Accepted"})
+
+
+def _handlers() -> dict:
+    from b2b_api.views import apply_callback_result as apply_b2b_result
+    from b2c_api.views import apply_callback_result as apply_b2c_result
+    from c2b_api.views import apply_confirmation, apply_stk_callback, apply_transaction_status_result
+
+    return {
+        CallbackInbox.KIND_STK_CALLBACK: apply_stk_callback,
+        CallbackInbox.KIND_C2B_CONFIRMATION: apply_confirmation,
+        CallbackInbox.KIND_TRANSACTION_STATUS_RESULT: apply_transaction_status_result,
+        CallbackInbox.KIND_B2C_RESULT: apply_b2c_result,
+        CallbackInbox.KIND_B2B_RESULT: apply_b2b_result,
+    }
+
+
+def _max_attempts() -> int:
+    try:
+        return max(int(getattr(settings, "CALLBACK_INBOX_MAX_ATTEMPTS", 5)), 1)
+    except (TypeError, ValueError):
+        return 5
+
+
+def process_entry(entry_id, *, handlers: dict | None = None) -> str:
+    """Apply one claimed inbox row. Returns its new status."""
+
+    handlers = handlers or _handlers()
+    entry = CallbackInbox.objects.get(id=entry_id)
+    if entry.status != CallbackInbox.STATUS_PROCESSING:
+        return entry.status
+
+    error = ""
+    try:
+        handler = handlers.get(entry.kind)
+        if handler is None:
+            raise ValueError(f"Unknown callback kind: {entry.kind}")
+        with transaction.atomic():
+            response = handler(entry.payload, remote_addr=entry.remote_addr)
+        if response.status_code >= 500:
+            error = response.content.decode("utf-8", errors="replace")
+        elif response.status_code >= 400:
+            # Not retryable (e.g. unknown request id); keep the reason for operators.
+            entry.last_error = response.content.decode("utf-8", errors="replace")[:2000]
+    except Exception as e:
+        logger.exception("Callback inbox entry %s failed", entry_id)
+        error = str(e) or e.__class__.__name__
+
+    entry.attempts += 1
+    if error:
+        entry.last_error = error[:2000]
+        entry.status = CallbackInbox.STATUS_FAILED if entry.attempts >= _max_attempts() else CallbackInbox.STATUS_PENDING
+    else:
+        entry.status = CallbackInbox.STATUS_PROCESSED
+        entry.processed_at = timezone.now()
+    entry.save(update_fields=["attempts", "last_error", "status", "processed_at", "updated_at"])
+    return entry.status
+
+
+def process_pending(*, limit: int = 200) -> int:
+    """Claim up to `limit` pending rows (oldest first) and apply them. Returns how many were claimed."""
+
+    entry_ids = claim_queued(
+        CallbackInbox.objects.all(),
+        limit=limit,
+        queued=CallbackInbox.STATUS_PENDING,
+        claimed=CallbackInbox.STATUS_PROCESSING,
+    )
+    handlers = _handlers()
+    for entry_id in entry_ids:
+        process_entry(entry_id, handlers=handlers)
+    return len(entry_ids)
+
+
+def requeue_stale(*, older_than_seconds: int) -> int:
+    """Return `processing` rows abandoned by a crashed worker to the queue."""
+
+    cutoff = timezone.now() - timedelta(seconds=older_than_seconds)
+    return CallbackInbox.objects.filter(status=CallbackInbox.STATUS_PROCESSING, updated_at__lt=cutoff).update(
+        status=CallbackInbox.STATUS_PENDING, updated_at=timezone.now()
+    )
@@ -0,0 +1,226 @@
+"""Per-endpoint circuit breaker and adaptive concurrency limit for Daraja calls.
+
+Every `outbound.request()` goes through the guard of its upstream endpoint,
+keyed by scheme, host and path. The host tells sandbox and production apart,
+so the key is per endpoint and environment. Each guard:
+
+- records outcomes over the last `UPSTREAM_BREAKER_WINDOW_SECONDS`. Transport
+  errors, 5xx/429 responses and calls slower than `UPSTREAM_BREAKER_SLOW_CALL_SECONDS`
+  count as failures. Once at least `UPSTREAM_BREAKER_MIN_REQUESTS` calls were
+  seen and the failure rate reaches `UPSTREAM_BREAKER_ERROR_RATE`, the circuit
+  opens. While open, calls fail immediately for `UPSTREAM_BREAKER_OPEN_SECONDS`.
+  After that a single probe is let through: success closes the circuit, failure
+  re-opens it.
+- caps in-flight calls with an AIMD limit. The limit grows by 1/limit per good
+  call and halves on a failure, between `UPSTREAM_CONCURRENCY_MIN` and
+  `UPSTREAM_CONCURRENCY_MAX`. Calls over the limit fail immediately instead of
+  queueing on a degraded upstream.
+
+Rejected calls raise `UpstreamUnavailable`, a `requests.RequestException`, so
+existing error handling still applies. Views that want the dedicated answer
+return `unavailable_response()`: a 503 with the mapped gateway status code and
+Retry-After. State is per process, on purpose: the breaker protects this
+worker's own capacity.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from django.http import JsonResponse
+
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+REASON_CIRCUIT_OPEN = "CIRCUIT_OPEN"
+REASON_CONCURRENCY_LIMIT = "CONCURRENCY_LIMIT"
+
+
+class UpstreamUnavailable(requests.RequestException):
+    def __init__(self, endpoint: str, reason: str, retry_after: int = 1):
+        super().__init__(f"Upstream unavailable ({reason}): {endpoint}")
+        self.endpoint = endpoint
+        self.reason = reason
+        self.retry_after = max(int(retry_after), 1)
+
+
+def _setting(name: str, default):
+    value = getattr(settings, name, default)
+    return default if value is None else value
+
+
+def enabled() -> bool:
+    return bool(_setting("UPSTREAM_BREAKER_ENABLED", True))
+
+
+def endpoint_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}{parts.path}"
+
+
+def is_failure(response=None, error: BaseException | None = None) -> bool:
+    if error is not None:
+        return True
+    status = getattr(response, "status_code", None)
+    return isinstance(status, int) and (status >= 500 or status == 429)
+
+
+class EndpointGuard:
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.window_seconds = float(_setting("UPSTREAM_BREAKER_WINDOW_SECONDS", 30))
+        self.min_requests = int(_setting("UPSTREAM_BREAKER_MIN_REQUESTS", 10))
+        self.error_rate = float(_setting("UPSTREAM_BREAKER_ERROR_RATE", 0.5))
+        self.slow_call_seconds = float(_setting("UPSTREAM_BREAKER_SLOW_CALL_SECONDS", 10))
+        self.open_seconds = float(_setting("UPSTREAM_BREAKER_OPEN_SECONDS", 30))
+        self.min_limit = max(int(_setting("UPSTREAM_CONCURRENCY_MIN", 2)), 1)
+        self.max_limit = max(int(_setting("UPSTREAM_CONCURRENCY_MAX", 64)), self.min_limit)
+
+        self.state = STATE_CLOSED
+        self.opened_at = 0.0
+        self.limit = float(min(max(int(_setting("UPSTREAM_CONCURRENCY_INITIAL", 16)), self.min_limit), self.max_limit))
+        self.in_flight = 0
+        self._probing = False
+        self._outcomes: deque[tuple[float, bool]] = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        """Reserve a slot or raise UpstreamUnavailable. Returns True for a half-open probe."""
+
+        now = time.monotonic()
+        with self._lock:
+            probe = False
+            if self.state == STATE_OPEN:
+                remaining = self.opened_at + self.open_seconds - now
+                if remaining > 0:
+                    raise UpstreamUnavailable(self.endpoint, REASON_CIRCUIT_OPEN, math.ceil(remaining))
+                self.state = STATE_HALF_OPEN
+            if self.state == STATE_HALF_OPEN:
+                if self._probing:
+                    raise UpstreamUnavailable(self.endpoint, REASON_CIRCUIT_OPEN, 1)
+                self._probing = probe = True
+            elif self.in_flight >= int(self.limit):
+                raise UpstreamUnavailable(self.endpoint, REASON_CONCURRENCY_LIMIT, 1)
+            self.in_flight += 1
+            return probe
+
+    def release(self, *, failed: bool, elapsed: float, probe: bool = False) -> None:
+        now = time.monotonic()
+        failed = failed or elapsed >= self.slow_call_seconds
+        with self._lock:
+            self.in_flight = max(self.in_flight - 1, 0)
+
+            if failed:
+                self.limit = max(self.min_limit, self.limit / 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            if probe:
+                self._probing = False
+                self._outcomes.clear()
+                if failed:
+                    self._open(now)
+                else:
+                    self.state = STATE_CLOSED
+                return
+
+            self._outcomes.append((now, failed))
+            cutoff = now - self.window_seconds
+            while self._outcomes and self._outcomes[0][0] < cutoff:
+                self._outcomes.popleft()
+
+            if self.state == STATE_CLOSED and len(self._outcomes) >= self.min_requests:
+                failures = sum(1 for _, f in self._outcomes if f)
+                if failures / len(self._outcomes) >= self.error_rate:
+                    self._open(now)
+
+    def _open(self, now: float) -> None:
+        self.state = STATE_OPEN
+        self.opened_at = now
+        self._outcomes.clear()
+
+
+_guards: dict[str, EndpointGuard] = {}
+_guards_lock = threading.Lock()
+
+
+def guard_for(url: str) -> EndpointGuard:
+    key = endpoint_key(url)
+    guard = _guards.get(key)
+    if guard is None:
+        with _guards_lock:
+            guard = _guards.setdefault(key, EndpointGuard(key))
+    return guard
+
+
+def reset_guards() -> None:
+    """Forget all breaker state (tests, or after changing breaker settings)."""
+
+    with _guards_lock:
+        _guards.clear()
+
+
+def call(url: str, send):
+    """Run `send()` (which performs the HTTP call) under the endpoint's guard."""
+
+    if not enabled():
+        return send()
+
+    guard = guard_for(url)
+    probe = guard.acquire()
+    started = time.monotonic()
+    response = None
+    try:
+        response = send()
+        return response
+    finally:
+        # Also runs on BaseException (cancellation, SystemExit): no response counts as a failure.
+        guard.release(failed=response is None or is_failure(response), elapsed=time.monotonic() - started, probe=probe)
+
+
+async def acall(url: str, send):
+    """Async `call()`: await `send()` under the endpoint's guard."""
+
+    if not enabled():
+        return await send()
+
+    guard = guard_for(url)
+    probe = guard.acquire()
+    started = time.monotonic()
+    response = None
+    try:
+        response = await send()
+        return response
+    finally:
+        # A client disconnect cancels the view with CancelledError; the slot and probe must still be released.
+        guard.release(failed=response is None or is_failure(response), elapsed=time.monotonic() - started, probe=probe)
+
+
+def unavailable_body(exc: UpstreamUnavailable) -> dict:
+    from services_common.status_codes import map_status
+
+    mapped = map_status(
+        external_system="gateway",
+        external_code=exc.reason,
+        default_message="Upstream temporarily unavailable",
+    )
+    return {
+        "error": "Upstream temporarily unavailable",
+        "status_code": mapped.status_code,
+        "status_message": mapped.status_message,
+        "retry_after": exc.retry_after,
+    }
+
+
+def unavailable_response(exc: UpstreamUnavailable) -> JsonResponse:
+    response = JsonResponse(unavailable_body(exc), status=503)
+    response["Retry-After"] = str(exc.retry_after)
+    return response
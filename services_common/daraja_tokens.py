@@ -0,0 +1,166 @@
+"""Process-wide Daraja OAuth access-token cache.
+
+Safaricom access tokens are valid for ~1 hour (`expires_in`), yet every
+outbound call used to fetch a fresh one. Tokens are now cached in two tiers:
+
+- a per-process dict (no I/O on the hot path), and
+- the Django cache, so gunicorn workers share a single token per credential.
+
+Tokens are refreshed `DARAJA_TOKEN_REFRESH_MARGIN_SECONDS` before they expire.
+Refreshes are single-flight: a process-local lock serialises threads, and a
+short-lived `cache.add` lock stops concurrent workers from stampeding the
+token endpoint when a token expires under load.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from typing import Callable
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+_CACHE_PREFIX = "daraja_token"
+
+# Used when Daraja omits or garbles `expires_in`.
+_DEFAULT_EXPIRES_IN = 3599
+
+_local_tokens: dict[str, tuple[str, float]] = {}
+_local_locks: dict[str, threading.Lock] = {}
+_local_locks_guard = threading.Lock()
+
+
+def _setting_int(name: str, default: int) -> int:
+    try:
+        return int(getattr(settings, name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def token_cache_key(*, environment: str, credential_id=None, consumer_key: str = "", token_url: str = "") -> str:
+    """Build the cache key for a credential.
+
+    DB-backed credentials are keyed by id, env credentials by "env". Both include
+    a hash of (consumer_key, token_url) so rotated keys get a fresh token and
+    secrets never end up in cache keys.
+    """
+
+    env = str(environment or "default").strip().lower() or "default"
+    owner = f"cred:{credential_id}" if credential_id is not None else "env"
+    digest = hashlib.sha256(f"{consumer_key}|{token_url}".encode("utf-8")).hexdigest()[:32]
+    return f"{_CACHE_PREFIX}:{env}:{owner}:{digest}"
+
+
+def _parse_expires_in(value) -> int:
+    try:
+        seconds = int(float(str(value).strip()))
+    except (TypeError, ValueError):
+        return _DEFAULT_EXPIRES_IN
+    return seconds if seconds > 0 else _DEFAULT_EXPIRES_IN
+
+
+def _lock_for(key: str) -> threading.Lock:
+    with _local_locks_guard:
+        lock = _local_locks.get(key)
+        if lock is None:
+            lock = threading.Lock()
+            _local_locks[key] = lock
+        return lock
+
+
+def _read_fresh(key: str, now: float) -> str | None:
+    entry = _local_tokens.get(key)
+    if entry and entry[1] > now:
+        return entry[0]
+
+    try:
+        shared = cache.get(key)
+    except Exception:
+        shared = None
+    if isinstance(shared, dict):
+        token = shared.get("token")
+        refresh_at = float(shared.get("refresh_at") or 0)
+        if token and refresh_at > now:
+            _local_tokens[key] = (str(token), refresh_at)
+            return str(token)
+    return None
+
+
+def _store(key: str, token: str, expires_in: int, now: float) -> None:
+    margin = max(_setting_int("DARAJA_TOKEN_REFRESH_MARGIN_SECONDS", 60), 0)
+    # Never cache for less than a few seconds, even with a tiny expires_in.
+    ttl = max(expires_in - margin, min(expires_in, 5))
+    refresh_at = now + ttl
+    _local_tokens[key] = (token, refresh_at)
+    try:
+        cache.set(key, {"token": token, "refresh_at": refresh_at}, timeout=int(ttl) + 1)
+    except Exception:
+        pass
+
+
+def get_access_token(key: str, fetch: Callable[[], tuple[str | None, object]]) -> str | None:
+    """Return a cached token for `key`, calling `fetch()` only when needed.
+
+    `fetch` performs the OAuth round-trip and returns `(token, expires_in)`.
+    Exceptions raised by `fetch` propagate; a falsy token is never cached.
+    """
+
+    now = time.time()
+    token = _read_fresh(key, now)
+    if token:
+        return token
+
+    with _lock_for(key):
+        # Another thread in this process may have refreshed while we waited.
+        now = time.time()
+        token = _read_fresh(key, now)
+        if token:
+            return token
+
+        lock_key = f"{key}:lock"
+        lock_timeout = max(_setting_int("DARAJA_TOKEN_LOCK_SECONDS", 10), 1)
+        try:
+            have_lock = bool(cache.add(lock_key, 1, timeout=lock_timeout))
+        except Exception:
+            have_lock = True
+
+        if not have_lock:
+            # Another worker is refreshing: wait briefly for it to publish.
+            deadline = time.time() + lock_timeout
+            while time.time() < deadline:
+                time.sleep(0.05)
+                token = _read_fresh(key, time.time())
+                if token:
+                    return token
+            # The other worker died or is slow; fall through and fetch ourselves.
+
+        try:
+            token, expires_in = fetch()
+            if token:
+                _store(key, str(token), _parse_expires_in(expires_in), time.time())
+            return str(token) if token else None
+        finally:
+            if have_lock:
+                try:
+                    cache.delete(lock_key)
+                except Exception:
+                    pass
+
+
+def invalidate_access_token(key: str) -> None:
+    """Drop a cached token (e.g. after Daraja rejects it with 401)."""
+
+    _local_tokens.pop(key, None)
+    try:
+        cache.delete(key)
+    except Exception:
+        pass
+
+
+def clear_local_tokens() -> None:
+    """Forget all per-process tokens (the shared cache is left untouched)."""
+
+    _local_tokens.clear()
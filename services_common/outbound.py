@@ -0,0 +1,178 @@
+"""Shared outbound HTTP client for Daraja calls.
+
+All upstream calls go through one process-wide `requests.Session` so TCP/TLS
+connections to api.safaricom.co.ke are kept alive and reused instead of being
+re-established on every request. urllib3 keeps a separate pool per host.
+
+Tunables (see settings.py):
+- OUTBOUND_HTTP_POOL_CONNECTIONS: number of per-host pools kept around.
+- OUTBOUND_HTTP_POOL_MAXSIZE: max keep-alive connections per host.
+- OUTBOUND_HTTP_POOL_BLOCK: block (instead of opening extra sockets) when a pool is exhausted.
+- OUTBOUND_HTTP_CONNECT_TIMEOUT_SECONDS / OUTBOUND_HTTP_READ_TIMEOUT_SECONDS.
+
+Each call also passes through the per-endpoint circuit breaker and adaptive
+concurrency limit in `services_common.circuit_breaker` (UPSTREAM_BREAKER_*,
+UPSTREAM_CONCURRENCY_*). A rejected call raises `UpstreamUnavailable`.
+
+Async views (`ASYNC_VIEWS_ENABLED`) use `arequest()`/`apost()` instead. These
+go through an `httpx.AsyncClient`, one per event loop, with the same timeouts,
+cookie policy and breaker. One ASGI worker can then keep many Daraja calls in
+flight without holding a thread for each. `OUTBOUND_ASYNC_MAX_CONNECTIONS` caps
+its sockets. Transport errors are re-raised as the matching `requests`
+exceptions, so callers handle both clients the same way. `Mpesa.asgi` closes
+the client on ASGI lifespan shutdown via `areset_client()`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import weakref
+from http.cookiejar import DefaultCookiePolicy
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from services_common import circuit_breaker
+
+
+UpstreamUnavailable = circuit_breaker.UpstreamUnavailable
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+_async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _setting(name: str, default):
+    value = getattr(settings, name, default)
+    return default if value is None else value
+
+
+def default_timeout() -> tuple[float, float]:
+    """(connect, read) timeout used when a caller does not pass one."""
+
+    return (
+        float(_setting("OUTBOUND_HTTP_CONNECT_TIMEOUT_SECONDS", 5)),
+        float(_setting("OUTBOUND_HTTP_READ_TIMEOUT_SECONDS", 30)),
+    )
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    # Upstream cookies must never leak between tenants sharing the session.
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+    adapter = HTTPAdapter(
+        pool_connections=int(_setting("OUTBOUND_HTTP_POOL_CONNECTIONS", 10)),
+        pool_maxsize=int(_setting("OUTBOUND_HTTP_POOL_MAXSIZE", 20)),
+        pool_block=bool(_setting("OUTBOUND_HTTP_POOL_BLOCK", False)),
+        # Payment calls are not idempotent; never retry implicitly.
+        max_retries=0,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def reset_session() -> None:
+    """Close pooled connections (e.g. after changing pool settings or forking)."""
+
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def _resolve_timeout(timeout) -> tuple[float, float]:
+    connect_timeout, read_timeout = default_timeout()
+    if timeout is None:
+        return (connect_timeout, read_timeout)
+    if not isinstance(timeout, tuple):
+        return (min(connect_timeout, float(timeout)), float(timeout))
+    return timeout
+
+
+def request(method: str, url: str, *, timeout=None, **kwargs) -> requests.Response:
+    """Send a request through the pooled session and the endpoint's circuit breaker.
+
+    `timeout` may be a number (applied as the read timeout) or a (connect, read)
+    tuple; it defaults to `default_timeout()`.
+    """
+
+    timeout = _resolve_timeout(timeout)
+    return circuit_breaker.call(url, lambda: get_session().request(method, url, timeout=timeout, **kwargs))
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def _build_async_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=int(_setting("OUTBOUND_ASYNC_MAX_CONNECTIONS", 100)),
+        max_keepalive_connections=int(_setting("OUTBOUND_HTTP_POOL_MAXSIZE", 20)),
+    )
+    client = httpx.AsyncClient(limits=limits)
+    client.cookies.jar.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """The async client of the running event loop (connection pools are loop-bound)."""
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = _build_async_client()
+    return client
+
+
+async def areset_client() -> None:
+    """Close the running loop's async client."""
+
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def arequest(method: str, url: str, *, timeout=None, **kwargs) -> httpx.Response:
+    """Async counterpart of `request()`; same timeout handling and circuit breaker."""
+
+    connect_timeout, read_timeout = _resolve_timeout(timeout)
+    client = get_async_client()
+
+    async def _send():
+        try:
+            return await client.request(
+                method, url, timeout=httpx.Timeout(read_timeout, connect=connect_timeout), **kwargs
+            )
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(str(e)) from e
+
+    return await circuit_breaker.acall(url, _send)
+
+
+async def aget(url: str, **kwargs) -> httpx.Response:
+    return await arequest("GET", url, **kwargs)
+
+
+async def apost(url: str, **kwargs) -> httpx.Response:
+    return await arequest("POST", url, **kwargs)
@@ -0,0 +1,79 @@
+"""Keyset (cursor) pagination and NDJSON streaming for large list endpoints.
+
+Pages are ordered newest first on `(created_at, id)` and the cursor encodes the
+last row of the previous page, so fetching page N costs the same as page 1 (no
+OFFSET scan) and rows inserted meanwhile do not shift pages.
+
+`ndjson_response` streams every matching row from a server-side cursor
+(`QuerySet.iterator`), keeping memory flat regardless of table size.
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+
+
+STREAM_CHUNK_SIZE = 2000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, pk) -> str:
+    raw = json.dumps([created_at.isoformat(), pk], cls=DjangoJSONEncoder)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(value: str):
+    try:
+        padded = value + "=" * (-len(value) % 4)
+        created_at_raw, pk = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+        created_at = parse_datetime(created_at_raw)
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+    if created_at is None or pk is None:
+        raise InvalidCursor("Invalid cursor")
+    return created_at, pk
+
+
+def _after_cursor(queryset, cursor: str | None):
+    queryset = queryset.order_by("-created_at", "-id")
+    if not cursor:
+        return queryset
+    created_at, pk = decode_cursor(cursor)
+    return queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+
+def keyset_page(queryset, *, cursor: str | None, limit: int) -> tuple[list[dict], str | None]:
+    """Return `(rows, next_cursor)`; `next_cursor` is None on the last page.
+
+    Raises InvalidCursor for a malformed cursor.
+    """
+
+    rows = list(_after_cursor(queryset, cursor).values()[: limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+
+
+def ndjson_response(queryset, *, cursor: str | None = None, chunk_size: int = STREAM_CHUNK_SIZE) -> StreamingHttpResponse:
+    """Stream all rows after `cursor` as newline-delimited JSON.
+
+    Raises InvalidCursor before the response starts.
+    """
+
+    rows = _after_cursor(queryset, cursor).values()
+
+    def _lines():
+        for row in rows.iterator(chunk_size=chunk_size):
+            yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
+
+    return StreamingHttpResponse(_lines(), content_type="application/x-ndjson")
@@ -0,0 +1,119 @@
+"""Sliding-window rate limiting on the shared Django cache.
+
+Each caller gets a counter per fixed window. The request is judged against a
+sliding estimate: the current window's count, plus the previous window's count
+weighted by how much of it still overlaps the last `window_seconds`. This
+removes the 2x burst a plain fixed window allows at window edges.
+
+Counting uses `cache.incr`, which is atomic on Redis (`REDIS_URL`). The default
+LocMemCache is per-process; it is what the tests use. Counting normally costs
+two cache operations per request: an incr of the current window and a get of the
+previous one. The first hit of a window adds an `add`. Resolving the caller reuses
+the cached Bearer token validation that `require_oauth2` does anyway.
+
+Callers are keyed by their bound business, else their OAuth client, else the
+staff user, else REMOTE_ADDR. Quotas are per scope: `RATE_LIMIT_SCOPE_QUOTAS`
+overrides `INTERNAL_RATE_LIMIT_REQUESTS` for views guarded by
+`require_oauth2(scopes=...)`.
+"""
+
+from __future__ import annotations
+
+import math
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+CACHE_PREFIX = "rl"
+
+
+@dataclass(frozen=True)
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_seconds: int
+
+    def headers(self) -> dict[str, str]:
+        return {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(self.reset_seconds),
+        }
+
+
+def hit(key: str, *, limit: int, window_seconds: int, now: float | None = None) -> RateLimitResult:
+    """Count one request for `key` and report whether it fits in the sliding window.
+
+    Raises whatever the cache backend raises; callers decide whether to fail open.
+    """
+
+    now = time.time() if now is None else now
+    bucket = int(now // window_seconds)
+    elapsed = (now % window_seconds) / window_seconds
+    current_key = f"{CACHE_PREFIX}:{key}:{bucket}"
+    previous_key = f"{CACHE_PREFIX}:{key}:{bucket - 1}"
+
+    try:
+        current = cache.incr(current_key)
+    except ValueError:
+        # First hit in this window; kept for two windows so the next one can weigh it.
+        if cache.add(current_key, 1, timeout=window_seconds * 2):
+            current = 1
+        else:
+            current = cache.incr(current_key)
+    previous = cache.get(previous_key) or 0
+
+    estimated = previous * (1 - elapsed) + current
+    reset_seconds = max(int(math.ceil(window_seconds - (now % window_seconds))), 1)
+    return RateLimitResult(
+        allowed=estimated <= limit,
+        limit=limit,
+        remaining=max(limit - int(math.ceil(estimated)), 0),
+        reset_seconds=reset_seconds,
+    )
+
+
+def scope_quotas() -> dict[str, int]:
+    raw = getattr(settings, "RATE_LIMIT_SCOPE_QUOTAS", None) or {}
+    quotas = {}
+    for scope, value in dict(raw).items():
+        try:
+            quotas[str(scope)] = int(value)
+        except (TypeError, ValueError):
+            continue
+    return quotas
+
+
+def quota_for(scopes, default: int) -> int:
+    """Tightest configured quota among `scopes`, or `default`."""
+
+    quotas = scope_quotas()
+    configured = [quotas[s] for s in scopes or [] if s in quotas]
+    return min(configured) if configured else default
+
+
+def caller_key(request) -> str:
+    """Stable identity for the caller: business, OAuth client, staff user, then IP."""
+
+    from services_common.auth import _get_bearer_token, _resolve_oauth2_token
+
+    bearer = _get_bearer_token(request)
+    if bearer:
+        token_obj, business = _resolve_oauth2_token(bearer)
+        if token_obj is not None:
+            if business is not None:
+                return f"business:{business.pk}"
+            app = getattr(token_obj, "application", None)
+            if app is not None:
+                return f"client:{app.client_id or app.pk}"
+
+    user = getattr(request, "user", None)
+    if user is not None and getattr(user, "is_authenticated", False):
+        return f"user:{user.pk}"
+
+    # Conservative default: REMOTE_ADDR only (avoids spoofing X-Forwarded-For).
+    return f"ip:{request.META.get('REMOTE_ADDR') or 'unknown'}"
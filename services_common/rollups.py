@@ -0,0 +1,250 @@
+"""Incrementally maintained daily transaction rollups.
+
+Callbacks that finalise a payment take a `*_contribution()` snapshot of the row
+before and after they change it and pass both to `record_change()`. Only the
+difference is applied to `DailyTransactionRollup`, so a repeated callback is a
+no-op and a status that flips (e.g. after reconciliation) moves the amount out
+again. The rollup row is written after the callback's transaction commits, so
+concurrent callbacks for the same day do not queue on its row lock while they
+hold their own payment rows.
+
+`rebuild_rollups()` (manage.py rebuild_transaction_rollups) recomputes the table
+from the raw payment tables with grouped SQL, for backfills and repairs. The
+`0015_backfill_daily_transaction_rollups` migration runs it once on upgrade.
+"""
+
+from __future__ import annotations
+
+import datetime
+import logging
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Cast, TruncDate
+from django.utils import timezone
+
+from business_api.models import MpesaShortcode
+from mpesa_api.models import DailyTransactionRollup, MpesaPayment
+
+
+logger = logging.getLogger(__name__)
+
+C2B_INCOMING = DailyTransactionRollup.DIRECTION_C2B_INCOMING
+B2C_OUTGOING = DailyTransactionRollup.DIRECTION_B2C_OUTGOING
+B2B_OUTGOING = DailyTransactionRollup.DIRECTION_B2B_OUTGOING
+
+# B2B USSD amounts are stored as text; only plain decimals are counted.
+NUMERIC_AMOUNT_REGEX = r"^[0-9]+(\.[0-9]+)?$"
+
+# MpesaShortcode id -> shortcode, so callbacks don't load the shortcode row each time.
+# Per process: other workers see a renamed shortcode after a restart (rebuild_rollups repairs).
+_shortcode_codes: dict = {}
+
+
+def _key(business_id, shortcode, product_type, direction: str, day: datetime.date) -> tuple:
+    return (business_id, str(shortcode or "").strip()[:20], str(product_type or "").strip()[:60], direction, day)
+
+
+def _amount(value) -> Decimal | None:
+    try:
+        amount = Decimal(str(value).strip()).quantize(Decimal("0.01"))
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+    return amount if amount.is_finite() else None
+
+
+def _day(created_at) -> datetime.date:
+    return timezone.localdate(created_at or timezone.now())
+
+
+def _shortcode_code(shortcode_id) -> str:
+    if not shortcode_id:
+        return ""
+    code = _shortcode_codes.get(shortcode_id)
+    if code is None:
+        code = MpesaShortcode.objects.filter(id=shortcode_id).values_list("shortcode", flat=True).first() or ""
+        _shortcode_codes[shortcode_id] = code
+    return code
+
+
+def forget_shortcode(shortcode_id) -> None:
+    """Drop a memoised shortcode (called when an MpesaShortcode is saved or deleted)."""
+
+    _shortcode_codes.pop(shortcode_id, None)
+
+
+def payment_contribution(payment):
+    """`(key, amount)` that a C2B/STK `MpesaPayment` adds to the rollup, or None."""
+
+    if (payment.status or "").lower() != "successful":
+        return None
+    amount = _amount(payment.amount or 0)
+    if amount is None:
+        return None
+    if MpesaPayment.shortcode.is_cached(payment):
+        shortcode = payment.shortcode.shortcode if payment.shortcode else ""
+    else:
+        shortcode = _shortcode_code(payment.shortcode_id)
+    return _key(payment.business_id, shortcode, payment.product_type, C2B_INCOMING, _day(payment.created_at)), amount
+
+
+def b2c_contribution(pr):
+    """`(key, amount)` that a `B2CPaymentRequest` adds to the rollup, or None."""
+
+    if pr.status != pr.STATUS_RESULT or pr.result_code != 0:
+        return None
+    amount = _amount(pr.amount) if pr.amount is not None else None
+    if amount is None:
+        return None
+    payload = pr.request_payload if isinstance(pr.request_payload, dict) else {}
+    return _key(pr.business_id, payload.get("PartyA"), pr.product_type, B2C_OUTGOING, _day(pr.created_at)), amount
+
+
+def b2b_contribution(req):
+    """`(key, amount)` that a `B2BUSSDPushRequest` adds to the rollup, or None."""
+
+    if req.status != req.STATUS_SUCCESS:
+        return None
+    amount = _amount(req.amount)
+    if amount is None:
+        return None
+    payload = req.request_payload if isinstance(req.request_payload, dict) else {}
+    return _key(req.business_id, payload.get("primaryShortCode"), req.product_type, B2B_OUTGOING, _day(req.created_at)), amount
+
+
+def _bump(key: tuple, amount: Decimal, count: int) -> None:
+    business_id, shortcode, product_type, direction, day = key
+    lookup = {
+        "business_id": business_id,
+        "shortcode": shortcode,
+        "product_type": product_type,
+        "direction": direction,
+        "day": day,
+    }
+    changes = {"amount": F("amount") + amount, "count": F("count") + count, "updated_at": timezone.now()}
+
+    if DailyTransactionRollup.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            DailyTransactionRollup.objects.create(**lookup, amount=amount, count=count)
+    except IntegrityError:
+        # Created concurrently by another callback.
+        DailyTransactionRollup.objects.filter(**lookup).update(**changes)
+
+
+def _apply_change(before, after) -> None:
+    try:
+        with transaction.atomic():
+            if before is not None:
+                _bump(before[0], -before[1], -1)
+            if after is not None:
+                _bump(after[0], after[1], 1)
+    except Exception:
+        logger.exception("Failed to update daily transaction rollup")
+
+
+def record_change(before, after) -> None:
+    """Apply the difference between two contributions (either may be None) once the caller commits.
+
+    Never raises: a failed rollup update must not fail the callback. Drift (also
+    from a crash between the commit and the rollup write) is repaired by
+    `rebuild_rollups()`.
+    """
+
+    if before == after:
+        return
+    transaction.on_commit(lambda: _apply_change(before, after))
+
+
+def _raw_sources(*, since: datetime.date | None, business_id):
+    """Yield `(direction, grouped queryset)` pairs computed from the raw payment tables.
+
+    Each queryset yields dicts with biz, sc (shortcode), pt (product type), day, total and n.
+    """
+
+    from b2b_api.models import B2BUSSDPushRequest, BulkBusinessPaymentItem
+    from b2c_api.models import B2CPaymentRequest, BulkPayoutItem
+
+    def _group(qs, *, business, shortcode, amount):
+        if since is not None:
+            qs = qs.filter(created_at__gte=timezone.make_aware(datetime.datetime.combine(since, datetime.time.min)))
+        if business_id is not None:
+            qs = qs.filter(**{business: business_id})
+        return (
+            qs.order_by()
+            .annotate(day=TruncDate("created_at"), sc=shortcode, pt=F("product_type"), biz=F(business))
+            .values("biz", "sc", "pt", "day")
+            .annotate(total=Sum(amount), n=Count("pk"))
+        )
+
+    yield C2B_INCOMING, _group(
+        MpesaPayment.objects.filter(status="successful"),
+        business="business",
+        shortcode=F("shortcode__shortcode"),
+        amount="amount",
+    )
+    yield B2C_OUTGOING, _group(
+        B2CPaymentRequest.objects.filter(status=B2CPaymentRequest.STATUS_RESULT, result_code=0, amount__isnull=False),
+        business="business",
+        shortcode=KeyTextTransform("PartyA", "request_payload"),
+        amount="amount",
+    )
+    # Bulk items submitted through a payment request are already counted above.
+    yield B2C_OUTGOING, _group(
+        BulkPayoutItem.objects.filter(status="completed", payment_requests__isnull=True),
+        business="batch__business",
+        shortcode=KeyTextTransform("party_a", "batch__meta"),
+        amount="amount",
+    )
+    yield B2B_OUTGOING, _group(
+        B2BUSSDPushRequest.objects.filter(status=B2BUSSDPushRequest.STATUS_SUCCESS, amount__regex=NUMERIC_AMOUNT_REGEX),
+        business="business",
+        shortcode=KeyTextTransform("primaryShortCode", "request_payload"),
+        amount=Cast("amount", output_field=DecimalField(max_digits=14, decimal_places=2)),
+    )
+    yield B2B_OUTGOING, _group(
+        BulkBusinessPaymentItem.objects.filter(status="completed", ussd_push_requests__isnull=True),
+        business="batch__business",
+        shortcode=KeyTextTransform("primary_short_code", "batch__meta"),
+        amount="amount",
+    )
+
+
+def rebuild_rollups(*, since: datetime.date | None = None, business_id=None, batch_size: int = 1000) -> int:
+    """Recompute rollup rows (from `since`, optionally for one business). Returns rows written."""
+
+    totals: dict[tuple, list] = {}
+    for direction, rows in _raw_sources(since=since, business_id=business_id):
+        for row in rows.iterator():
+            if row["day"] is None:
+                continue
+            key = _key(row["biz"], row["sc"], row["pt"], direction, row["day"])
+            bucket = totals.setdefault(key, [Decimal("0"), 0])
+            bucket[0] += _amount(row["total"] or 0) or Decimal("0")
+            bucket[1] += row["n"]
+
+    stale = DailyTransactionRollup.objects.all()
+    if since is not None:
+        stale = stale.filter(day__gte=since)
+    if business_id is not None:
+        stale = stale.filter(business_id=business_id)
+
+    objs = [
+        DailyTransactionRollup(
+            business_id=business,
+            shortcode=shortcode,
+            product_type=product_type,
+            direction=direction,
+            day=day,
+            amount=amount,
+            count=count,
+        )
+        for (business, shortcode, product_type, direction, day), (amount, count) in totals.items()
+    ]
+    with transaction.atomic():
+        stale.delete()
+        DailyTransactionRollup.objects.bulk_create(objs, batch_size=batch_size)
+    return len(objs)
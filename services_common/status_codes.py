@@ -1,14 +1,32 @@
 from __future__ import annotations
 
+import threading
+import uuid
 from dataclasses import dataclass
 
 from django.apps import apps
+from django.core.cache import cache
 
-from django.db import transaction
-from django.db.utils import IntegrityError
-from django.db.models import Max
+from django.db import connection, transaction
+from django.db.models import F, Max
 
 
+# Cross-worker version of the mapping table. Any save/delete bumps it, and every
+# process reloads its snapshot the next time it sees a different value.
+MAPPING_VERSION_CACHE_KEY = "status_codes:mapping_version"
+
+# Per-process snapshot: {(external_system, external_code): (internal_code, default_message)}
+_snapshot_rows: dict[tuple[str, str], tuple[int, str]] | None = None
+_snapshot_version: str | None = None
+_snapshot_lock = threading.Lock()
+
+# PostgreSQL sequence created by status_codes migration 0003.
+INTERNAL_CODE_SEQUENCE = "status_codes_internal_code_seq"
+
+# How many times a new mapping is retried when its allocated internal code is
+# already taken (e.g. a row was added by hand with an explicit internal_code).
+_MAX_ALLOCATION_ATTEMPTS = 3
+
 
 def _get_status_code_mapping_model():
     # Lazily resolve the model via the Django app registry.
@@ -17,6 +35,118 @@ def _get_status_code_mapping_model():
     return apps.get_model("status_codes", "StatusCodeMapping")
 
 
+def allocate_internal_code() -> int:
+    """Reserve the next internal code without locking the mapping table.
+
+    PostgreSQL uses a sequence (`nextval` is non-transactional, so concurrent
+    callers never wait on each other). Other databases bump a single counter row.
+    Codes are increasing but may have gaps (e.g. when two workers race to map the
+    same external code and one allocation is discarded).
+    """
+
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(%s)", [INTERNAL_CODE_SEQUENCE])
+            return int(cursor.fetchone()[0])
+
+    StatusCodeCounter = apps.get_model("status_codes", "StatusCodeCounter")
+    with transaction.atomic():
+        bumped = StatusCodeCounter.objects.filter(name=StatusCodeCounter.INTERNAL_CODE).update(value=F("value") + 1)
+        if not bumped:
+            StatusCodeMapping = _get_status_code_mapping_model()
+            current_max = StatusCodeMapping.objects.aggregate(m=Max("internal_code")).get("m") or 0
+            StatusCodeCounter.objects.get_or_create(
+                name=StatusCodeCounter.INTERNAL_CODE,
+                defaults={"value": int(current_max)},
+            )
+            StatusCodeCounter.objects.filter(name=StatusCodeCounter.INTERNAL_CODE).update(value=F("value") + 1)
+        return int(
+            StatusCodeCounter.objects.filter(name=StatusCodeCounter.INTERNAL_CODE)
+            .values_list("value", flat=True)
+            .get()
+        )
+
+
+def sync_internal_code_allocator() -> None:
+    """Move the allocator past the highest internal code in use.
+
+    Needed after internal codes are assigned explicitly (seed --reset, admin edits).
+    Never moves the allocator backwards.
+    """
+
+    StatusCodeMapping = _get_status_code_mapping_model()
+    current_max = int(StatusCodeMapping.objects.aggregate(m=Max("internal_code")).get("m") or 0)
+
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT setval(%s, GREATEST(%s, (SELECT last_value FROM " + INTERNAL_CODE_SEQUENCE + ")), true)",
+                [INTERNAL_CODE_SEQUENCE, max(current_max, 1)],
+            )
+        return
+
+    StatusCodeCounter = apps.get_model("status_codes", "StatusCodeCounter")
+    _, created = StatusCodeCounter.objects.get_or_create(
+        name=StatusCodeCounter.INTERNAL_CODE,
+        defaults={"value": current_max},
+    )
+    if not created:
+        StatusCodeCounter.objects.filter(name=StatusCodeCounter.INTERNAL_CODE, value__lt=current_max).update(value=current_max)
+
+
+def _current_version() -> str | None:
+    try:
+        version = cache.get(MAPPING_VERSION_CACHE_KEY)
+        if version is None:
+            cache.add(MAPPING_VERSION_CACHE_KEY, uuid.uuid4().hex, timeout=None)
+            version = cache.get(MAPPING_VERSION_CACHE_KEY)
+        return version
+    except Exception:
+        # Without a usable cache we cannot tell when other workers change the
+        # table, so do not trust the snapshot at all.
+        return None
+
+
+def _get_snapshot() -> dict[tuple[str, str], tuple[int, str]] | None:
+    """Return the whole mapping table, reloading it only when the version changes."""
+
+    global _snapshot_rows, _snapshot_version
+
+    version = _current_version()
+    if version is None:
+        return None
+    if _snapshot_rows is not None and _snapshot_version == version:
+        return _snapshot_rows
+
+    with _snapshot_lock:
+        if _snapshot_rows is not None and _snapshot_version == version:
+            return _snapshot_rows
+        StatusCodeMapping = _get_status_code_mapping_model()
+        rows = {
+            (system, code): (int(internal), message or "")
+            for system, code, internal, message in StatusCodeMapping.objects.values_list(
+                "external_system", "external_code", "internal_code", "default_message"
+            )
+        }
+        _snapshot_rows = rows
+        _snapshot_version = version
+        return rows
+
+
+def invalidate_status_code_cache() -> None:
+    """Drop this process's snapshot and force every worker to reload."""
+
+    global _snapshot_rows, _snapshot_version
+
+    with _snapshot_lock:
+        _snapshot_rows = None
+        _snapshot_version = None
+    try:
+        cache.set(MAPPING_VERSION_CACHE_KEY, uuid.uuid4().hex, timeout=None)
+    except Exception:
+        pass
+
+
 @dataclass(frozen=True)
 class MappedStatus:
     status_code: int
@@ -46,7 +176,7 @@ def map_status(
 ) -> MappedStatus:
     """Get or create a mapping from (external_system, external_code) -> internal status.
 
-    Internal codes are auto-assigned sequentially starting at 0.
+    Internal codes are assigned by `allocate_internal_code()`; Safaricom success is always 0.
 
     Message resolution order:
     1) mapping.default_message (if set)
@@ -65,74 +195,77 @@ def map_status(
         external_system = StatusCodeMapping.SYSTEM_GATEWAY
         code = "UNKNOWN"
 
-    # Fast path.
-    existing = StatusCodeMapping.objects.filter(external_system=external_system, external_code=code).first()
-    if existing:
-        resolved_msg = (existing.default_message or "").strip() or (default_message or "").strip() or msg
+    # Fast path: in-memory snapshot, no queries.
+    snapshot = _get_snapshot()
+    cached = snapshot.get((external_system, code)) if snapshot is not None else None
+    if cached is not None:
+        internal_code, cached_message = cached
+        resolved_msg = cached_message.strip() or (default_message or "").strip() or msg
         return MappedStatus(
-            status_code=int(existing.internal_code),
+            status_code=internal_code,
             status_message=resolved_msg,
             external_system=external_system,
             external_code=code,
         )
 
-    # Create path (race-safe).
-    with transaction.atomic():
+    # Create path: allocate a code, then INSERT ... ON CONFLICT DO NOTHING and
+    # re-read. No table lock; a concurrent insert of the same external code wins
+    # and we simply return its row.
+    is_success = external_system == StatusCodeMapping.SYSTEM_SAFARICOM and code == "0"
+    resolved_msg = (default_message or "").strip() or msg
+    if is_success and not resolved_msg:
+        resolved_msg = "Success"
+
+    if not is_success:
         # Ensure internal code 0 is reserved for Safaricom success.
         # This prevents the first-ever seen non-zero external code from taking internal code 0.
-        if not StatusCodeMapping.objects.filter(internal_code=0).exists():
-            try:
-                StatusCodeMapping.objects.create(
-                    external_system=StatusCodeMapping.SYSTEM_SAFARICOM,
-                    external_code="0",
-                    internal_code=0,
-                    default_message="Success",
-                    is_success=True,
-                )
-            except IntegrityError:
-                # Another concurrent request may have created it (or internal 0 is already taken).
-                pass
-
-        # Re-check under lock.
-        existing = (
-            StatusCodeMapping.objects.select_for_update()
-            .filter(external_system=external_system, external_code=code)
-            .first()
-        )
-        if existing:
-            resolved_msg = (existing.default_message or "").strip() or (default_message or "").strip() or msg
-            return MappedStatus(
-                status_code=int(existing.internal_code),
-                status_message=resolved_msg,
-                external_system=external_system,
-                external_code=code,
+        has_internal_zero = snapshot is not None and any(v[0] == 0 for v in snapshot.values())
+        if not has_internal_zero:
+            StatusCodeMapping.objects.bulk_create(
+                [
+                    StatusCodeMapping(
+                        external_system=StatusCodeMapping.SYSTEM_SAFARICOM,
+                        external_code="0",
+                        internal_code=0,
+                        default_message="Success",
+                        is_success=True,
+                    )
+                ],
+                ignore_conflicts=True,
             )
 
-        if external_system == StatusCodeMapping.SYSTEM_SAFARICOM and code == "0":
-            next_internal = 0
-        else:
-            max_code = StatusCodeMapping.objects.select_for_update().aggregate(m=Max("internal_code")).get("m")
-            next_internal = int(max_code or 0) + 1
+    existing = None
+    for attempt in range(_MAX_ALLOCATION_ATTEMPTS):
+        StatusCodeMapping.objects.bulk_create(
+            [
+                StatusCodeMapping(
+                    external_system=external_system,
+                    external_code=code,
+                    internal_code=0 if is_success else allocate_internal_code(),
+                    default_message=resolved_msg if resolved_msg else "",
+                    is_success=is_success,
+                )
+            ],
+            ignore_conflicts=True,
+        )
+        existing = StatusCodeMapping.objects.filter(external_system=external_system, external_code=code).first()
+        if existing is not None or is_success:
+            break
+        # Our internal code was already taken by a row the allocator did not know about.
+        sync_internal_code_allocator()
 
-        is_success = external_system == StatusCodeMapping.SYSTEM_SAFARICOM and code == "0"
-        resolved_msg = (default_message or "").strip() or msg
-        if is_success and not resolved_msg:
-            resolved_msg = "Success"
+    if existing is None:
+        raise RuntimeError(f"Could not allocate an internal status code for {external_system}:{code}")
 
-        created = StatusCodeMapping.objects.create(
-            external_system=external_system,
-            external_code=code,
-            internal_code=next_internal,
-            default_message=resolved_msg if resolved_msg else "",
-            is_success=is_success,
-        )
+    # bulk_create does not send post_save, so publish the new row ourselves.
+    transaction.on_commit(invalidate_status_code_cache)
 
-        return MappedStatus(
-            status_code=int(created.internal_code),
-            status_message=(created.default_message or "").strip() or msg,
-            external_system=external_system,
-            external_code=code,
-        )
+    return MappedStatus(
+        status_code=int(existing.internal_code),
+        status_message=(existing.default_message or "").strip() or (default_message or "").strip() or msg,
+        external_system=external_system,
+        external_code=code,
+    )
 
 
 def map_safaricom_status(*, code, message=None) -> MappedStatus:
@@ -2,6 +2,8 @@ import uuid
 
 from django.http import JsonResponse
 
+from services_common.auth import get_bound_business
+
 
 def _uuid_or_none(value) -> uuid.UUID | None:
     if value in (None, ""):
@@ -47,25 +49,20 @@ def resolve_business_from_request(request, provided_business_id):
         if app is not None:
             from business_api.models import OAuthClientBusiness
 
-            binding = (
-                OAuthClientBusiness.objects.select_related("business")
-                .filter(application=app)
-                .first()
-            )
-            if binding and binding.business_id != business.id:
+            bound = get_bound_business(request)
+            if bound and bound.id != business.id:
                 return None, JsonResponse({"error": "Client is not allowed to access this business"}, status=403)
-            if not binding:
+            if not bound:
                 OAuthClientBusiness.objects.create(application=app, business=business)
+                setattr(request, "oauth2_business", business)
 
         return business, None
 
     # No explicit business_id: try derive from OAuth2 client binding.
     if app is not None:
-        from business_api.models import OAuthClientBusiness
-
-        binding = OAuthClientBusiness.objects.select_related("business").filter(application=app).first()
-        if binding:
-            return binding.business, None
+        bound = get_bound_business(request)
+        if bound:
+            return bound, None
 
     return None, JsonResponse(
         {"error": "business_id is required (or bind your OAuth client to a business)"},
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class StatusCodesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "status_codes"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -6,6 +6,7 @@ from dataclasses import dataclass
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
+from services_common.status_codes import allocate_internal_code, sync_internal_code_allocator
 from status_codes.models import StatusCodeMapping
 
 
@@ -147,16 +148,16 @@ class Command(BaseCommand):
                         updated += 1
                     continue
 
-                # Allocate next internal code (append after current max).
-                max_code = StatusCodeMapping.objects.order_by("-internal_code").values_list("internal_code", flat=True).first()
-                next_internal = int(max_code or 0) + 1
                 StatusCodeMapping.objects.create(
                     external_system=StatusCodeMapping.SYSTEM_SAFARICOM,
                     external_code=code,
-                    internal_code=next_internal,
+                    internal_code=allocate_internal_code(),
                     default_message=r.default_message or "",
                     is_success=bool(r.is_success),
                 )
                 created += 1
 
+        # Internal codes above may have been assigned explicitly; keep the allocator ahead of them.
+        sync_internal_code_allocator()
+
         self.stdout.write(f"Seeded safaricom mappings. created={created}, updated={updated}")
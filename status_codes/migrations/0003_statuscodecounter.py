@@ -0,0 +1,43 @@
+from django.db import migrations, models
+from django.db.models import Max
+
+
+INTERNAL_CODE_SEQUENCE = "status_codes_internal_code_seq"
+
+
+def create_internal_code_allocator(apps, schema_editor):
+    StatusCodeMapping = apps.get_model("status_codes", "StatusCodeMapping")
+    StatusCodeCounter = apps.get_model("status_codes", "StatusCodeCounter")
+
+    current_max = StatusCodeMapping.objects.aggregate(m=Max("internal_code")).get("m") or 0
+
+    if schema_editor.connection.vendor == "postgresql":
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {INTERNAL_CODE_SEQUENCE} MINVALUE 1")
+            cursor.execute("SELECT setval(%s, %s, false)", [INTERNAL_CODE_SEQUENCE, int(current_max) + 1])
+        return
+
+    StatusCodeCounter.objects.update_or_create(name="internal_code", defaults={"value": int(current_max)})
+
+
+def drop_internal_code_allocator(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f"DROP SEQUENCE IF EXISTS {INTERNAL_CODE_SEQUENCE}")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("status_codes", "0002_seed_success_mapping"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StatusCodeCounter",
+            fields=[
+                ("name", models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ("value", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_internal_code_allocator, drop_internal_code_allocator),
+    ]
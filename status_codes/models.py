@@ -42,3 +42,19 @@ class StatusCodeMapping(models.Model):
 
     def __str__(self) -> str:
         return f"{self.external_system}:{self.external_code} -> {self.internal_code}"
+
+
+class StatusCodeCounter(models.Model):
+    """Counter row used to allocate `StatusCodeMapping.internal_code` values.
+
+    PostgreSQL uses the `status_codes_internal_code_seq` sequence instead; this
+    row backs the allocator on other databases (e.g. SQLite in development).
+    """
+
+    INTERNAL_CODE = "internal_code"
+
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.PositiveIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f"{self.name}={self.value}"
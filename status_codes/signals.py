@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from services_common.status_codes import invalidate_status_code_cache
+
+from .models import StatusCodeMapping
+
+
+@receiver(post_save, sender=StatusCodeMapping)
+@receiver(post_delete, sender=StatusCodeMapping)
+def _invalidate_status_code_cache(sender, **kwargs):
+    # Bump once the change is visible to other workers' connections.
+    transaction.on_commit(invalidate_status_code_cache)